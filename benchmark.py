@@ -0,0 +1,318 @@
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import StringIO
+
+import pandas as pd
+
+import clawer_dividend as cd
+import clawer_monthly_revenue as cmr
+import clawer_daily_quotes as cdq
+import clawer_quarterly_balance as cqb
+import clawer_quarterly_income as cqi
+import storage
+
+# ======= 設定區 =======
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURE_DIR = os.path.join(BASE_DIR, "bench_fixtures")
+RESULT_DIR = os.path.join(BASE_DIR, "bench_results")
+
+SCALES = [1, 10, 100]       # 資料量倍數（以 fixture 的列數為 1×）
+REPEAT = 5                  # 每個項目跑幾次
+REGRESSION_THRESHOLD = 0.2  # 和基準比較時，最快一次慢超過 20% 視為退步
+STOCK_NO = "2330"
+
+FIXTURES = {
+    "stock_day": "twse_stock_day_2330_202509.json",
+    "dividend": "cmoney_dividend_2330.html",
+    "revenue": "cmoney_revenue_2330.html",
+    "assets": "cmoney_balance_assets_2330.html",
+    "liabilities": "cmoney_balance_liabilities_2330.html",
+    "equity": "cmoney_balance_equity_2330.html",
+    "income": "cmoney_income_2330.html",
+    "eps": "cmoney_eps_2330.html",
+}
+
+
+def _read_fixture(name) -> str:
+    with open(os.path.join(FIXTURE_DIR, FIXTURES[name]), encoding="utf-8") as f:
+        return f.read()
+
+
+# ======= 放大資料量：把 fixture 的資料列複製 scale 份，每份往前挪期別，key 不重複 =======
+
+_ROW_RE = re.compile(r"<tr>(.*?)</tr>", re.S)
+_CELL_RE = re.compile(r"<td>(.*?)</td>", re.S)
+
+
+def _shift_year(text: str, years: int) -> str:
+    # "2025/09"、"2025/Q3"、"2025合計" → 年份往前挪
+    return re.sub(r"^(\d{4})", lambda m: str(int(m.group(1)) - years), text)
+
+
+def _shift_date(text: str, days: int) -> str:
+    # "2025/06/12" → 往前挪幾天；"-" 之類的照舊
+    if not re.fullmatch(r"\d{4}/\d{2}/\d{2}", text):
+        return text
+    return (datetime.strptime(text, "%Y/%m/%d") - timedelta(days=days)).strftime("%Y/%m/%d")
+
+
+def _span_years(cells_list) -> int:
+    years = {int(cells[0][:4]) for cells in cells_list if re.match(r"\d{4}", cells[0])}
+    return max(years) - min(years) + 1
+
+
+def scale_table_html(html: str, scale: int, by: str = "year") -> str:
+    head, rest = html.split("<tbody>", 1)
+    body, tail = rest.split("</tbody>", 1)
+    rows = [_CELL_RE.findall(r) for r in _ROW_RE.findall(body)]
+    span = _span_years(rows)
+
+    out = []
+    for k in range(scale):
+        for cells in rows:
+            if by == "year":
+                cells = [_shift_year(cells[0], k * span)] + cells[1:]
+            else:
+                cells = [_shift_date(c, k) for c in cells]
+            out.append("<tr>" + "".join(f"<td>{c}</td>" for c in cells) + "</tr>")
+    return f"{head}<tbody>{''.join(out)}</tbody>{tail}"
+
+
+def scale_stock_day_json(text: str, scale: int) -> str:
+    data = json.loads(text)
+    rows = []
+    for k in range(scale):
+        for row in data["data"]:
+            y, m, d = row[0].split("/")
+            rows.append([f"{int(y) - k}/{m}/{d}"] + row[1:])
+    data["data"] = rows
+    data["total"] = len(rows)
+    return json.dumps(data, ensure_ascii=False)
+
+
+# ======= 寫入目標：暫存目錄裡的 SQLite（storage 的本機 backend），不需要 SQL Server =======
+
+@contextmanager
+def local_db():
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = storage.configure("sqlite", os.path.join(tmp, "bench.sqlite3"))
+        try:
+            yield backend
+        finally:
+            storage.close()
+
+
+# 每次寫入前清空資料表（不計時），量到的都是「全部新增」的情況
+def _fresh(backend, table, *args):
+    conn = backend.connect()
+    conn.execute(f"DELETE FROM {table}")
+    conn.commit()
+    return args
+
+
+# ======= 計時 =======
+
+# setup() 產生這一次的輸入（不計時），run(*args) 才計時；回傳 (各次秒數, 筆數)
+def _time(run, setup, repeat):
+    timings, rows = [], 0
+    for _ in range(repeat):
+        args = setup()
+        started = time.perf_counter()
+        result = run(*args)
+        timings.append(time.perf_counter() - started)
+        rows = _count_rows(result)
+    return timings, rows
+
+
+def _count_rows(result):
+    if isinstance(result, pd.DataFrame):
+        return len(result)
+    if isinstance(result, dict) and "data" in result:
+        return len(result["data"])
+    if isinstance(result, tuple) and result and isinstance(result[0], pd.DataFrame):
+        return len(result[0])
+    if isinstance(result, tuple) and len(result) == 2 and all(isinstance(x, int) for x in result):
+        return sum(result)
+    return 0
+
+
+def _record(stage, dataset, scale, timings, rows):
+    return {
+        "stage": stage,
+        "dataset": dataset,
+        "scale": scale,
+        "rows": rows,
+        "repeat": len(timings),
+        "min_ms": round(min(timings) * 1000, 3),
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "mean_ms": round(statistics.mean(timings) * 1000, 3),
+    }
+
+
+# ======= 各資料集的 parse / transform / write =======
+
+ALL_YEARS = ((1, 1), (9999, 12))
+
+
+def _parse_table(module, html):
+    return module.flatten_columns(pd.read_html(StringIO(html))[0])
+
+
+# 每個資料集回傳 [(stage, run, setup), ...]，輸入都先依 scale 準備好
+def _cases(scale, backend):
+    stock_day = scale_stock_day_json(_read_fixture("stock_day"), scale)
+    stock_day_json = json.loads(stock_day)
+    stock_day_df = cdq.transform_twse_stock_day_json(stock_day_json)
+
+    dividend = scale_table_html(_read_fixture("dividend"), scale, by="date")
+    dividend_raw = _parse_table(cd, dividend)
+    dividend_df = cd.transform_dividend_df(dividend_raw)
+
+    revenue = scale_table_html(_read_fixture("revenue"), scale)
+    revenue_raw = _parse_table(cmr, revenue)
+    revenue_df = cmr.transform_monthly_df(revenue_raw.copy(), *ALL_YEARS)
+
+    balance = {name: scale_table_html(_read_fixture(name), scale)
+               for name in ("assets", "liabilities", "equity")}
+    balance_raw = cqb.parse_quarterly_balance_html(balance)
+    balance_df = cqb.build_quarterly_balance_df(*[df.copy() for df in balance_raw], *ALL_YEARS)
+
+    income = {name: scale_table_html(_read_fixture(name), scale) for name in ("income", "eps")}
+    income_raw = cqi.parse_quarterly_income_html(income)
+    income_df = cqi.build_quarterly_income_df(*income_raw)
+
+    return {
+        "stock_day": [
+            ("parse", json.loads, lambda: (stock_day,)),
+            ("transform", cdq.transform_twse_stock_day_json, lambda: (stock_day_json,)),
+            ("write", cdq.insert_daily_quotes_to_db,
+             lambda: _fresh(backend, "stock_daily_quotes", STOCK_NO, stock_day_df)),
+        ],
+        "dividend": [
+            ("parse", lambda html: _parse_table(cd, html), lambda: (dividend,)),
+            ("transform", cd.transform_dividend_df, lambda: (dividend_raw.copy(),)),
+            ("write", cd.insert_dividend_to_db,
+             lambda: _fresh(backend, "stock_dividend", STOCK_NO, dividend_df)),
+        ],
+        "revenue": [
+            ("parse", lambda html: _parse_table(cmr, html), lambda: (revenue,)),
+            ("transform", cmr.transform_monthly_df, lambda: (revenue_raw.copy(), *ALL_YEARS)),
+            ("write", cmr.insert_monthly_to_db,
+             lambda: _fresh(backend, "stock_monthly_revenue", STOCK_NO, revenue_df)),
+        ],
+        "balance-sheet": [
+            ("parse", cqb.parse_quarterly_balance_html, lambda: (balance,)),
+            ("transform", cqb.build_quarterly_balance_df,
+             lambda: (*[df.copy() for df in balance_raw], *ALL_YEARS)),
+            ("write", cqb.insert_quarterly_balance_to_db,
+             lambda: _fresh(backend, "stock_quarterly_balance", STOCK_NO, balance_df)),
+        ],
+        "income-statement": [
+            ("parse", cqi.parse_quarterly_income_html, lambda: (income,)),
+            ("transform", cqi.build_quarterly_income_df, lambda: tuple(df.copy() for df in income_raw)),
+            ("write", cqi.insert_quarterly_income_to_db,
+             lambda: _fresh(backend, "stock_quarterly_income", STOCK_NO, income_df)),
+        ],
+    }
+
+
+def run_benchmarks(scales=SCALES, repeat=REPEAT) -> list:
+    results = []
+    with local_db() as backend:
+        for scale in scales:
+            for dataset, cases in _cases(scale, backend).items():
+                for stage, run, setup in cases:
+                    timings, rows = _time(run, setup, repeat)
+                    results.append(_record(stage, dataset, scale, timings, rows))
+    return results
+
+
+# ======= 結果輸出與比較 =======
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def build_report(results) -> dict:
+    return {
+        "meta": {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+
+
+def write_report(report, path=None) -> str:
+    if path is None:
+        os.makedirs(RESULT_DIR, exist_ok=True)
+        path = os.path.join(RESULT_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def print_results(results):
+    print(f"{'stage':<10}{'dataset':<18}{'scale':>6}{'rows':>8}{'median ms':>12}{'min ms':>10}")
+    for r in results:
+        print(f"{r['stage']:<10}{r['dataset']:<18}{r['scale']:>6}{r['rows']:>8}"
+              f"{r['median_ms']:>12.3f}{r['min_ms']:>10.3f}")
+
+
+# 和之前存的結果比最快一次（比中位數不受雜訊影響），回傳變慢超過門檻的項目
+def compare(results, baseline_path, threshold=REGRESSION_THRESHOLD) -> list:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["stage"], r["dataset"], r["scale"]): r for r in json.load(f)["results"]}
+
+    regressions = []
+    for r in results:
+        base = baseline.get((r["stage"], r["dataset"], r["scale"]))
+        if base is None or base["min_ms"] <= 0:
+            continue
+        ratio = r["min_ms"] / base["min_ms"]
+        if ratio > 1 + threshold:
+            regressions.append({**r, "baseline_min_ms": base["min_ms"], "ratio": round(ratio, 3)})
+            print(f"⚠️ {r['stage']} {r['dataset']} {r['scale']}×：{base['min_ms']:.3f}ms → "
+                  f"{r['min_ms']:.3f}ms（{ratio:.2f} 倍）")
+    if not regressions:
+        print(f"✅ 和 {baseline_path} 相比沒有超過 {threshold:.0%} 的退步")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="離線量測 parse / transform / write 各階段的耗時")
+    parser.add_argument("--scales", type=int, nargs="+", default=SCALES, help="資料量倍數")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="每個項目跑幾次")
+    parser.add_argument("--output", help="結果 JSON 路徑，預設寫到 bench_results/")
+    parser.add_argument("--compare", help="拿來比較的舊結果 JSON")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="最快一次慢超過這個比例就算退步")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmarks(args.scales, args.repeat)
+    print_results(results)
+    path = write_report(build_report(results), args.output)
+    print(f"✅ 結果已寫入 {path}")
+    if args.compare and compare(results, args.compare, args.threshold):
+        raise SystemExit(1)
@@ -0,0 +1,167 @@
+import argparse
+import statistics
+import threading
+import time
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+# ======= 設定區 =======
+
+LEAN = True   # False = 原本的 Chrome（什麼都下載），給比較用
+
+# 只讀表格，不需要 GPU、擴充功能、背景連線
+LEAN_ARGS = [
+    "--headless=new",
+    "--disable-gpu",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-notifications",
+    "--no-first-run",
+    "--mute-audio",
+    "--blink-settings=imagesEnabled=false",
+]
+LEAN_PREFS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.default_content_setting_values.notifications": 2,
+}
+
+# 用 CDP Network.setBlockedURLs 擋掉的請求：圖片、字型、影音，以及廣告 / 追蹤的第三方網域
+BLOCKED_URLS = [
+    "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot",
+    "*.mp4", "*.webm", "*.mp3",
+    "*googletagmanager.com*", "*google-analytics.com*", "*analytics.google.com*",
+    "*doubleclick.net*", "*googlesyndication.com*", "*googleadservices.com*", "*adservice.google.*",
+    "*facebook.net*", "*facebook.com/tr*", "*connect.facebook.net*",
+    "*scorecardresearch.com*", "*hotjar.com*", "*clarity.ms*", "*criteo.*", "*taboola.com*",
+    "*outbrain.com*", "*yahoo.com/*ads*", "*line-scdn.net*", "*fonts.googleapis.com*", "*fonts.gstatic.com*",
+]
+
+# 比較用：等這個元素出現才算頁面可以用（股利表格）
+COMPARE_URL = "https://www.cmoney.tw/forum/stock/2330?s=dividend"
+COMPARE_XPATH = '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/section[2]/div[3]'
+COMPARE_REPEAT = 3
+
+# 每頁下載量與時間（Performance API）：{"pages", "bytes", "requests", "ms"}
+_stats = {"pages": 0, "bytes": 0, "requests": 0, "ms": 0.0}
+_lock = threading.Lock()
+
+
+def chrome_options(lean=None) -> Options:
+    lean = LEAN if lean is None else lean
+    options = Options()
+    if not lean:
+        options.add_argument("--headless")
+        return options
+    for arg in LEAN_ARGS:
+        options.add_argument(arg)
+    options.add_experimental_option("prefs", LEAN_PREFS)
+    # DOMContentLoaded 就回傳，不等圖片、廣告載完；表格由 page_wait 等
+    options.page_load_strategy = "eager"
+    return options
+
+
+# 開啟 request 攔截（每個 driver 一次）
+def apply_blocking(driver):
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+
+
+def create_driver(lean=None, page_load_timeout=None):
+    lean = LEAN if lean is None else lean
+    driver = webdriver.Chrome(service=Service(), options=chrome_options(lean))
+    if page_load_timeout:
+        driver.set_page_load_timeout(page_load_timeout)
+    if lean:
+        apply_blocking(driver)
+    return driver
+
+
+_METRICS_JS = """
+const nav = performance.getEntriesByType('navigation')[0];
+const res = performance.getEntriesByType('resource');
+let bytes = nav ? nav.transferSize : 0;
+for (const r of res) bytes += r.transferSize || 0;
+return {bytes: bytes, requests: res.length + 1,
+        ms: nav ? nav.domContentLoadedEventEnd - nav.startTime : 0};
+"""
+
+
+# 目前這頁到現在為止下載了多少（bytes、請求數）、DOMContentLoaded 花多久
+def page_metrics(driver) -> dict:
+    try:
+        return driver.execute_script(_METRICS_JS)
+    except Exception:
+        return None
+
+
+def record_page(metrics):
+    if not metrics:
+        return
+    with _lock:
+        _stats["pages"] += 1
+        _stats["bytes"] += metrics["bytes"]
+        _stats["requests"] += metrics["requests"]
+        _stats["ms"] += metrics["ms"]
+
+
+def page_summary() -> dict:
+    with _lock:
+        return dict(_stats)
+
+
+def print_page_summary():
+    s = page_summary()
+    if not s["pages"]:
+        return
+    n = s["pages"]
+    print(f"🧭 瀏覽器（{'精簡' if LEAN else '完整'}設定）：{n} 頁，平均每頁 {s['bytes'] / n / 1024:.0f} KB、"
+          f"{s['requests'] / n:.0f} 個請求、DOMContentLoaded {s['ms'] / n:.0f} ms")
+
+
+# ======= 比較：同一頁用完整 / 精簡設定各載入幾次 =======
+
+def _measure(lean, url, xpath, repeat):
+    driver = create_driver(lean)
+    runs = []
+    try:
+        for _ in range(repeat):
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+            started = time.perf_counter()
+            driver.get(url)
+            WebDriverWait(driver, 60).until(EC.presence_of_element_located((By.XPATH, xpath)))
+            ms = (time.perf_counter() - started) * 1000
+            # 表格出來後再給一點時間，讓還在下載的資源也算進去
+            time.sleep(1)
+            metrics = page_metrics(driver) or {"bytes": 0, "requests": 0}
+            runs.append({"ms": ms, "bytes": metrics["bytes"], "requests": metrics["requests"]})
+    finally:
+        driver.quit()
+    return {key: statistics.median(r[key] for r in runs) for key in ("ms", "bytes", "requests")}
+
+
+def compare(url=COMPARE_URL, xpath=COMPARE_XPATH, repeat=COMPARE_REPEAT) -> dict:
+    full = _measure(False, url, xpath, repeat)
+    lean = _measure(True, url, xpath, repeat)
+    print(f"{'':<6}{'表格出現(ms)':>14}{'下載(KB)':>12}{'請求數':>8}")
+    for name, m in (("完整", full), ("精簡", lean)):
+        print(f"{name:<6}{m['ms']:>14.0f}{m['bytes'] / 1024:>12.0f}{m['requests']:>8.0f}")
+    print(f"每頁省下 {full['ms'] - lean['ms']:.0f} ms、{(full['bytes'] - lean['bytes']) / 1024:.0f} KB、"
+          f"{full['requests'] - lean['requests']:.0f} 個請求")
+    return {"full": full, "lean": lean}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較完整 / 精簡 Chrome 設定載入同一頁的時間與下載量")
+    parser.add_argument("--url", default=COMPARE_URL)
+    parser.add_argument("--xpath", default=COMPARE_XPATH, help="等這個元素出現才算載入完成")
+    parser.add_argument("--repeat", type=int, default=COMPARE_REPEAT)
+    args = parser.parse_args()
+    compare(args.url, args.xpath, args.repeat)
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+import time
+
+import aiohttp
+import requests
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+import host_limit
+
+# ======= 設定區 =======
+
+FAILURE_THRESHOLD = 5       # 連續幾支股票因為頁面結構失敗就跳開
+COOLDOWN_SECONDS = 15 * 60  # 跳開後多久再放一支股票進去試
+# 每個資料集的來源，同一個 (來源, 資料集) 共用一個 breaker
+DATASET_SOURCES = {
+    "dividend": "cmoney",
+    "monthly_revenue": "cmoney",
+    "quarterly_balance": "cmoney",
+    "quarterly_income": "cmoney",
+    "daily_quotes": "twse",
+}
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+# 頁面結構變了才會出現的錯誤：元素等不到 / 找不到、表格或欄位不見（read_html、欄位改名）
+# 網路、限流這類錯誤不算，交給 host_limit 和重試處理
+def is_structural(ex) -> bool:
+    if isinstance(ex, (requests.RequestException, aiohttp.ClientError, asyncio.TimeoutError,
+                       host_limit.Throttled)):
+        return False
+    return isinstance(ex, (TimeoutException, NoSuchElementException, ValueError, KeyError, IndexError))
+
+
+# closed：正常；open：跳開，冷卻期間直接略過；half_open：冷卻結束，放一支股票進去試
+class CircuitBreaker:
+    def __init__(self, key):
+        self.key = key
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self.skipped = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= COOLDOWN_SECONDS:
+                self.state = "half_open"
+                print(f"🔌 {self.key[0]}/{self.key[1]} 冷卻結束，試一支股票")
+                return True
+            self.skipped += 1
+            return False
+
+    # 只看狀態、不佔用試探的名額（例如整支股票預抓時決定要不要順便抓）
+    def is_open(self) -> bool:
+        with self._lock:
+            return self.state != "closed" and not (
+                self.state == "open" and time.monotonic() - self.opened_at >= COOLDOWN_SECONDS)
+
+    def success(self):
+        with self._lock:
+            if self.state != "closed":
+                print(f"✅ {self.key[0]}/{self.key[1]} 恢復正常")
+            self.state = "closed"
+            self.failures = 0
+
+    def failure(self, ex):
+        with self._lock:
+            self.last_error = f"{type(ex).__name__}: {str(ex).strip()}"
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= FAILURE_THRESHOLD:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.trips += 1
+                print(f"🔌 {self.key[0]}/{self.key[1]} 連續 {self.failures} 次頁面結構錯誤，"
+                      f"暫停 {COOLDOWN_SECONDS // 60} 分鐘：{self.last_error}")
+
+    # 沒有結論（資料已是最新、網路錯誤）：試探的名額還回去，下一支股票再試
+    def release(self):
+        with self._lock:
+            if self.state == "half_open":
+                self.state = "open"
+
+
+def get(dataset) -> CircuitBreaker:
+    key = (DATASET_SOURCES.get(dataset, "other"), dataset)
+    with _lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = CircuitBreaker(key)
+            _breakers[key] = breaker
+        return breaker
+
+
+def allow(dataset) -> bool:
+    return get(dataset).allow()
+
+
+def is_open(dataset) -> bool:
+    return get(dataset).is_open()
+
+
+# 回報一個 (股票, 資料集) 的結果：ok=True 成功、ok=False 失敗（ex 是最後的例外）、ok=None 沒跑任何階段
+def report(dataset, ok, ex=None):
+    breaker = get(dataset)
+    if ok:
+        breaker.success()
+    elif ok is False and ex is not None and is_structural(ex):
+        breaker.failure(ex)
+    else:
+        breaker.release()
+
+
+def summary() -> dict:
+    with _lock:
+        breakers = list(_breakers.values())
+    return {
+        f"{b.key[0]}/{b.key[1]}": {"state": b.state, "trips": b.trips, "skipped": b.skipped,
+                                   "last_error": b.last_error}
+        for b in breakers if b.trips
+    }
+
+
+def print_summary():
+    tripped = summary()
+    if not tripped:
+        return
+    print("🔌 跳開過的 circuit breaker（頁面結構可能改了）")
+    for key, s in sorted(tripped.items()):
+        print(f"  {key:<24} 目前 {s['state']:<9} 跳開 {s['trips']} 次  略過 {s['skipped']} 支股票")
+        print(f"    最後錯誤：{s['last_error']}")
@@ -1,14 +1,28 @@
+import asyncio
+import aiohttp
 import requests
+import numpy as np
 import pandas as pd
-import pyodbc
+import json
+import calendar
 from datetime import date
+import host_limit
+import market_calendar
+import watermark
+import raw_cache
+import storage
+import perf
+from db_writer import as_float, as_int, as_value, as_constant, build_params
 
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;"
-    "DATABASE=Stock;"
-    "Trusted_Connection=yes;"
-)
+
+TWSE_STOCK_DAY_URL = "https://www.twse.com.tw/exchangeReport/STOCK_DAY"
+# 全市場每日收盤行情（一個交易日一張表，涵蓋所有上市股票）
+TWSE_MI_INDEX_URL = "https://www.twse.com.tw/exchangeReport/MI_INDEX"
+ASYNC_TIMEOUT = 30
+HTTP_TIMEOUT = 15
+
+# 共用 Session，重複使用 TCP/TLS 連線（keep-alive）
+_session = requests.Session()
 
 def roc_str_to_date(roc_str: str) -> date:
     roc_str = str(roc_str).strip()
@@ -18,6 +32,36 @@ def roc_str_to_date(roc_str: str) -> date:
     day = int(d)
     return date(year, month, day)
 
+# ======= 整欄轉換（向量化，取代逐格 apply） =======
+
+# 一整欄民國日期字串（114/11/03）→ 西元 date
+def roc_col_to_date(col: pd.Series) -> pd.Series:
+    if col.empty:
+        return pd.Series([], index=col.index, dtype=object)
+    parts = col.astype(str).str.strip().str.split("/", expand=True).astype(int)
+    dates = pd.to_datetime(pd.DataFrame({
+        "year": parts[0] + 1911,
+        "month": parts[1],
+        "day": parts[2],
+    }))
+    return pd.Series(dates.dt.date, index=col.index, dtype=object)
+
+def _strip_commas(col: pd.Series) -> pd.Series:
+    return col.astype(str).str.replace(",", "", regex=False).str.strip()
+
+# 空字串 / "0" / "--" → 0，其餘 int(float(s))
+# 原本全市場（MI_INDEX）的 to_int 就把 "--" 當 0；個股（STOCK_DAY）的遇到 "--" 會丟例外，現在兩邊一致當 0
+def clean_int_col(col: pd.Series) -> pd.Series:
+    s = _strip_commas(col)
+    s = s.mask(s.isin(["", "--"]), "0")
+    return pd.to_numeric(s).astype(float).astype("int64")
+
+# 同原本的 to_float：空字串 / "X0.00" / "--" → 0.0，其餘去掉 X 後轉 float
+def clean_float_col(col: pd.Series) -> pd.Series:
+    s = _strip_commas(col)
+    s = s.mask(s.isin(["", "X0.00", "--"]), "0").str.replace("X", "", regex=False)
+    return pd.to_numeric(s).astype(float)
+
 def transform_twse_stock_day_json(json_data: dict) -> pd.DataFrame:
     # 原始表格
     raw = pd.DataFrame(json_data["data"], columns=json_data["fields"])
@@ -36,39 +80,15 @@ def transform_twse_stock_day_json(json_data: dict) -> pd.DataFrame:
     })
 
     # 日期：民國 → 西元
-    raw["trade_date"] = raw["date_roc"].apply(roc_str_to_date)
-
-    # 小工具：數字轉換
-    def to_int(s):
-        s = str(s).replace(",", "").strip()
-        if s == "" or s == "0":
-            return 0
-        return int(float(s))
-
-    def to_float(s):
-        s = str(s).replace(",", "").strip()
-        if s in ("", "X0.00", "--"):
-            return 0.0
-        s = s.replace("X", "")
-        return float(s)
-
-    # 轉型各欄位
-    raw["volume_shares"] = raw["volume_shares"].apply(to_int)
-    raw["open_price"]    = raw["open_price"].apply(to_float)
-    raw["high_price"]    = raw["high_price"].apply(to_float)
-    raw["low_price"]     = raw["low_price"].apply(to_float)
-    raw["last_price"]    = raw["last_price"].apply(to_float)
-    raw["change_price"]  = raw["change_price"].apply(to_float)
+    raw["trade_date"] = roc_col_to_date(raw["date_roc"])
 
-    # 前一日收盤價 = 當日收盤價 - 漲跌價差
-    def calc_prev_close(row):
-        lp = row["last_price"]
-        cp = row["change_price"]
-        if lp is None or cp is None:
-            return None
-        return lp - cp
+    # 轉型各欄位（整欄一次轉）
+    raw["volume_shares"] = clean_int_col(raw["volume_shares"])
+    for col in ["open_price", "high_price", "low_price", "last_price", "change_price"]:
+        raw[col] = clean_float_col(raw[col])
 
-    raw["prev_close"] = raw.apply(calc_prev_close, axis=1)
+    # 前一日收盤價 = 當日收盤價 - 漲跌價差
+    raw["prev_close"] = raw["last_price"] - raw["change_price"]
 
     # 成交量（張）
     raw["volume_lots"] = (raw["volume_shares"] // 1000).astype(int)
@@ -87,74 +107,331 @@ def transform_twse_stock_day_json(json_data: dict) -> pd.DataFrame:
 
     return df
 
-def insert_daily_quotes_to_db(stock_no: str, df: pd.DataFrame):
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-
-    sql = """
-    INSERT INTO dbo.stock_daily_quotes (
-        stock_id,
-        trade_date,
-        last_price,
-        open_price,
-        high_price,
-        low_price,
-        prev_close,
-        volume_lots,
-        volume_shares
+DAILY_QUOTES_TABLE = "dbo.stock_daily_quotes"
+DAILY_QUOTES_COLUMNS = [
+    "stock_id",
+    "trade_date",
+    "last_price",
+    "open_price",
+    "high_price",
+    "low_price",
+    "prev_close",
+    "volume_lots",
+    "volume_shares",
+]
+DAILY_QUOTES_KEYS = ["stock_id", "trade_date"]
+
+# 依欄位組出寫入參數；stock_no 為 None 時用 df 的 stock_no 欄（全市場模式）
+def _daily_quotes_params(df: pd.DataFrame, stock_no: str = None) -> list:
+    return build_params(
+        as_constant(stock_no, len(df)) if stock_no is not None else df["stock_no"].tolist(),
+        as_value(df["trade_date"]),
+        as_float(df["last_price"]),
+        as_float(df["open_price"]),
+        as_float(df["high_price"]),
+        as_float(df["low_price"]),
+        as_float(df["prev_close"]),
+        as_int(df["volume_lots"]),
+        as_int(df["volume_shares"]),
     )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
-
-    for _, row in df.iterrows():
-        params = (
-            stock_no,
-            row["trade_date"],
-            row["last_price"],
-            row["open_price"],
-            row["high_price"],
-            row["low_price"],
-            row["prev_close"],
-            int(row["volume_lots"]),
-            int(row["volume_shares"]),
-        )
-        try:
-            cursor.execute(sql, params)
-        except pyodbc.IntegrityError as ex:
-            # 建議在 DB 上有 UNIQUE(stock_id, trade_date) 時，重複就會走這裡
-            print(f"⚠️ 重複略過 {stock_no} {row['trade_date']}: {ex}")
-        except Exception as ex:
-            print(f"❌ 寫入失敗 {stock_no} {row['trade_date']}: {ex}")
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+# 新增 / 更新筆數，回傳 (inserted, updated)
+def _write_daily_quotes(rows: list):
+    return storage.upsert(DAILY_QUOTES_TABLE, DAILY_QUOTES_COLUMNS, DAILY_QUOTES_KEYS, rows)
+
+def insert_daily_quotes_to_db(stock_no: str, df: pd.DataFrame):
+    return _write_daily_quotes(_daily_quotes_params(df, stock_no))
+
+# 全市場的 DataFrame（含 stock_no 欄）一次寫入，整天只寫一批
+def insert_market_quotes_to_db(df: pd.DataFrame):
+    return _write_daily_quotes(_daily_quotes_params(df))
+
+# TWSE 回傳 stat = OK 才存進快取，被擋或查無資料不存
+def _twse_ok(text: str) -> bool:
+    try:
+        return json.loads(text).get("stat") == "OK"
+    except ValueError:
+        return False
+
+# TWSE 擋人時常回 200 但內容是空白或 HTML 擋頁，不是 JSON
+def _check_twse_text(text: str) -> str:
+    if not text.lstrip().startswith("{"):
+        raise host_limit.Throttled(f"TWSE 回傳的不是 JSON（{len(text)} bytes）")
+    return text
+
+# 送一個 TWSE 請求：經過 host_limit 的速率限制，被限流時降速重試
+def _get_twse(url: str) -> str:
+    def get():
+        resp = _session.get(url, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        return _check_twse_text(resp.text)
+    return host_limit.with_backoff(url, get)
+
+# 當月還會有新資料，之前的月份就不會再變
+def _month_closed(yyyymm: str) -> bool:
+    return yyyymm[:6] < date.today().strftime("%Y%m")
 
 def fetch_twse_stock_day_json(stock_no: str, yyyymm: str) -> dict:
-    url = (
-        "https://www.twse.com.tw/exchangeReport/STOCK_DAY"
-        f"?date={yyyymm}&stockNo={stock_no}"
-    )
-    resp = requests.get(url)
-    resp.raise_for_status()
-    return resp.json()
+    def fetch():
+        return _get_twse(f"{TWSE_STOCK_DAY_URL}?date={yyyymm}&stockNo={stock_no}")
+
+    with perf.stage("fetch"):
+        text = raw_cache.cached_fetch("twse", "stock_day", stock_no, yyyymm[:6], fetch,
+                                      closed=_month_closed(yyyymm), should_cache=_twse_ok)
+    with perf.stage("parse") as span:
+        json_data = json.loads(text)
+        span.rows = len(json_data.get("data") or [])
+    return json_data
 
 
 def fetch_and_save_stock_month(stock_id: int, stock_no: str, yyyymm: str):
     json_data = fetch_twse_stock_day_json(stock_no, yyyymm)
+    save_stock_month_json(stock_no, yyyymm, json_data)
 
+# 清洗並寫入一個月的 STOCK_DAY 回應（一般流程和快取重播共用）
+def save_stock_month_json(stock_no: str, yyyymm: str, json_data: dict, use_watermark=True):
     if json_data.get("stat") != "OK":
         print(f"❌ TWSE 回傳失敗，股票代號{stock_no}：{json_data.get('stat')}")
         return
 
-    df = transform_twse_stock_day_json(json_data)
-    insert_daily_quotes_to_db(stock_no, df)
-    print(f"✅ 已寫入 {stock_no} {yyyymm} 共 {len(df)} 筆日行情")
+    with perf.stage("transform") as span:
+        df = transform_twse_stock_day_json(json_data)
+        # 只寫高水位之後的日期
+        wm = watermark.daily_watermark(stock_no) if use_watermark else None
+        if wm is not None:
+            df = df[df["trade_date"] > wm]
+        span.rows = len(df)
+    if df.empty:
+        print(f"⏭️ {stock_no} {yyyymm} 沒有新的日行情")
+        return
+    with perf.stage("write") as span:
+        inserted, updated = insert_daily_quotes_to_db(stock_no, df)
+        span.rows = inserted + updated
+    watermark.advance("daily_quotes", stock_no, df["trade_date"].max())
+    print(f"✅ 已寫入 {stock_no} {yyyymm} 共 {len(df)} 筆日行情（新增 {inserted}、更新 {updated}）")
 
 def process_daily_quotes_for_stock(stock_no: str):
-    yyyymm_list = ["202511", "20251031", "20250930"]  # 最近三個月
+    # 從資料庫最新的交易日之後開始抓，已經最新就不發請求
+    yyyymm_list = watermark.missing_daily_months(stock_no)
+    if not yyyymm_list:
+        print(f"⏭️ {stock_no} 日成交資料已是最新，略過")
+        return
     for yyyymm in yyyymm_list:
         try:
             fetch_and_save_stock_month(stock_no, stock_no, yyyymm)
         except Exception as ex:
-            print(f"❌ {stock_no} {yyyymm} 日成交資料失敗：{ex}")
\ No newline at end of file
+            print(f"❌ {stock_no} {yyyymm} 日成交資料失敗：{ex}")
+
+# ======= 全市場模式：一個交易日抓一次全部上市股票 =======
+
+def fetch_twse_market_day_json(yyyymmdd: str) -> dict:
+    def fetch():
+        return _get_twse(f"{TWSE_MI_INDEX_URL}?response=json&date={yyyymmdd}&type=ALLBUT0999")
+
+    closed = yyyymmdd < date.today().strftime("%Y%m%d")
+    with perf.stage("fetch"):
+        text = raw_cache.cached_fetch("twse", "market_day", "ALL", yyyymmdd, fetch,
+                                      closed=closed, should_cache=_twse_ok)
+    with perf.stage("parse"):
+        return json.loads(text)
+
+# 找出「每日收盤行情」那張表，新版放在 tables，舊版放在 fieldsN / dataN
+def _find_market_quote_table(json_data: dict):
+    for table in json_data.get("tables", []):
+        fields = table.get("fields") or []
+        if "證券代號" in fields and "收盤價" in fields:
+            return fields, table.get("data") or []
+    for key, fields in json_data.items():
+        if key.startswith("fields") and "證券代號" in fields and "收盤價" in fields:
+            return fields, json_data.get("data" + key[len("fields"):], [])
+    return None, None
+
+def transform_twse_market_day_json(json_data: dict, trade_date: date) -> pd.DataFrame:
+    fields, data = _find_market_quote_table(json_data)
+    if fields is None:
+        raise ValueError("找不到每日收盤行情表格")
+
+    raw = pd.DataFrame(data, columns=fields)
+    raw = raw.rename(columns={
+        "證券代號": "stock_no",
+        "成交股數": "volume_shares",
+        "開盤價": "open_price",
+        "最高價": "high_price",
+        "最低價": "low_price",
+        "收盤價": "last_price",
+        "漲跌(+/-)": "change_sign",
+        "漲跌價差": "change_price",
+    })
+
+    raw["stock_no"] = raw["stock_no"].astype(str).str.strip()
+    raw["trade_date"] = trade_date
+    raw["volume_shares"] = clean_int_col(raw["volume_shares"])
+    for col in ["open_price", "high_price", "low_price", "last_price", "change_price"]:
+        raw[col] = clean_float_col(raw[col])
+
+    # 漲跌價差是絕對值，正負號在「漲跌(+/-)」欄（內容是 <p style=...>-</p> 這種 HTML）
+    sign = np.where(raw["change_sign"].astype(str).str.contains("-", regex=False), -1.0, 1.0)
+    raw["prev_close"] = raw["last_price"] - sign * raw["change_price"]
+    raw["volume_lots"] = (raw["volume_shares"] // 1000).astype(int)
+
+    return raw[[
+        "stock_no",
+        "trade_date",
+        "last_price",
+        "open_price",
+        "high_price",
+        "low_price",
+        "prev_close",
+        "volume_lots",
+        "volume_shares",
+    ]].copy()
+
+# 某個月份裡的交易日（排除週末與 TWSE 公布的休市日；臨時休市 TWSE 會回非 OK）
+def candidate_trading_dates(yyyymm: str):
+    year, month = int(yyyymm[:4]), int(yyyymm[4:6])
+    days = calendar.monthrange(year, month)[1]
+    for day in range(1, days + 1):
+        d = date(year, month, day)
+        if d <= date.today() and market_calendar.is_trading_day(d):
+            yield d
+
+# 抓一個交易日的全市場行情，只留 stock_nos 裡的股票後一次寫入
+def fetch_and_save_market_day(trade_date: date, stock_nos=None) -> int:
+    json_data = fetch_twse_market_day_json(trade_date.strftime("%Y%m%d"))
+    return save_market_day_json(trade_date, json_data, stock_nos)
+
+# 清洗並寫入一天的全市場回應（一般流程和快取重播共用）
+def save_market_day_json(trade_date: date, json_data: dict, stock_nos=None, use_watermark=True) -> int:
+    if json_data.get("stat") != "OK":
+        # 休市日也會走這裡
+        return 0
+
+    with perf.stage("transform") as span:
+        df = transform_twse_market_day_json(json_data, trade_date)
+        if stock_nos is not None:
+            df = df[df["stock_no"].isin(set(stock_nos))]
+        # 這一天已經有資料的股票不用再寫
+        if use_watermark:
+            df = df[df["stock_no"].map(lambda s: (watermark.daily_watermark(s) or date.min) < trade_date)]
+        span.rows = len(df)
+    if df.empty:
+        return 0
+    with perf.stage("write") as span:
+        inserted, updated = insert_market_quotes_to_db(df)
+        span.rows = inserted + updated
+    for stock_no in df["stock_no"].unique():
+        watermark.advance("daily_quotes", stock_no, trade_date)
+    print(f"✅ 已寫入 {trade_date} 全市場 {df['stock_no'].nunique()} 檔共 {len(df)} 筆日行情（新增 {inserted}、更新 {updated}）")
+    return len(df)
+
+# 全市場模式要抓的日期：從所有股票中最早缺資料的那天到最新交易日
+def missing_market_dates(stock_nos) -> list:
+    firsts = [watermark.first_missing_trade_date(s) for s in stock_nos]
+    firsts = [d for d in firsts if d is not None]
+    if not firsts:
+        return []
+    return market_calendar.trading_days(min(firsts), watermark.latest_trade_date())
+
+# 全市場模式：每個交易日一個請求，取代 每支股票 × 每個月 一個請求
+# 沒指定 yyyymm_list 時只抓高水位之後缺的交易日
+def process_daily_quotes_for_market(stock_nos, yyyymm_list=None):
+    if yyyymm_list:
+        dates = [d for yyyymm in yyyymm_list for d in candidate_trading_dates(yyyymm)]
+    else:
+        dates = missing_market_dates(stock_nos)
+    if not dates:
+        print("⏭️ 全市場日成交資料已是最新，略過")
+        return
+    for trade_date in dates:
+        try:
+            fetch_and_save_market_day(trade_date, stock_nos)
+        except Exception as ex:
+            print(f"❌ {trade_date} 全市場日成交資料失敗：{ex}")
+
+# 非同步抓多個 (stock_no, yyyymm)：共用一個連線池，最多 max_in_flight 個同時進行
+# （預設跟同步版一樣用 host_limit.HOST_LIMITS 的上限），
+# 哪個先回來就先 yield (stock_no, yyyymm, json_data 或 Exception)
+async def fetch_twse_stock_day_many(pairs, max_in_flight: int = None):
+    if max_in_flight is None:
+        max_in_flight = host_limit.concurrency(TWSE_STOCK_DAY_URL)
+    sem = asyncio.Semaphore(max_in_flight)
+    connector = aiohttp.TCPConnector(limit=max_in_flight, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=ASYNC_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def fetch_one(stock_no, yyyymm):
+            cached = raw_cache.get("twse", "stock_day", stock_no, yyyymm[:6])
+            if cached is not None:
+                return stock_no, yyyymm, json.loads(cached)
+            async with sem:
+                try:
+                    await host_limit.acquire_async(TWSE_STOCK_DAY_URL)
+                    try:
+                        async with session.get(
+                            TWSE_STOCK_DAY_URL, params={"date": yyyymm, "stockNo": stock_no}
+                        ) as resp:
+                            resp.raise_for_status()
+                            text = _check_twse_text(await resp.text())
+                    except Exception as ex:
+                        host_limit.report(TWSE_STOCK_DAY_URL, ex)
+                        raise
+                    host_limit.report(TWSE_STOCK_DAY_URL)
+                    if _twse_ok(text):
+                        raw_cache.put("twse", "stock_day", stock_no, yyyymm[:6], text,
+                                      closed=_month_closed(yyyymm))
+                    return stock_no, yyyymm, json.loads(text)
+                except Exception as ex:
+                    return stock_no, yyyymm, ex
+
+        tasks = [asyncio.create_task(fetch_one(s, m)) for s, m in pairs]
+        try:
+            for done in asyncio.as_completed(tasks):
+                yield await done
+        finally:
+            for task in tasks:
+                task.cancel()
+
+# 寫入回補的一個月（在執行緒裡跑，perf 各自記一個 task）
+# 各月份回來的順序不固定，不用高水位過濾（MERGE 重複寫入沒關係），寫完再推進高水位
+def _save_backfill_month(stock_no: str, yyyymm: str, json_data: dict):
+    with perf.task("daily_quotes", stock_no):
+        with perf.stage("transform") as span:
+            df = transform_twse_stock_day_json(json_data)
+            span.rows = len(df)
+        with perf.stage("write") as span:
+            inserted, updated = insert_daily_quotes_to_db(stock_no, df)
+            span.rows = inserted + updated
+    if not df.empty:
+        watermark.advance("daily_quotes", stock_no, df["trade_date"].max())
+    print(f"✅ 已寫入 {stock_no} {yyyymm} 共 {len(df)} 筆日行情（新增 {inserted}、更新 {updated}）")
+
+async def _backfill_daily_quotes(pairs, max_in_flight):
+    saved = 0
+    async for stock_no, yyyymm, result in fetch_twse_stock_day_many(pairs, max_in_flight):
+        if isinstance(result, Exception):
+            print(f"❌ {stock_no} {yyyymm} 日成交資料失敗：{result}")
+            continue
+        if result.get("stat") != "OK":
+            print(f"❌ TWSE 回傳失敗，股票代號{stock_no}：{result.get('stat')}")
+            continue
+        try:
+            # 寫入 DB 是同步的，丟到執行緒，其他請求可以繼續進行
+            await asyncio.to_thread(_save_backfill_month, stock_no, yyyymm, result)
+            saved += 1
+        except Exception as ex:
+            print(f"❌ {stock_no} {yyyymm} 日成交資料失敗：{ex}")
+    return saved
+
+# 一次回補大量 (stock_no, yyyymm)，回傳成功寫入的月份數
+def backfill_daily_quotes(pairs, max_in_flight: int = None) -> int:
+    return asyncio.run(_backfill_daily_quotes(list(pairs), max_in_flight))
+
+# 所有股票高水位之後缺的月份一次非同步回補（--daily-mode async）
+def process_daily_quotes_backfill(stock_nos, max_in_flight: int = None) -> int:
+    pairs = [(stock_no, yyyymm) for stock_no in stock_nos for yyyymm in watermark.missing_daily_months(stock_no)]
+    if not pairs:
+        print("⏭️ 日成交資料已是最新，略過")
+        return 0
+    saved = backfill_daily_quotes(pairs, max_in_flight)
+    print(f"✅ 日成交回補：{saved} / {len(pairs)} 個月份")
+    return saved
@@ -1,46 +1,73 @@
-import time
-import selenium
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 import pandas as pd
-import pyodbc
-from datetime import datetime
-
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;" 
-    "DATABASE=Stock;"
-    "Trusted_Connection=yes;"
-)
-
-def get_stocks():
-    conn = pyodbc.connect(CONN_STR)
-    df = pd.read_sql("SELECT id, stock_no FROM dbo.stocks ORDER BY id", conn)
-    conn.close()
-    return df
-
-
+from io import StringIO
+from driver_pool import borrow_driver, load_page
+from page_wait import wait_for_element, click_and_wait_changed
+import watermark
+import raw_cache
+import storage
+import http_tables
+import perf
+from db_writer import as_float, as_value, as_constant, build_params
+
+
+DIVIDEND_URL = "https://www.cmoney.tw/forum/stock/{stock_no}?s=dividend"
+DIVIDEND_TABLE_XPATH = '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/section[2]/div[3]'
+
+# 在已經停在股利頁的瀏覽器上取表格的 outerHTML（單獨抓或整支股票一次抓都用這個）
+def read_dividend_table(driver) -> str:
+    table_xpath = DIVIDEND_TABLE_XPATH
+    wait_for_element(driver, table_xpath, "dividend")
+    # 點選按鈕，等表格內容更新
+    return click_and_wait_changed(
+        driver,
+        '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/section[2]/div[4]/div',
+        table_xpath,
+        "dividend",
+    )
+
+# 用瀏覽器抓股利表格的 outerHTML
+def scrape_dividend_html(stock_no) -> str:
+    with borrow_driver() as driver:
+        load_page(driver, DIVIDEND_URL.format(stock_no=stock_no))
+        html = read_dividend_table(driver)
+
+    return html
+
+# 不開瀏覽器，直接從伺服器回傳的 HTML 取股利表格；HTML 裡沒有就回傳 None
+def fetch_dividend_html_http(stock_no):
+    tables = http_tables.fetch_tables(DIVIDEND_URL.format(stock_no=stock_no),
+                                      {"dividend": (DIVIDEND_TABLE_XPATH, ("除息日",))})
+    return tables and tables["dividend"]
+
+def parse_dividend_html(html: str) -> pd.DataFrame:
+    dfs = pd.read_html(StringIO(html))
+    return dfs[0]
+
+# HTTP 拿到的表格要涵蓋要寫的年度：已有資料只需要最新幾筆，沒有的話要回到 2020
+def _dividend_covers(stock_no, html) -> bool:
+    if watermark.dividend_watermark(stock_no) is not None:
+        return True
+    df = flatten_columns(parse_dividend_html(html))
+    return pd.to_numeric(df["除權息年度_除權息年度"], errors="coerce").min() <= watermark.DIVIDEND_DEFAULT_YEAR
+
+# 只試 HTTP：表格在 HTML 裡而且年度夠就回傳，否則 None
+def try_dividend_html_http(stock_no):
+    return http_tables.try_http("dividend", lambda: fetch_dividend_html_http(stock_no),
+                                covers=lambda html: _dividend_covers(stock_no, html))
+
+# 先試 HTTP，表格不在 HTML 裡或年度不夠才開瀏覽器
+def fetch_dividend_html(stock_no) -> str:
+    return try_dividend_html_http(stock_no) or http_tables.use_browser(
+        "dividend", lambda: scrape_dividend_html(stock_no))
+
+# 股利公告沒有固定期別，快取只靠 TTL
 def clawer_dividend(stock_no):
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    driver = webdriver.Chrome(service=Service(), options=chrome_options)
-
-
-    driver.get(f"https://www.cmoney.tw/forum/stock/{stock_no}?s=dividend")
-    time.sleep(5)
-    # 點選按鈕
-    button = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/section[2]/div[4]/div')
-    button.click()
-
-    table = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/section[2]/div[3]')
-
-    html = table.get_attribute('outerHTML')
-
-    dfs = pd.read_html(html)
-    df = dfs[0]
-
+    with perf.stage("fetch"):
+        html = raw_cache.cached_fetch("cmoney", "dividend", stock_no, "latest",
+                                      lambda: fetch_dividend_html(stock_no))
+    with perf.stage("parse") as span:
+        df = parse_dividend_html(html)
+        span.rows = len(df)
     return df
 
 # 把 MultiIndex 轉成單層欄位
@@ -54,61 +81,66 @@ def transform_dividend_df(df):
 
     df_clean["cash_dividend"] = pd.to_numeric(df["現金股利(元)_股利"], errors="coerce")
 
-    # 日期格式清洗（2025/03/17 → 2025-03-17）
-    def clean_date(x):
-        try:
-            return datetime.strptime(str(x), "%Y/%m/%d").date()
-        except:
-            return None
+    # 日期格式清洗（2025/03/17 → 2025-03-17），整欄一次轉，無法解析的給 None
+    def clean_date(col):
+        dates = pd.to_datetime(col.astype(str), format="%Y/%m/%d", errors="coerce")
+        return pd.Series(dates.dt.date, index=col.index, dtype=object).where(dates.notna(), None)
 
-    df_clean["ex_dividend_date"] = df["現金股利(元)_除息日"].apply(clean_date)
-    df_clean["pay_date"] = df["現金股利(元)_發放日"].apply(clean_date)
+    df_clean["ex_dividend_date"] = clean_date(df["現金股利(元)_除息日"])
+    df_clean["pay_date"] = clean_date(df["現金股利(元)_發放日"])
 
     # 年度（若你未來要放，可留著）
     df_clean["fiscal_year"] = df["除權息年度_除權息年度"].astype(int)
 
     return df_clean
 
+# 有除息日的以 (stock_no, ex_dividend_date) 為 key MERGE；還沒有除息日的（頁面上是 "-"）不能當 key，
+# 每次整組換成頁面上目前的那幾筆：公布除息日後舊的那筆就被刪掉，同一年有好幾筆也不會被併成一筆
+# 回傳 (新增筆數, 更新筆數)
 def insert_dividend_to_db(stock_no, df):
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-
-    sql = """
-        INSERT INTO dbo.stock_dividend (
-            stock_no,
-            cash_dividend,
-            ex_dividend_date,
-            pay_date
-        )
-        VALUES (?, ?, ?, ?)
-    """
-
-    for _, row in df.iterrows():
-        params = (
-            stock_no,
-            row["cash_dividend"],
-            row["ex_dividend_date"],
-            row["pay_date"]
-        )
-        try:
-            cursor.execute(sql, params)
-        except Exception as ex:
-            print(f"❌ 寫入錯誤：{stock_no} {row} | {ex}")
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-def process_dividend_for_stock(stock_no):
-    try:
-        df_cd = clawer_dividend(stock_no)
+    columns = [
+        "stock_no",
+        "cash_dividend",
+        "ex_dividend_date",
+        "pay_date",
+    ]
+    rows = build_params(
+        as_constant(stock_no, len(df)),
+        as_float(df["cash_dividend"]),
+        as_value(df["ex_dividend_date"]),
+        as_value(df["pay_date"]),
+    )
+    dated = [r for r in rows if r[2] is not None]
+    pending = [r for r in rows if r[2] is None]
+
+    inserted, updated = storage.upsert("dbo.stock_dividend", columns, ["stock_no", "ex_dividend_date"], dated)
+    written, deleted = storage.replace("dbo.stock_dividend", columns,
+                                       {"stock_no": stock_no, "ex_dividend_date": None}, pending)
+    # 取代掉的舊資料算更新，多出來的算新增
+    return inserted + max(written - deleted, 0), updated + min(written, deleted)
+
+# 清洗並寫入一份股利表格（一般流程和快取重播共用）
+def save_dividend_df(stock_no, df_cd, use_watermark=True):
+    with perf.stage("transform") as span:
         df_cd = flatten_columns(df_cd)
         # 過濾年度
-        df_cd = df_cd[df_cd["除權息年度_除權息年度"] >= 2020]
+        df_cd = df_cd[df_cd["除權息年度_除權息年度"] >= watermark.DIVIDEND_DEFAULT_YEAR]
         # 格式清洗
         df_clean = transform_dividend_df(df_cd)
-        # 寫入 DB
-        insert_dividend_to_db(stock_no, df_clean)
-        print(f"✅ 已寫入 {stock_no} 的股利資料（2020~最新）")
+        # 股利公告時間不固定，頁面照抓；只寫最新除息日之後（或還沒有除息日）的資料
+        wm = watermark.dividend_watermark(stock_no) if use_watermark else None
+        if wm is not None:
+            df_clean = df_clean[df_clean["ex_dividend_date"].map(lambda d: pd.isna(d) or d > wm)]
+        span.rows = len(df_clean)
+    # 寫入 DB
+    with perf.stage("write") as span:
+        inserted, updated = insert_dividend_to_db(stock_no, df_clean)
+        span.rows = inserted + updated
+    print(f"✅ 已寫入 {stock_no} 的股利資料（2020~最新，新增 {inserted}、更新 {updated}）")
+
+def process_dividend_for_stock(stock_no):
+    try:
+        df_cd = clawer_dividend(stock_no)
+        save_dividend_df(stock_no, df_cd)
     except Exception as ex:
         print(f"❌ {stock_no} 股利資料失敗：{ex}")
\ No newline at end of file
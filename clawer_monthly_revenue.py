@@ -1,44 +1,80 @@
-import time
-import selenium
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 import pandas as pd
-import pyodbc
-from datetime import datetime
-
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;" 
-    "DATABASE=Stock;"
-    "Trusted_Connection=yes;"
-)
-
-# 爬取月營收資料
-def clawer_monthly_revenue(stock_no):
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    driver = webdriver.Chrome(service=Service(), options=chrome_options)
-
-
-    driver.get(f"https://www.cmoney.tw/forum/stock/{stock_no}?s=revenue")
-    time.sleep(5)
-    # 點選按鈕
-    button = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]/div[3]/div')
-    button.click()
-
-    table = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]')
-
-    html = table.get_attribute('outerHTML')
-
-    dfs = pd.read_html(html)
-    df = dfs[0]
+from io import StringIO
+from driver_pool import borrow_driver, load_page
+from page_wait import wait_for_element, click_and_wait_changed
+import watermark
+import raw_cache
+import storage
+import http_tables
+import perf
+import fundamentals
+from db_writer import as_int, as_float_scaled, as_constant, build_params
+
+
+REVENUE_URL = "https://www.cmoney.tw/forum/stock/{stock_no}?s=revenue"
+REVENUE_TABLE_XPATH = '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]'
+
+# 在已經停在月營收頁的瀏覽器上取表格的 outerHTML（單獨抓或整支股票一次抓都用這個）
+def read_monthly_revenue_table(driver) -> str:
+    table_xpath = REVENUE_TABLE_XPATH
+    wait_for_element(driver, table_xpath, "revenue")
+    # 點選按鈕，等表格內容更新
+    return click_and_wait_changed(
+        driver,
+        '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]/div[3]/div',
+        table_xpath,
+        "revenue",
+    )
 
+# 用瀏覽器抓月營收表格的 outerHTML
+def scrape_monthly_revenue_html(stock_no) -> str:
+    with borrow_driver() as driver:
+        load_page(driver, REVENUE_URL.format(stock_no=stock_no))
+        html = read_monthly_revenue_table(driver)
+
+    return html
+
+# 不開瀏覽器，直接從伺服器回傳的 HTML 取月營收表格；HTML 裡沒有就回傳 None
+def fetch_monthly_revenue_html_http(stock_no):
+    tables = http_tables.fetch_tables(REVENUE_URL.format(stock_no=stock_no),
+                                      {"revenue": (REVENUE_TABLE_XPATH, ("當月營收",))})
+    return tables and tables["revenue"]
+
+def parse_monthly_revenue_html(html: str) -> pd.DataFrame:
+    dfs = pd.read_html(StringIO(html))
+    return dfs[0]
+
+# HTTP 拿到的表格要往回涵蓋到 start 那個月（頁面預設可能只顯示最近幾個月）
+def _revenue_covers(html, start) -> bool:
+    if start is None:
+        return True
+    df = flatten_columns(parse_monthly_revenue_html(html))
+    return df["年度/月份_年度/月份"].astype(str).min() <= "%d/%02d" % start
+
+# 只試 HTTP：表格在 HTML 裡而且月份夠就回傳，否則 None
+def try_monthly_revenue_html_http(stock_no, start=None):
+    return http_tables.try_http("revenue", lambda: fetch_monthly_revenue_html_http(stock_no),
+                                covers=lambda html: _revenue_covers(html, start))
+
+# 先試 HTTP，表格不在 HTML 裡或月份不夠才開瀏覽器
+def fetch_monthly_revenue_html(stock_no, start=None) -> str:
+    return try_monthly_revenue_html_http(stock_no, start) or http_tables.use_browser(
+        "revenue", lambda: scrape_monthly_revenue_html(stock_no))
+
+# 爬取月營收資料；快取以「應該已公布的最新月份」為期別，start 是最早需要的月份
+def clawer_monthly_revenue(stock_no, period=None, start=None):
+    if period is None:
+        period = "%d%02d" % watermark.latest_revenue_month()
+    with perf.stage("fetch"):
+        html = raw_cache.cached_fetch("cmoney", "revenue", stock_no, period,
+                                      lambda: fetch_monthly_revenue_html(stock_no, start))
+    with perf.stage("parse") as span:
+        df = parse_monthly_revenue_html(html)
+        span.rows = len(df)
     return df
 
-# 重新整理並清洗月營收資料
-def transform_monthly_df(df: pd.DataFrame) -> pd.DataFrame:
+# 重新整理並清洗月營收資料，只留 start ~ end（含）的月份
+def transform_monthly_df(df: pd.DataFrame, start=(2022, 9), end=(2025, 9)) -> pd.DataFrame:
     # 重新命名欄位成好用一點的英文
     df = df.rename(columns={
         "年度/月份_年度/月份": "ym",
@@ -56,9 +92,10 @@ def transform_monthly_df(df: pd.DataFrame) -> pd.DataFrame:
     df["month"] = df["ym"].str.slice(5, 7).astype(int)
     df["roc_year"] = df["year"] - 1911
 
+    (start_y, start_m), (end_y, end_m) = start, end
     df = df[
-        ((df["year"] > 2022) | ((df["year"] == 2022) & (df["month"] >= 9))) &
-        ((df["year"] < 2025) | ((df["year"] == 2025) & (df["month"] <= 9)))
+        ((df["year"] > start_y) | ((df["year"] == start_y) & (df["month"] >= start_m))) &
+        ((df["year"] < end_y) | ((df["year"] == end_y) & (df["month"] <= end_m)))
     ]
 
     # 轉數字欄位
@@ -69,14 +106,9 @@ def transform_monthly_df(df: pd.DataFrame) -> pd.DataFrame:
         "revenue_ytd_prev_year",
     ]
 
-    for col in numeric_cols:
-        df[col] = (
-            df[col]
-            .astype(str)
-            .str.replace(",", "", regex=False)
-            .str.replace("%", "", regex=False)
-        )
-        df[col] = pd.to_numeric(df[col], errors="coerce")
+    # 四欄一起去掉千分位與 %，一次轉數字
+    cleaned = df[numeric_cols].astype(str).replace(r"[,%]", "", regex=True)
+    df[numeric_cols] = cleaned.apply(pd.to_numeric, errors="coerce")
 
     return df
 
@@ -88,61 +120,64 @@ def flatten_columns(df):
 
 # 將清洗好的月營收資料寫入資料庫
 def insert_monthly_to_db(stock_no: str, df: pd.DataFrame):
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-
-    sql = """
-    INSERT INTO dbo.stock_monthly_revenue (
-        stock_no,
-        year,
-        month,
-        roc_year,
-        revenue_current,
-        revenue_prev_year_month,
-        revenue_ytd,
-        revenue_ytd_prev_year
+    columns = [
+        "stock_no",
+        "year",
+        "month",
+        "roc_year",
+        "revenue_current",
+        "revenue_prev_year_month",
+        "revenue_ytd",
+        "revenue_ytd_prev_year",
+    ]
+
+    # 仟元 → 億元
+    scale = 1000.0 / 100_000_000.0
+    rows = build_params(
+        as_constant(stock_no, len(df)),
+        as_int(df["year"]),
+        as_int(df["month"]),
+        as_int(df["roc_year"]),
+        as_float_scaled(df["revenue_current"], scale),
+        as_float_scaled(df["revenue_prev_year_month"], scale),
+        as_float_scaled(df["revenue_ytd"], scale),
+        as_float_scaled(df["revenue_ytd_prev_year"], scale),
     )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    """
-
-    def to_float_scaled(val):
-        # 將數值轉為 float，NaN 或無效值回傳 None 以便寫入 SQL 的 NULL
-        try:
-            if pd.isna(val):
-                return None
-            # 有些情況可能是字串空白或空字串
-            if isinstance(val, str):
-                v = val.strip()
-                if v == "":
-                    return None
-                val = float(v)
-            return float(val) * 1000.0 / 100_000_000.0
-        except Exception:
-            return None
-
-    for _, row in df.iterrows():
-        params = (
-            stock_no,
-            int(row["year"]),
-            int(row["month"]),
-            int(row["roc_year"]),
-            to_float_scaled(row.get("revenue_current")),
-            to_float_scaled(row.get("revenue_prev_year_month")),
-            to_float_scaled(row.get("revenue_ytd")),
-            to_float_scaled(row.get("revenue_ytd_prev_year"))
-        )
-        cursor.execute(sql, params)
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+
+    # 以 (stock_no, year, month) 為 key MERGE，回傳 (新增筆數, 更新筆數)
+    return storage.upsert("dbo.stock_monthly_revenue", columns, ["stock_no", "year", "month"], rows)
+
+# 清洗並寫入一份月營收表格（一般流程和快取重播共用）
+def save_monthly_revenue_df(stock_no, df_cmr, start, end):
+    with perf.stage("transform") as span:
+        df_cmr = flatten_columns(df_cmr)
+        df_clean  = transform_monthly_df(df_cmr, start, end)
+        span.rows = len(df_clean)
+    with perf.stage("write") as span:
+        inserted, updated = insert_monthly_to_db(stock_no=stock_no, df=df_clean)
+        span.rows = inserted + updated
+        # 財務比率的待算清單也是寫入的一部分，失敗就算寫入失敗
+        if not df_clean.empty:
+            first = df_clean.sort_values(["year", "month"]).iloc[0]
+            fundamentals.mark_changed("monthly", stock_no, (first["year"], first["month"]))
+    if not df_clean.empty:
+        last = df_clean.sort_values(["year", "month"]).iloc[-1]
+        watermark.advance("monthly_revenue", stock_no, int(last["year"]) * 100 + int(last["month"]))
+    print(f"✅ 已將{stock_no}寫入 stock_monthly_revenue（新增 {inserted}、更新 {updated}）")
+    return df_clean
 
 def process_monthly_revenue_for_stock(stock_no):
+    # 只抓資料庫最新月份之後、已公布的月份；已經最新就不開瀏覽器
+    missing = watermark.missing_revenue_range(stock_no)
+    if missing is None:
+        print(f"⏭️ {stock_no} 月營收已是最新，略過")
+        return
     try:
-        df_cmr = clawer_monthly_revenue(stock_no)
-        df_cmr = flatten_columns(df_cmr)
-        df_clean  = transform_monthly_df(df_cmr)
-        insert_monthly_to_db(stock_no=stock_no, df=df_clean)
-        print(f"✅ 已將{stock_no}寫入 stock_monthly_revenue")
+        period = "%d%02d" % missing[1]
+        df_cmr = clawer_monthly_revenue(stock_no, period, start=missing[0])
+        df_clean = save_monthly_revenue_df(stock_no, df_cmr, *missing)
+        # 已經拿到最新月份，這份快取之後不會再變
+        if ((df_clean["year"] == missing[1][0]) & (df_clean["month"] == missing[1][1])).any():
+            raw_cache.mark_closed("cmoney", "revenue", stock_no, period)
     except Exception as ex:
         print(f"❌ {stock_no} 月營收資料失敗：{ex}")
\ No newline at end of file
@@ -1,67 +1,97 @@
-import time
-import selenium
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 import pandas as pd
-import pyodbc
-from datetime import datetime
-
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;"      # 改成你的 SQL Server
-    "DATABASE=Stock;"
-    "Trusted_Connection=yes;"
-)
-
-def clawer_quarterly_balance(stock_no):
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    driver = webdriver.Chrome(service=Service(), options=chrome_options)
-
-    driver.get(f"https://www.cmoney.tw/forum/stock/{stock_no}?s=balance-sheet")
-    time.sleep(5)
-
-    # 點選按鈕
-    assets_button = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[1]/div[1]/div[1]/label[1]')
-    liabilities_button = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[1]/div[1]/div[1]/label[2]')
-    equity_button = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[1]/div[1]/div[1]/label[3]')
-    
+import json
+from io import StringIO
+from driver_pool import borrow_driver, load_page
+from page_wait import wait_for_element, click_and_wait_changed
+import watermark
+import raw_cache
+import storage
+import http_tables
+import perf
+import fundamentals
+from db_writer import as_int, as_float_scaled, as_constant, build_params
+
+
+BALANCE_URL = "https://www.cmoney.tw/forum/stock/{stock_no}?s=balance-sheet"
+BALANCE_TABLE_XPATH = '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[2]'
+
+# 在已經停在資產負債表頁的瀏覽器上依序點資產 / 負債 / 權益，回傳三張表格的 outerHTML
+def read_quarterly_balance_tables(driver) -> dict:
+    buttons_xpath = '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[1]/div[1]/div[1]'
+    table_xpath = BALANCE_TABLE_XPATH
+    wait_for_element(driver, table_xpath, "balance-sheet")
+
     # 資產表
-    assets_button.click()
-    time.sleep(3)
-    assets_table = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[2]')
-    assets_html = assets_table.get_attribute('outerHTML')
-    assets_dfs = pd.read_html(assets_html)
-    assets_df = assets_dfs[0]
+    assets_html = click_and_wait_changed(driver, f"{buttons_xpath}/label[1]", table_xpath, "balance-sheet", "assets")
 
     # 負債表
-    liabilities_button.click()
-    time.sleep(3)
-    liabilities_table = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[2]')
-    liabilities_html = liabilities_table.get_attribute('outerHTML')
-    liabilities_dfs = pd.read_html(liabilities_html)
-    liabilities_df = liabilities_dfs[0]
+    liabilities_html = click_and_wait_changed(driver, f"{buttons_xpath}/label[2]", table_xpath, "balance-sheet", "liabilities")
 
     # 權益表
-    equity_button.click()
-    time.sleep(3)
-    equity_table = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[2]')
-    equity_html = equity_table.get_attribute('outerHTML')
-    equity_dfs = pd.read_html(equity_html)
-    equity_df = equity_dfs[0]
-
+    equity_html = click_and_wait_changed(driver, f"{buttons_xpath}/label[3]", table_xpath, "balance-sheet", "equity")
+
+    return {"assets": assets_html, "liabilities": liabilities_html, "equity": equity_html}
+
+# 用瀏覽器抓資產 / 負債 / 權益三張表格的 outerHTML
+def scrape_quarterly_balance_html(stock_no) -> dict:
+    with borrow_driver() as driver:
+        load_page(driver, BALANCE_URL.format(stock_no=stock_no))
+        tables = read_quarterly_balance_tables(driver)
+
+    return tables
+
+# 不開瀏覽器，直接從伺服器回傳的 HTML 取三張表；資產 / 負債 / 權益是分頁，
+# 通常只有預設那一頁在 HTML 裡，缺任何一張就回傳 None
+def fetch_quarterly_balance_html_http(stock_no):
+    return http_tables.fetch_tables(BALANCE_URL.format(stock_no=stock_no), {
+        "assets": (BALANCE_TABLE_XPATH, ("總資產",)),
+        "liabilities": (BALANCE_TABLE_XPATH, ("總負債",)),
+        "equity": (BALANCE_TABLE_XPATH, ("股東權益(淨值)",)),
+    })
+
+# HTTP 拿到的表格要往回涵蓋到 start 那一季
+def _balance_covers(tables, start) -> bool:
+    if start is None:
+        return True
+    assets_df = flatten_columns(pd.read_html(StringIO(tables["assets"]))[0])
+    return assets_df["日期"].astype(str).min() <= "%d/Q%d" % start
+
+# 只試 HTTP：三張表都在 HTML 裡而且季別夠就回傳，否則 None
+def try_quarterly_balance_html_http(stock_no, start=None):
+    return http_tables.try_http("balance-sheet", lambda: fetch_quarterly_balance_html_http(stock_no),
+                                covers=lambda tables: _balance_covers(tables, start))
+
+# 先試 HTTP，三張表不全或季別不夠才開瀏覽器
+def fetch_quarterly_balance_html(stock_no, start=None) -> dict:
+    return try_quarterly_balance_html_http(stock_no, start) or http_tables.use_browser(
+        "balance-sheet", lambda: scrape_quarterly_balance_html(stock_no))
+
+def parse_quarterly_balance_html(tables: dict):
+    assets_df = pd.read_html(StringIO(tables["assets"]))[0]
+    liabilities_df = pd.read_html(StringIO(tables["liabilities"]))[0]
+    equity_df = pd.read_html(StringIO(tables["equity"]))[0]
     return assets_df, liabilities_df, equity_df
 
+# 快取以「應該已公布的最新季別」為期別，三張表存成一份；start 是最早需要的季別
+def clawer_quarterly_balance(stock_no, period=None, start=None):
+    if period is None:
+        period = "%dQ%d" % watermark.latest_quarter()
+    with perf.stage("fetch"):
+        payload = raw_cache.cached_fetch("cmoney", "balance-sheet", stock_no, period,
+                                         lambda: json.dumps(fetch_quarterly_balance_html(stock_no, start), ensure_ascii=False))
+    with perf.stage("parse") as span:
+        tables = parse_quarterly_balance_html(json.loads(payload))
+        span.rows = len(tables[0])
+    return tables
+
 def flatten_columns(df):
     # 若 columns 是 MultiIndex → 轉成單層
     if isinstance(df.columns, pd.MultiIndex):
         df.columns = ['_'.join([str(x) for x in col]).strip() for col in df.columns]
     return df
 
-# 把三張表合併成「季資產負債」DataFrame
-def build_quarterly_balance_df(assets_df, liabilities_df, equity_df) -> pd.DataFrame:
+# 把三張表合併成「季資產負債」DataFrame，只留 start ~ end（含）的季別
+def build_quarterly_balance_df(assets_df, liabilities_df, equity_df, start=(2022, 1), end=None) -> pd.DataFrame:
     # 扁平欄位
     assets_df = flatten_columns(assets_df)
     liabilities_df = flatten_columns(liabilities_df)
@@ -87,21 +117,23 @@ def build_quarterly_balance_df(assets_df, liabilities_df, equity_df) -> pd.DataF
     )
     df["roc_year"] = df["fiscal_year"] - 1911
 
-    # 數字欄位轉成 float（目前單位：仟元）
-    for col_old, col_new in [
-        ("總資產", "total_assets"),
-        ("總負債", "total_liabilities"),
-        ("股東權益(淨值)", "total_equity"),
-    ]:
-        df[col_new] = (
-            df[col_old]
-            .astype(str)
-            .str.replace(",", "", regex=False)
-            .str.replace("-", "0", regex=False)
-        )
-        df[col_new] = pd.to_numeric(df[col_new], errors="coerce")
-
-    df = df[df["fiscal_year"] >= 2022]
+    # 數字欄位轉成 float（目前單位：仟元），三欄一次處理
+    # 只有整格是 "-"（無資料）才當 0，負數的負號要保留
+    old_cols = ["總資產", "總負債", "股東權益(淨值)"]
+    new_cols = ["total_assets", "total_liabilities", "total_equity"]
+    cleaned = (
+        df[old_cols]
+        .astype(str)
+        .replace(",", "", regex=True)
+        .replace(r"^\s*-\s*$", "0", regex=True)
+    )
+    df[new_cols] = cleaned.apply(pd.to_numeric, errors="coerce").to_numpy()
+
+    period = df["fiscal_year"] * 10 + df["fiscal_quarter"]
+    mask = period >= start[0] * 10 + start[1]
+    if end is not None:
+        mask &= period <= end[0] * 10 + end[1]
+    df = df[mask]
 
     return df[
         [
@@ -116,62 +148,62 @@ def build_quarterly_balance_df(assets_df, liabilities_df, equity_df) -> pd.DataF
 
 # 寫入 stock_quarterly_balance
 def insert_quarterly_balance_to_db(stock_no: str, df: pd.DataFrame):
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-
-    sql = """
-    INSERT INTO dbo.stock_quarterly_balance (
-        stock_no,
-        fiscal_year,
-        fiscal_quarter,
-        roc_year,
-        total_assets,
-        total_equity,
-        total_liabilities
+    columns = [
+        "stock_no",
+        "fiscal_year",
+        "fiscal_quarter",
+        "roc_year",
+        "total_assets",
+        "total_equity",
+        "total_liabilities",
+    ]
+
+    # 仟元 → 千萬元
+    scale = 1000.0 / 10_000_000.0
+    rows = build_params(
+        as_constant(stock_no, len(df)),
+        as_int(df["fiscal_year"]),
+        as_int(df["fiscal_quarter"]),
+        as_int(df["roc_year"]),
+        as_float_scaled(df["total_assets"], scale),
+        as_float_scaled(df["total_equity"], scale),
+        as_float_scaled(df["total_liabilities"], scale),
     )
-    VALUES (?, ?, ?, ?, ?, ?, ?)
-    """
-    def to_float_scaled(val):
-        # 將數值轉為 float，NaN 或無效值回傳 None 以便寫入 SQL 的 NULL
-        try:
-            if pd.isna(val):
-                return None
-            # 有些情況可能是字串空白或空字串
-            if isinstance(val, str):
-                v = val.strip()
-                if v == "":
-                    return None
-                val = float(v)
-            return float(val) * 1000.0 / 10_000_000.0
-        except Exception:
-            return None
-
-    for _, row in df.iterrows():
-        params = (
-            stock_no,
-            int(row["fiscal_year"]),
-            int(row["fiscal_quarter"]),
-            int(row["roc_year"]),
-            to_float_scaled(row.get("total_assets")),
-            to_float_scaled(row.get("total_equity")),
-            to_float_scaled(row.get("total_liabilities")),
-        )
-        try:
-            cursor.execute(sql, params)
-        except pyodbc.IntegrityError as ex:
-            print(f"  ⚠️ 重複略過 {stock_no} {row['fiscal_year']}Q{row['fiscal_quarter']}: {ex}")
-        except Exception as ex:
-            print(f"  ❌ 寫入失敗 {stock_no} {row['fiscal_year']}Q{row['fiscal_quarter']}: {ex}")
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+
+    # 以 (stock_no, fiscal_year, fiscal_quarter) 為 key MERGE，回傳 (新增筆數, 更新筆數)
+    return storage.upsert("dbo.stock_quarterly_balance", columns,
+                          ["stock_no", "fiscal_year", "fiscal_quarter"], rows)
+
+# 合併、清洗並寫入三張表（一般流程和快取重播共用）
+def save_quarterly_balance(stock_no, assets_df, liabilities_df, equity_df, start, end):
+    with perf.stage("transform") as span:
+        qb_df = build_quarterly_balance_df(assets_df, liabilities_df, equity_df, start, end)
+        span.rows = len(qb_df)
+    with perf.stage("write") as span:
+        inserted, updated = insert_quarterly_balance_to_db(stock_no, qb_df)
+        span.rows = inserted + updated
+        # 財務比率的待算清單也是寫入的一部分，失敗就算寫入失敗
+        if not qb_df.empty:
+            first = qb_df.sort_values(["fiscal_year", "fiscal_quarter"]).iloc[0]
+            fundamentals.mark_changed("quarterly", stock_no, (first["fiscal_year"], first["fiscal_quarter"]))
+    if not qb_df.empty:
+        watermark.advance("quarterly_balance", stock_no,
+                          int((qb_df["fiscal_year"] * 10 + qb_df["fiscal_quarter"]).max()))
+    print(f"✅ 已將 {stock_no} 寫入 stock_quarterly_balance，共 {len(qb_df)} 筆（新增 {inserted}、更新 {updated}）")
+    return qb_df
 
 def process_quarterly_balance_for_stock(stock_no):
+    # 只抓資料庫最新季別之後、已過公布期限的季報；已經最新就不開瀏覽器
+    missing = watermark.missing_quarter_range("quarterly_balance", stock_no)
+    if missing is None:
+        print(f"⏭️ {stock_no} 季資產負債已是最新，略過")
+        return
     try:
-        assets_df, liabilities_df, equity_df = clawer_quarterly_balance(stock_no)
-        qb_df = build_quarterly_balance_df(assets_df, liabilities_df, equity_df)
-        insert_quarterly_balance_to_db(stock_no, qb_df)
-        print(f"✅ 已將 {stock_no} 寫入 stock_quarterly_balance，共 {len(qb_df)} 筆")
+        period = "%dQ%d" % missing[1]
+        assets_df, liabilities_df, equity_df = clawer_quarterly_balance(stock_no, period, start=missing[0])
+        qb_df = save_quarterly_balance(stock_no, assets_df, liabilities_df, equity_df, *missing)
+        # 已經拿到最新一季，這份快取之後不會再變
+        if ((qb_df["fiscal_year"] == missing[1][0]) & (qb_df["fiscal_quarter"] == missing[1][1])).any():
+            raw_cache.mark_closed("cmoney", "balance-sheet", stock_no, period)
     except Exception as ex:
         print(f"❌ {stock_no} 失敗：{ex}")
\ No newline at end of file
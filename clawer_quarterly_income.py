@@ -1,57 +1,109 @@
-import time
-import selenium
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
 import pandas as pd
-import pyodbc
-from datetime import datetime
-
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;"
-    "DATABASE=Stock;"
-    "Trusted_Connection=yes;"
-)
-
-def clawer_quarterly_income(stock_no):
-    chrome_options = Options()
-    chrome_options.add_argument("--headless")
-    driver = webdriver.Chrome(service=Service(), options=chrome_options)
-
-    # 損益表格
-    driver.get(f"https://www.cmoney.tw/forum/stock/{stock_no}?s=income-statement")
-    time.sleep(5)
-
-    # 損益表按鈕
-    income_button = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[3]/div')
-    income_button.click()
-    time.sleep(3)
-
-    # 損益表格
-    income_table = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[2]')
-    income_df = pd.read_html(income_table.get_attribute('outerHTML'))[0]
-    income_df = flatten_columns(income_df)
-
-    # EPS表格
-    driver.get(f"https://www.cmoney.tw/forum/stock/{stock_no}?s=eps")
-    time.sleep(5)
+import json
+from io import StringIO
+from driver_pool import borrow_driver, load_page
+from page_wait import wait_for_element, click_and_wait_changed
+import watermark
+import raw_cache
+import storage
+import http_tables
+import perf
+import fundamentals
+from db_writer import as_int, as_float, as_float_scaled, as_constant, build_params
+
+
+INCOME_URL = "https://www.cmoney.tw/forum/stock/{stock_no}?s=income-statement"
+INCOME_TABLE_XPATH = '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[2]'
+EPS_URL = "https://www.cmoney.tw/forum/stock/{stock_no}?s=eps"
+EPS_TABLE_XPATH = '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]'
+
+# 在已經停在損益表頁的瀏覽器上取損益表格的 outerHTML
+def read_income_table(driver) -> str:
+    income_table_xpath = INCOME_TABLE_XPATH
+    wait_for_element(driver, income_table_xpath, "income-statement")
+
+    # 損益表按鈕，等表格內容更新
+    return click_and_wait_changed(
+        driver,
+        '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]/div[3]/div',
+        income_table_xpath,
+        "income-statement",
+    )
 
-    # EPS表格
-    eps_table = driver.find_element(By.XPATH, '//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[3]')
-    eps_df = pd.read_html(eps_table.get_attribute('outerHTML'))[0]
+# 在已經停在 EPS 頁的瀏覽器上取 EPS 表格的 outerHTML
+def read_eps_table(driver) -> str:
+    eps_table = wait_for_element(driver, EPS_TABLE_XPATH, "eps")
+    return eps_table.get_attribute('outerHTML')
+
+# 用瀏覽器抓損益表與 EPS 表格的 outerHTML
+def scrape_quarterly_income_html(stock_no) -> dict:
+    with borrow_driver() as driver:
+        # 損益表格
+        load_page(driver, INCOME_URL.format(stock_no=stock_no))
+        income_html = read_income_table(driver)
+
+        # EPS表格
+        load_page(driver, EPS_URL.format(stock_no=stock_no))
+        eps_html = read_eps_table(driver)
+
+    return {"income": income_html, "eps": eps_html}
+
+# 不開瀏覽器，直接從伺服器回傳的 HTML 取損益表與 EPS 表；任一張不在 HTML 裡就回傳 None
+def fetch_quarterly_income_html_http(stock_no):
+    income = http_tables.fetch_tables(INCOME_URL.format(stock_no=stock_no),
+                                      {"income": (INCOME_TABLE_XPATH, ("稅後淨利",))})
+    if income is None:
+        return None
+    eps = http_tables.fetch_tables(EPS_URL.format(stock_no=stock_no),
+                                   {"eps": (EPS_TABLE_XPATH, ("每股盈餘",))})
+    if eps is None:
+        return None
+    return {**income, **eps}
+
+# HTTP 拿到的損益表要往回涵蓋到 start 那一季
+def _income_covers(tables, start) -> bool:
+    if start is None:
+        return True
+    income_df = flatten_columns(pd.read_html(StringIO(tables["income"]))[0])
+    return income_df["日期"].astype(str).min() <= "%d/Q%d" % start
+
+# 只試 HTTP：兩張表都在 HTML 裡而且季別夠就回傳，否則 None
+def try_quarterly_income_html_http(stock_no, start=None):
+    return http_tables.try_http("income-statement", lambda: fetch_quarterly_income_html_http(stock_no),
+                                covers=lambda tables: _income_covers(tables, start))
+
+# 先試 HTTP，表格不全或季別不夠才開瀏覽器
+def fetch_quarterly_income_html(stock_no, start=None) -> dict:
+    return try_quarterly_income_html_http(stock_no, start) or http_tables.use_browser(
+        "income-statement", lambda: scrape_quarterly_income_html(stock_no))
+
+def parse_quarterly_income_html(tables: dict):
+    income_df = pd.read_html(StringIO(tables["income"]))[0]
+    income_df = flatten_columns(income_df)
+    eps_df = pd.read_html(StringIO(tables["eps"]))[0]
     eps_df = flatten_columns(eps_df)
-
     return income_df, eps_df
 
+# 快取以「應該已公布的最新季別」為期別，兩張表存成一份；start 是最早需要的季別
+def clawer_quarterly_income(stock_no, period=None, start=None):
+    if period is None:
+        period = "%dQ%d" % watermark.latest_quarter()
+    with perf.stage("fetch"):
+        payload = raw_cache.cached_fetch("cmoney", "income-statement", stock_no, period,
+                                         lambda: json.dumps(fetch_quarterly_income_html(stock_no, start), ensure_ascii=False))
+    with perf.stage("parse") as span:
+        tables = parse_quarterly_income_html(json.loads(payload))
+        span.rows = len(tables[0])
+    return tables
+
 def flatten_columns(df):
     # 若 columns 是 MultiIndex → 轉成單層
     if isinstance(df.columns, pd.MultiIndex):
         df.columns = ['_'.join([str(x) for x in col]).strip() for col in df.columns]
     return df
 
-def build_quarterly_income_df(df_income: pd.DataFrame, df_eps: pd.DataFrame) -> pd.DataFrame:
+# 合併損益表 + EPS，只留 start ~ end（含）的季別（都不給就全部保留）
+def build_quarterly_income_df(df_income: pd.DataFrame, df_eps: pd.DataFrame, start=None, end=None) -> pd.DataFrame:
     # --- 損益表處理 ---
     inc = df_income.copy()
     # 確保欄位名稱正確
@@ -106,6 +158,14 @@ def build_quarterly_income_df(df_income: pd.DataFrame, df_eps: pd.DataFrame) ->
         how="left"
     )
 
+    period = df["fiscal_year"] * 10 + df["fiscal_quarter"]
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= period >= start[0] * 10 + start[1]
+    if end is not None:
+        mask &= period <= end[0] * 10 + end[1]
+    df = df[mask]
+
     df = df[[
         "fiscal_year",
         "fiscal_quarter",
@@ -120,68 +180,66 @@ def build_quarterly_income_df(df_income: pd.DataFrame, df_eps: pd.DataFrame) ->
     return df
 
 def insert_quarterly_income_to_db(stock_no: str, df: pd.DataFrame):
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-
-    sql = """
-    INSERT INTO dbo.stock_quarterly_income (
-        stock_no,
-        fiscal_year,
-        fiscal_quarter,
-        roc_year,
-        revenue,
-        gross_profit,
-        operating_income,
-        net_income,
-        eps_basic
+    columns = [
+        "stock_no",
+        "fiscal_year",
+        "fiscal_quarter",
+        "roc_year",
+        "revenue",
+        "gross_profit",
+        "operating_income",
+        "net_income",
+        "eps_basic",
+    ]
+
+    # 仟元 → 千萬元
+    scale = 1000.0 / 10_000_000.0
+    rows = build_params(
+        as_constant(stock_no, len(df)),
+        as_int(df["fiscal_year"]),
+        as_int(df["fiscal_quarter"]),
+        as_int(df["roc_year"]),
+        as_float_scaled(df["revenue"], scale),
+        as_float_scaled(df["gross_profit"], scale),
+        as_float_scaled(df["operating_income"], scale),
+        as_float_scaled(df["net_income"], scale),
+        as_float(df["eps_basic"]),
     )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """
-
-    def to_float_scaled(val):
-        # 將數值轉為 float，NaN 或無效值回傳 None 以便寫入 SQL 的 NULL
-        try:
-            if pd.isna(val):
-                return None
-            # 有些情況可能是字串空白或空字串
-            if isinstance(val, str):
-                v = val.strip()
-                if v == "":
-                    return None
-                val = float(v)
-            return float(val) * 1000.0 / 10_000_000.0
-        except Exception:
-            return None
-
-    for _, row in df.iterrows():
-        params = (
-            stock_no,
-            int(row["fiscal_year"]),
-            int(row["fiscal_quarter"]),
-            int(row["roc_year"]),
-            to_float_scaled(row.get("revenue")),
-            to_float_scaled(row.get("gross_profit")),
-            to_float_scaled(row.get("operating_income")),
-            to_float_scaled(row.get("net_income")),
-            row["eps_basic"]
-        )
-
-        try:
-            cursor.execute(sql, params)
-        except pyodbc.IntegrityError as ex:
-                print(f"  ⚠️ 略過重複 {stock_no} {row['fiscal_year']}Q{row['fiscal_quarter']}: {ex}")
-        except Exception as ex:
-            print(f"  ❌ 寫入失敗 {stock_no} {row['fiscal_year']}Q{row['fiscal_quarter']}: {ex}")
-
-    conn.commit()
-    cursor.close()
-    conn.close()
+
+    # 以 (stock_no, fiscal_year, fiscal_quarter) 為 key MERGE，回傳 (新增筆數, 更新筆數)
+    return storage.upsert("dbo.stock_quarterly_income", columns,
+                          ["stock_no", "fiscal_year", "fiscal_quarter"], rows)
+
+# 合併、清洗並寫入損益表 + EPS（一般流程和快取重播共用）
+def save_quarterly_income(stock_no, income_table, eps_table, start, end):
+    with perf.stage("transform") as span:
+        qi_df = build_quarterly_income_df(income_table, eps_table, start, end)
+        span.rows = len(qi_df)
+    with perf.stage("write") as span:
+        inserted, updated = insert_quarterly_income_to_db(stock_no, qi_df)
+        span.rows = inserted + updated
+        # 財務比率的待算清單也是寫入的一部分，失敗就算寫入失敗
+        if not qi_df.empty:
+            first = qi_df.sort_values(["fiscal_year", "fiscal_quarter"]).iloc[0]
+            fundamentals.mark_changed("quarterly", stock_no, (first["fiscal_year"], first["fiscal_quarter"]))
+    if not qi_df.empty:
+        watermark.advance("quarterly_income", stock_no,
+                          int((qi_df["fiscal_year"] * 10 + qi_df["fiscal_quarter"]).max()))
+    print(f"✅ 已將 {stock_no} 寫入 stock_quarterly_income，共 {len(qi_df)} 筆（新增 {inserted}、更新 {updated}）")
+    return qi_df
 
 def process_quarterly_income_for_stock(stock_no):
+    # 只抓資料庫最新季別之後、已過公布期限的季報；已經最新就不開瀏覽器
+    missing = watermark.missing_quarter_range("quarterly_income", stock_no)
+    if missing is None:
+        print(f"⏭️ {stock_no} 季損益已是最新，略過")
+        return
     try:
-        income_table, eps_table = clawer_quarterly_income(stock_no)
-        qi_df = build_quarterly_income_df(income_table, eps_table)
-        insert_quarterly_income_to_db(stock_no, qi_df)
-        print(f"✅ 已將 {stock_no} 寫入 stock_quarterly_income，共 {len(qi_df)} 筆")
+        period = "%dQ%d" % missing[1]
+        income_table, eps_table = clawer_quarterly_income(stock_no, period, start=missing[0])
+        qi_df = save_quarterly_income(stock_no, income_table, eps_table, *missing)
+        # 已經拿到最新一季，這份快取之後不會再變
+        if ((qi_df["fiscal_year"] == missing[1][0]) & (qi_df["fiscal_quarter"] == missing[1][1])).any():
+            raw_cache.mark_closed("cmoney", "income-statement", stock_no, period)
     except Exception as ex:
         print(f"❌ {stock_no} 失敗：{ex}")
\ No newline at end of file
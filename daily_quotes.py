@@ -1,20 +1,19 @@
 from lxml import html
-import requests
-import pyodbc
 from datetime import datetime
+import http_tables
+import raw_cache
+import storage
+from clawer_daily_quotes import DAILY_QUOTES_TABLE, DAILY_QUOTES_COLUMNS, DAILY_QUOTES_KEYS
 
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;" 
-    "DATABASE=Stock;"
-    "Trusted_Connection=yes;"
-)
+# 取節點文字並去掉千分位
+def _text(node) -> str:
+    return node.text_content().strip().replace(",", "")
 
 def fetch_daily_quote(stock_no):
     url = f"https://www.cmoney.tw/forum/stock/{stock_no}"
-    response = requests.get(url)
-    byte_data = response.content
-    source_code = html.fromstring(byte_data)
+    page = raw_cache.cached_fetch("cmoney", "quote", stock_no, datetime.now().strftime("%Y%m%d"),
+                                  lambda: http_tables.fetch_page(url))
+    source_code = html.fromstring(page)
 
     prev_close = source_code.xpath('//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]/div[2]/div[1]/div[1]/div[6]/span[2]')[0]
     open_price = source_code.xpath('//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]/div[2]/div[1]/div[1]/div[2]/span[2]')[0]
@@ -23,41 +22,24 @@ def fetch_daily_quote(stock_no):
     last_price = source_code.xpath('//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]/div[2]/div[1]/div[1]/div[1]/span[2]')[0]
     volume_lots = source_code.xpath('//*[@id="StockRevPanel"]/div[3]/div[2]/section/div/div[2]/div[2]/div[1]/div[2]/div[7]/span[2]')[0]
 
-    # 寫入資料庫
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-    cursor.execute("""
-    INSERT INTO dbo.stock_daily_quotes (
-        stock_no,
-        trade_date,
-        last_price,
-        open_price,
-        high_price,
-        low_price,
-        prev_close,
-        volume_lots,
-        volume_shares
-    )
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
+    # 寫入資料庫（走 storage，--db-backend / --sqlite-path 也適用）
+    # 股票代號寫在 stock_id 欄（跟 clawer_daily_quotes、schema 一致）；
+    # 以前這裡的 INSERT 寫的是 stock_daily_quotes 沒有的 stock_no 欄
+    lots = int(_text(volume_lots))
+    row = (
         stock_no,
         datetime.now().date(),
-        last_price.text_content().strip().replace(",", ""),
-        open_price.text_content().strip().replace(",", ""),
-        high_price.text_content().strip().replace(",", ""),
-        low_price.text_content().strip().replace(",", ""),
-        prev_close.text_content().strip().replace(",", ""),
-        volume_lots.text_content().strip().replace(",", ""),
-        int(volume_lots.text_content().strip().replace(",", "")) * 1000
-    ))
-
+        float(_text(last_price)),
+        float(_text(open_price)),
+        float(_text(high_price)),
+        float(_text(low_price)),
+        float(_text(prev_close)),
+        lots,
+        lots * 1000,
+    )
+    storage.upsert(DAILY_QUOTES_TABLE, DAILY_QUOTES_COLUMNS, DAILY_QUOTES_KEYS, [row])
     print(f"Inserted daily quote for stock {stock_no}")
 
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-
 if __name__ == "__main__":
     stock_no = "2330"  # Example stock number
     fetch_daily_quote(stock_no)
\ No newline at end of file
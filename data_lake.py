@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import storage
+
+# ======= 設定區 =======
+
+LAKE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data_lake")
+STATE_PATH = os.path.join(LAKE_DIR, "_state.json")
+COMPRESSION = "zstd"
+
+# 每個資料集：來源資料表、key、期別（SQL 條件與匯出後記下的最後一期）、年份（分區用）
+LAKE_DATASETS = {
+    "daily_quotes": {
+        "table": "dbo.stock_daily_quotes",
+        "keys": ["stock_id", "trade_date"],
+        "period_sql": "trade_date",
+        "last_period": lambda df: df["trade_date"].max().strftime("%Y-%m-%d"),
+        "year": lambda df: df["trade_date"].dt.year,
+    },
+    "monthly_revenue": {
+        "table": "dbo.stock_monthly_revenue",
+        "keys": ["stock_no", "year", "month"],
+        "period_sql": "year * 100 + month",
+        "last_period": lambda df: int((df["year"] * 100 + df["month"]).max()),
+        "year": lambda df: df["year"],
+    },
+    "quarterly_balance": {
+        "table": "dbo.stock_quarterly_balance",
+        "keys": ["stock_no", "fiscal_year", "fiscal_quarter"],
+        "period_sql": "fiscal_year * 10 + fiscal_quarter",
+        "last_period": lambda df: int((df["fiscal_year"] * 10 + df["fiscal_quarter"]).max()),
+        "year": lambda df: df["fiscal_year"],
+    },
+    "quarterly_income": {
+        "table": "dbo.stock_quarterly_income",
+        "keys": ["stock_no", "fiscal_year", "fiscal_quarter"],
+        "period_sql": "fiscal_year * 10 + fiscal_quarter",
+        "last_period": lambda df: int((df["fiscal_year"] * 10 + df["fiscal_quarter"]).max()),
+        "year": lambda df: df["fiscal_year"],
+    },
+}
+
+_lock = threading.Lock()
+
+
+# ======= 路徑與匯出進度 =======
+
+def _partition_path(dataset, year):
+    return os.path.join(LAKE_DIR, dataset, f"year={int(year)}", "data.parquet")
+
+
+def _years(dataset):
+    root = os.path.join(LAKE_DIR, dataset)
+    if not os.path.isdir(root):
+        return []
+    return sorted(int(name[5:]) for name in os.listdir(root) if name.startswith("year="))
+
+
+def _load_state() -> dict:
+    try:
+        with open(STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state):
+    os.makedirs(LAKE_DIR, exist_ok=True)
+    tmp = STATE_PATH + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, STATE_PATH)
+
+
+# ======= 匯出（資料庫 → Parquet） =======
+
+# 日期欄統一成 datetime64，股票代號統一成字串（SQL Server / SQLite 讀出來的型別不一樣）
+def _normalize(dataset, df):
+    if dataset == "daily_quotes":
+        df["trade_date"] = pd.to_datetime(df["trade_date"])
+    for col in ("stock_id", "stock_no"):
+        if col in df.columns:
+            df[col] = df[col].astype(str).str.strip()
+    return df
+
+
+def _write_partition(dataset, year, df, keys):
+    path = _partition_path(dataset, year)
+    if os.path.exists(path):
+        old = pq.read_table(path).to_pandas()
+        df = pd.concat([old, df], ignore_index=True)
+    # 同一個 key 保留最新匯出的那筆（資料庫裡被 MERGE 更新過的值）
+    df = df.drop_duplicates(keys, keep="last").sort_values(keys).reset_index(drop=True)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp, compression=COMPRESSION)
+    os.replace(tmp, path)
+    return len(df)
+
+
+def _literal(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'" if isinstance(value, str) else str(int(value))
+
+
+# 每支股票各自從自己上次匯出的最後一期（含）開始拿；還沒匯出過的股票全部拿
+# 同一期的股票併成一個條件：(期別 >= x AND 股票 IN (...)) OR ... OR 股票 NOT IN (已匯出的)
+def _since_clause(spec, marks: dict) -> str:
+    stock_col = spec["keys"][0]
+    by_period = {}
+    for stock_no, period in marks.items():
+        by_period.setdefault(period, []).append(stock_no)
+    parts = [
+        f"({spec['period_sql']} >= {_literal(period)} AND {stock_col} IN ({', '.join(map(_literal, stocks))}))"
+        for period, stocks in by_period.items()
+    ]
+    parts.append(f"{stock_col} NOT IN ({', '.join(map(_literal, marks))})")
+    return " OR ".join(parts)
+
+
+# 匯出一個資料集：每支股票只拿它上次匯出的最後一期（含）之後的資料，依年份併進各分區
+# 最後一期重拿是因為那一期可能還在補資料；某支股票當天失敗、隔天重試補上的舊期別，
+# 或新加入的股票補抓的歷史，都比它自己的最後一期新，不會漏；full=True 全部重匯
+def export_dataset(dataset, full=False) -> int:
+    spec = LAKE_DATASETS[dataset]
+    state = _load_state()
+    marks = {} if full else state.get(dataset)
+    # 舊版的 _state.json 只有一個全資料集的期別，分不出每支股票到哪裡，整份重匯一次
+    if not isinstance(marks, dict):
+        marks = {}
+
+    sql = f"SELECT * FROM {spec['table']}"
+    if marks:
+        sql += f" WHERE {_since_clause(spec, marks)}"
+    df = storage.read_sql(sql)
+    if df.empty:
+        return 0
+
+    df = _normalize(dataset, df)
+    years = spec["year"](df)
+    for year, part in df.groupby(years):
+        _write_partition(dataset, year, part, spec["keys"])
+
+    marks.update({stock_no: spec["last_period"](part) for stock_no, part in df.groupby(spec["keys"][0])})
+    state[dataset] = marks
+    _save_state(state)
+    return len(df)
+
+
+# 每次執行完把新資料接到 data lake 後面
+def sync(full=False):
+    with _lock:
+        for dataset in LAKE_DATASETS:
+            try:
+                n = export_dataset(dataset, full)
+                if n:
+                    print(f"✅ data lake {dataset}：匯出 {n} 筆")
+            except Exception as ex:
+                print(f"❌ data lake {dataset} 匯出失敗：{ex}")
+
+
+# ======= 讀取（memory-map，不經過資料庫） =======
+
+# 讀一個資料集；years 給了只開那幾年的分區，columns 只讀需要的欄位
+def read_dataset(dataset, years=None, columns=None, filters=None) -> pd.DataFrame:
+    wanted = _years(dataset) if years is None else [y for y in _years(dataset) if y in set(years)]
+    tables = [
+        pq.read_table(_partition_path(dataset, y), columns=columns, filters=filters, memory_map=True)
+        for y in wanted
+    ]
+    if not tables:
+        return pd.DataFrame(columns=columns)
+    return pa.concat_tables(tables).to_pandas()
+
+
+# 日期 × 股票 的收盤價矩陣（也可以換成其他欄位，例如 volume_lots）
+def price_matrix(start=None, end=None, stock_nos=None, field="last_price") -> pd.DataFrame:
+    start = pd.Timestamp(start) if start is not None else None
+    end = pd.Timestamp(end) if end is not None else None
+    years = None
+    if start is not None or end is not None:
+        lo = start.year if start is not None else 0
+        hi = end.year if end is not None else 9999
+        years = [y for y in _years("daily_quotes") if lo <= y <= hi]
+
+    filters = []
+    if start is not None:
+        filters.append(("trade_date", ">=", start))
+    if end is not None:
+        filters.append(("trade_date", "<=", end))
+    if stock_nos is not None:
+        filters.append(("stock_id", "in", [str(s) for s in stock_nos]))
+
+    df = read_dataset("daily_quotes", years, ["stock_id", "trade_date", field], filters or None)
+    return df.pivot(index="trade_date", columns="stock_id", values=field).sort_index()
@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+import time
+import urllib
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
+
+# ======= 設定區 =======
+
+# 預設值；可在 appsettings.json 的 "Database" 區段或環境變數覆寫
+DEFAULT_SETTINGS = {
+    "Backend": "sqlserver",             # sqlserver 或 sqlite（本機單一檔案，不需要 SQL Server）
+    "SqlitePath": "stock.sqlite3",      # sqlite 檔案路徑（相對路徑以專案目錄為準）
+    "ConnectionString": (
+        "DRIVER={ODBC Driver 17 for SQL Server};"
+        "SERVER=localhost;"
+        "DATABASE=Stock;"
+        "Trusted_Connection=yes;"
+    ),
+    "PoolSize": 5,          # 常駐連線數
+    "MaxOverflow": 5,       # 尖峰時可以多開的連線數
+    "PoolTimeout": 30,      # 等待可用連線的上限（秒）
+    "PoolRecycle": 1800,    # 連線用多久後重建（秒）
+}
+SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "appsettings.json")
+
+_engine = None
+_lock = threading.Lock()
+_overrides = {}
+
+# 連線池統計
+_metrics = {"connects": 0, "checkouts": 0, "checkins": 0, "wait_total": 0.0, "wait_max": 0.0}
+_metrics_lock = threading.Lock()
+
+
+def load_settings() -> dict:
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(SETTINGS_PATH, encoding="utf-8") as f:
+            settings.update(json.load(f).get("Database", {}))
+    except (OSError, ValueError):
+        pass
+    if os.environ.get("STOCK_DB_CONN_STR"):
+        settings["ConnectionString"] = os.environ["STOCK_DB_CONN_STR"]
+    if os.environ.get("STOCK_DB_BACKEND"):
+        settings["Backend"] = os.environ["STOCK_DB_BACKEND"]
+    if os.environ.get("STOCK_DB_SQLITE_PATH"):
+        settings["SqlitePath"] = os.environ["STOCK_DB_SQLITE_PATH"]
+    settings.update(_overrides)
+    return settings
+
+
+# 在第一次連線前調整設定，例如平行執行時 configure(PoolSize=workers)
+def configure(**overrides):
+    global _engine
+    with _lock:
+        _overrides.update(overrides)
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def _count(event_name):
+    def listener(*args):
+        with _metrics_lock:
+            _metrics[event_name] += 1
+    return listener
+
+
+def get_engine():
+    global _engine
+    with _lock:
+        if _engine is None:
+            settings = load_settings()
+            # 要將 ODBC 字串變成適用於 URL 的格式
+            params = urllib.parse.quote_plus(settings["ConnectionString"])
+            _engine = create_engine(
+                f"mssql+pyodbc:///?odbc_connect={params}",
+                pool_size=settings["PoolSize"],
+                max_overflow=settings["MaxOverflow"],
+                pool_timeout=settings["PoolTimeout"],
+                pool_recycle=settings["PoolRecycle"],
+                pool_pre_ping=True,
+            )
+            event.listen(_engine, "connect", _count("connects"))
+            event.listen(_engine, "checkout", _count("checkouts"))
+            event.listen(_engine, "checkin", _count("checkins"))
+        return _engine
+
+
+# 從連線池借一條 pyodbc 連線，離開 with 就還回去（不是真的關掉）
+@contextmanager
+def get_connection():
+    started = time.perf_counter()
+    conn = get_engine().raw_connection()
+    waited = time.perf_counter() - started
+    with _metrics_lock:
+        _metrics["wait_total"] += waited
+        _metrics["wait_max"] = max(_metrics["wait_max"], waited)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def pool_metrics() -> dict:
+    with _metrics_lock:
+        metrics = dict(_metrics)
+    metrics["wait_avg"] = metrics["wait_total"] / metrics["checkouts"] if metrics["checkouts"] else 0.0
+    if _engine is not None:
+        metrics["pool_status"] = _engine.pool.status()
+    return metrics
+
+
+def print_pool_metrics():
+    m = pool_metrics()
+    print(f"🗄️ DB 連線池：實際登入 {m['connects']} 次、借出 {m['checkouts']} 次、"
+          f"平均等待 {m['wait_avg'] * 1000:.1f}ms、最長等待 {m['wait_max'] * 1000:.1f}ms")
+
+
+def dispose():
+    global _engine
+    with _lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
@@ -0,0 +1,278 @@
+import numpy as np
+import pandas as pd
+
+# ======= 設定區 =======
+
+BATCH_SIZE = 500   # 每次 executemany 送出的筆數
+
+
+# ======= 欄位轉換（整欄一次轉，取代逐列 iterrows） =======
+
+def _nullable(values: pd.Series) -> list:
+    # NaN / NaT 轉成 None，寫入 SQL 的 NULL
+    values = values.astype(object)
+    return values.where(values.notna(), None).tolist()
+
+
+def as_value(series: pd.Series) -> list:
+    return _nullable(series)
+
+
+def as_int(series: pd.Series) -> list:
+    return series.astype("int64").tolist()
+
+
+def as_float(series: pd.Series) -> list:
+    return _nullable(pd.to_numeric(series, errors="coerce").astype(float))
+
+
+# 同原本各模組的 to_float_scaled：空白、NaN、無法轉換 → None，其餘乘上 factor
+def as_float_scaled(series: pd.Series, factor: float) -> list:
+    if series.dtype == object:
+        series = series.astype(str).str.strip().replace("", np.nan)
+    return _nullable(pd.to_numeric(series, errors="coerce").astype(float) * factor)
+
+
+def as_constant(value, n: int) -> list:
+    return [value] * n
+
+
+# 把一欄一欄的 list 組成 executemany 要的參數 tuple
+def build_params(*columns) -> list:
+    return list(zip(*columns))
+
+
+# ======= 批次寫入 =======
+
+# 一次送 batch_size 筆；某一批失敗就 rollback 那一批，改成逐筆寫入，
+# 讓 on_row_error 照原本的方式回報是哪一筆出錯（例如重複略過）
+def insert_batched(conn, sql: str, rows: list, on_row_error, batch_size: int = BATCH_SIZE) -> int:
+    cursor = conn.cursor()
+    if hasattr(cursor, "fast_executemany"):   # pyodbc 才有（sqlite3 沒有）
+        cursor.fast_executemany = True
+    inserted = 0
+
+    for start in range(0, len(rows), batch_size):
+        chunk = rows[start:start + batch_size]
+        try:
+            cursor.executemany(sql, chunk)
+            conn.commit()
+            inserted += len(chunk)
+            continue
+        except Exception:
+            conn.rollback()
+
+        for params in chunk:
+            try:
+                cursor.execute(sql, params)
+                inserted += 1
+            except Exception as ex:
+                on_row_error(params, ex)
+        conn.commit()
+
+    cursor.close()
+    return inserted
+
+
+# ======= 暫存表 + MERGE（重跑時不再靠 IntegrityError 一筆一筆擋重複） =======
+
+def _dedupe(rows: list, key_idx: list) -> list:
+    # 同一批資料裡 key 重複時 MERGE 會失敗，保留最後一筆
+    latest = {}
+    for params in rows:
+        latest[tuple(params[i] for i in key_idx)] = params
+    return list(latest.values())
+
+
+def _merge_sql(table: str, stage: str, columns: list, key_columns: list) -> str:
+    value_columns = [c for c in columns if c not in key_columns]
+    # key 可能是 NULL（例如還沒公布的除息日），用 NULL-safe 的比對
+    on = " AND ".join(
+        f"(t.{c} = s.{c} OR (t.{c} IS NULL AND s.{c} IS NULL))" for c in key_columns
+    )
+    col_list = ", ".join(columns)
+    src_list = ", ".join(f"s.{c}" for c in columns)
+
+    update = ""
+    if value_columns:
+        # EXCEPT 會把 NULL 視為相等，只有真的有變才更新
+        changed = (
+            f"EXISTS (SELECT {', '.join(f's.{c}' for c in value_columns)} "
+            f"EXCEPT SELECT {', '.join(f't.{c}' for c in value_columns)})"
+        )
+        set_list = ", ".join(f"t.{c} = s.{c}" for c in value_columns)
+        update = f"WHEN MATCHED AND {changed} THEN UPDATE SET {set_list}"
+
+    return f"""
+    SET NOCOUNT ON;
+    DECLARE @actions TABLE (act NVARCHAR(10));
+    MERGE {table} AS t
+    USING {stage} AS s
+    ON {on}
+    {update}
+    WHEN NOT MATCHED BY TARGET THEN INSERT ({col_list}) VALUES ({src_list})
+    OUTPUT $action INTO @actions;
+    SELECT
+        COALESCE(SUM(CASE WHEN act = 'INSERT' THEN 1 ELSE 0 END), 0),
+        COALESCE(SUM(CASE WHEN act = 'UPDATE' THEN 1 ELSE 0 END), 0)
+    FROM @actions;
+    """
+
+
+# 把 rows 丟進暫存表（欄位型別直接複製目標表），再用一個 MERGE 寫入：
+# 新的新增、有變的更新、一樣的略過。回傳 (新增筆數, 更新筆數)
+def upsert_merge(conn, table: str, columns: list, key_columns: list, rows: list,
+                 batch_size: int = BATCH_SIZE):
+    if not rows:
+        return 0, 0
+
+    rows = _dedupe(rows, [columns.index(c) for c in key_columns])
+    stage = "#stage_" + table.split(".")[-1]
+    col_list = ", ".join(columns)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"IF OBJECT_ID('tempdb..{stage}') IS NOT NULL DROP TABLE {stage};")
+        cursor.execute(f"SELECT TOP 0 {col_list} INTO {stage} FROM {table};")
+
+        cursor.fast_executemany = True
+        stage_sql = f"INSERT INTO {stage} ({col_list}) VALUES ({', '.join('?' * len(columns))})"
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(stage_sql, rows[start:start + batch_size])
+
+        cursor.execute(_merge_sql(table, stage, columns, key_columns))
+        inserted, updated = cursor.fetchone()
+        cursor.execute(f"DROP TABLE {stage};")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return int(inserted), int(updated)
+
+
+# ======= SQLite 版的 upsert（本機 storage backend 用） =======
+
+def _sqlite_upsert_sql(table: str, stage: str, columns: list, key_columns: list):
+    value_columns = [c for c in columns if c not in key_columns]
+    # IS 是 SQLite 的 NULL-safe 比較
+    match = " AND ".join(f"t.{c} IS s.{c}" for c in key_columns)
+    col_list = ", ".join(columns)
+
+    update = None
+    if value_columns:
+        set_list = ", ".join(f"{c} = s.{c}" for c in value_columns)
+        same = " AND ".join(f"t.{c} IS s.{c}" for c in value_columns)
+        update = f"UPDATE {table} AS t SET {set_list} FROM {stage} AS s WHERE {match} AND NOT ({same})"
+    insert = (
+        f"INSERT INTO {table} ({col_list}) SELECT {col_list} FROM {stage} AS s "
+        f"WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {match})"
+    )
+    return update, insert
+
+
+# 同 upsert_merge：先整批 append 到暫存表，再一次 UPDATE 有變的、INSERT 新的
+def upsert_sqlite(conn, table: str, columns: list, key_columns: list, rows: list,
+                  batch_size: int = BATCH_SIZE):
+    if not rows:
+        return 0, 0
+
+    rows = _dedupe(rows, [columns.index(c) for c in key_columns])
+    stage = "temp.stage_" + table
+    col_list = ", ".join(columns)
+    update_sql, insert_sql = _sqlite_upsert_sql(table, stage, columns, key_columns)
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP TABLE IF EXISTS {stage}")
+        cursor.execute(f"CREATE TEMP TABLE stage_{table} AS SELECT {col_list} FROM {table} WHERE 0")
+        stage_sql = f"INSERT INTO {stage} ({col_list}) VALUES ({', '.join('?' * len(columns))})"
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(stage_sql, rows[start:start + batch_size])
+
+        updated = 0
+        if update_sql:
+            cursor.execute(update_sql)
+            updated = cursor.rowcount
+        cursor.execute(insert_sql)
+        inserted = cursor.rowcount
+        cursor.execute(f"DROP TABLE {stage}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return inserted, updated
+
+
+# ======= 整組取代（key 不唯一的資料，例如還沒公布除息日的股利） =======
+
+# 刪掉符合 match 的舊資料、寫入 rows，同一個 transaction；match 的值是 None 時比對 IS NULL
+# 回傳 (寫入筆數, 刪除筆數)
+def replace_rows(conn, table: str, columns: list, match: dict, rows: list, batch_size: int = BATCH_SIZE):
+    where = " AND ".join(f"{c} IS NULL" if v is None else f"{c} = ?" for c, v in match.items())
+    params = [v for v in match.values() if v is not None]
+    insert_sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DELETE FROM {table} WHERE {where}", params)
+        deleted = cursor.rowcount
+        if hasattr(cursor, "fast_executemany") and rows:   # pyodbc 才有（sqlite3 沒有）
+            cursor.fast_executemany = True
+        for start in range(0, len(rows), batch_size):
+            cursor.executemany(insert_sql, rows[start:start + batch_size])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return len(rows), max(deleted, 0)
+
+
+# ======= 依 key 整批刪除 =======
+
+def _delete_staged(conn, table: str, stage: str, create_stage: list, key_columns: list, keys: list,
+                   batch_size: int):
+    if not keys:
+        return 0
+    col_list = ", ".join(key_columns)
+    match = " AND ".join(f"s.{c} = {table}.{c}" for c in key_columns)
+
+    cursor = conn.cursor()
+    try:
+        for sql in create_stage:
+            cursor.execute(sql)
+        if hasattr(cursor, "fast_executemany"):   # pyodbc 才有（sqlite3 沒有）
+            cursor.fast_executemany = True
+        stage_sql = f"INSERT INTO {stage} ({col_list}) VALUES ({', '.join('?' * len(key_columns))})"
+        for start in range(0, len(keys), batch_size):
+            cursor.executemany(stage_sql, keys[start:start + batch_size])
+        cursor.execute(f"DELETE FROM {table} WHERE EXISTS (SELECT 1 FROM {stage} AS s WHERE {match})")
+        deleted = cursor.rowcount
+        cursor.execute(f"DROP TABLE {stage}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return max(deleted, 0)
+
+
+# 把要刪的 key 丟進暫存表，再用一個 DELETE ... EXISTS 刪掉；回傳刪除筆數
+def delete_keys(conn, table: str, key_columns: list, keys: list, batch_size: int = BATCH_SIZE) -> int:
+    stage = "#delete_" + table.split(".")[-1]
+    create = [f"IF OBJECT_ID('tempdb..{stage}') IS NOT NULL DROP TABLE {stage};",
+              f"SELECT TOP 0 {', '.join(key_columns)} INTO {stage} FROM {table};"]
+    return _delete_staged(conn, table, stage, create, key_columns, keys, batch_size)
+
+
+def delete_keys_sqlite(conn, table: str, key_columns: list, keys: list, batch_size: int = BATCH_SIZE) -> int:
+    stage = "temp.delete_" + table
+    create = [f"DROP TABLE IF EXISTS {stage}",
+              f"CREATE TEMP TABLE delete_{table} AS SELECT {', '.join(key_columns)} FROM {table} WHERE 0"]
+    return _delete_staged(conn, table, stage, create, key_columns, keys, batch_size)
@@ -0,0 +1,251 @@
+import atexit
+import threading
+import time
+from contextlib import contextmanager
+
+import psutil
+from selenium.common.exceptions import TimeoutException, WebDriverException
+
+import browser_profile
+import host_limit
+from host_limit import host_slot
+import perf
+
+# ======= 設定區 =======
+
+POOL_SIZE = 2                 # 同時存在的 Chrome 數量上限
+MAX_PAGES_PER_DRIVER = 50     # 每個 Chrome 開過幾頁後就重開
+MAX_MEMORY_MB = 1024          # Chrome（含子行程）記憶體超過就重開
+PAGE_LOAD_TIMEOUT = 60        # 單頁載入逾時（秒），避免卡死
+ACQUIRE_TIMEOUT = 300         # 等待可用 Chrome 的上限（秒）
+
+
+# 建立一個新的 headless Chrome（精簡設定：擋圖片 / 字型 / 廣告追蹤、eager 載入，見 browser_profile）
+def create_driver():
+    return browser_profile.create_driver(page_load_timeout=PAGE_LOAD_TIMEOUT)
+
+
+# 取得 chromedriver 行程（含所有 Chrome 子行程）
+def _driver_processes(driver):
+    try:
+        pid = driver.service.process.pid
+        proc = psutil.Process(pid)
+        return [proc] + proc.children(recursive=True)
+    except Exception:
+        return []
+
+
+# Chrome 佔用的記憶體（MB）
+def driver_memory_mb(driver) -> float:
+    total = 0
+    for proc in _driver_processes(driver):
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / 1024 / 1024
+
+
+# 檢查 Chrome 是否還活著、還能回應
+def is_driver_alive(driver) -> bool:
+    try:
+        if driver.service.process.poll() is not None:
+            return False
+        driver.execute_script("return 1")
+        return True
+    except Exception:
+        return False
+
+
+# 關閉 Chrome，quit 失敗就直接把行程砍掉
+def kill_driver(driver):
+    procs = _driver_processes(driver)
+    try:
+        driver.quit()
+    except Exception:
+        pass
+    for proc in procs:
+        try:
+            if proc.is_running():
+                proc.kill()
+        except psutil.Error:
+            pass
+
+
+class DriverPool:
+    """共用的 Chrome 池：借出 / 歸還、超過頁數或記憶體就重開、死掉的直接回收"""
+
+    def __init__(self, size=POOL_SIZE, max_pages=MAX_PAGES_PER_DRIVER, max_memory_mb=MAX_MEMORY_MB):
+        self.size = size
+        self.max_pages = max_pages
+        self.max_memory_mb = max_memory_mb
+        self._idle = []        # 閒置中的 driver
+        self._pages = {}       # id(driver) -> 已開頁數
+        self._all = {}         # id(driver) -> driver（含借出中的）
+        self._creating = 0     # 正在啟動中的 Chrome 數
+        self._cond = threading.Condition()
+        self._closed = False
+        self.stats = {"created": 0, "recycled": 0, "reaped": 0}
+
+    # 啟動 Chrome 很慢，不要在鎖裡面做；呼叫前須先把 _creating 加 1
+    def _create(self):
+        try:
+            driver = create_driver()
+        except Exception:
+            with self._cond:
+                self._creating -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._creating -= 1
+            self._all[id(driver)] = driver
+            self._pages[id(driver)] = 0
+            self.stats["created"] += 1
+        return driver
+
+    # 從池子拿掉（須持有 _cond）；真正關 Chrome 交給 kill_driver，在鎖外面做
+    def _forget(self, driver):
+        self._all.pop(id(driver), None)
+        self._pages.pop(id(driver), None)
+        self._cond.notify()
+
+    # 鎖裡只做借出 / 歸還的記帳；檢查 Chrome 活著沒（execute_script）、量記憶體、quit
+    # 都可能被卡住的 Chrome 拖很久，放在鎖外面，才不會擋住其他 worker
+    def acquire(self, timeout=ACQUIRE_TIMEOUT):
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("DriverPool 已關閉")
+                    if self._idle:
+                        driver = self._idle.pop()
+                        break
+                    if len(self._all) + self._creating < self.size:
+                        self._creating += 1
+                        driver = None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"等待 Chrome 逾時（{timeout} 秒）")
+                    self._cond.wait(remaining)
+            if driver is None:
+                return self._create()
+            if is_driver_alive(driver):
+                return driver
+            with self._cond:
+                self.stats["reaped"] += 1
+                self._forget(driver)
+            kill_driver(driver)
+
+    def release(self, driver, broken=False):
+        with self._cond:
+            if id(driver) not in self._all:
+                return
+            closed = self._closed
+            pages = self._pages[id(driver)]
+        if closed or broken or not is_driver_alive(driver):
+            reason = "reaped"
+        elif pages >= self.max_pages or driver_memory_mb(driver) >= self.max_memory_mb:
+            reason = "recycled"
+        else:
+            reason = None
+        with self._cond:
+            # 檢查期間池子被關掉了：close() 會負責關這個 Chrome
+            if id(driver) not in self._all:
+                return
+            if reason is None and not self._closed:
+                self._idle.append(driver)
+                self._cond.notify()
+                return
+            self.stats[reason or "reaped"] += 1
+            self._forget(driver)
+        kill_driver(driver)
+
+    # 開網頁並記錄頁數，給「開幾頁就重開」用
+    def get(self, driver, url):
+        with self._cond:
+            if id(driver) in self._pages:
+                self._pages[id(driver)] += 1
+        with host_slot(url), perf.stage("render"):
+            try:
+                driver.get(url)
+            except TimeoutException as ex:
+                # 整頁載入逾時是網站太慢或在限流：降速、不算頁面結構錯誤
+                raise host_limit.Throttled(f"載入逾時（{PAGE_LOAD_TIMEOUT} 秒）：{url}") from ex
+            # 這頁下載了多少，記到 perf 並累計到 browser_profile 的報表
+            metrics = browser_profile.page_metrics(driver)
+            browser_profile.record_page(metrics)
+            if metrics:
+                perf.annotate(bytes=metrics["bytes"], requests=metrics["requests"])
+
+    @contextmanager
+    def borrow(self):
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            # Chrome 本身出錯（crash、逾時），歸還時一併檢查是否要丟掉
+            broken = not is_driver_alive(driver)
+            raise
+        finally:
+            self.release(driver, broken=broken)
+
+    # 關掉所有 Chrome（含借出中的）
+    def close(self):
+        with self._cond:
+            self._closed = True
+            drivers = list(self._all.values())
+            self._all.clear()
+            self._pages.clear()
+            self._idle.clear()
+            self._cond.notify_all()
+        for driver in drivers:
+            kill_driver(driver)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> DriverPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool._closed:
+            _pool = DriverPool()
+        return _pool
+
+
+# 平行執行時讓每個 worker 都有自己的 Chrome
+def configure_pool(size: int) -> DriverPool:
+    global _pool
+    with _pool_lock:
+        old, _pool = _pool, DriverPool(size=size)
+    if old is not None:
+        old.close()
+    return _pool
+
+
+# 給 clawer_* 用：with borrow_driver() as driver: ...
+@contextmanager
+def borrow_driver():
+    pool = get_pool()
+    with pool.borrow() as driver:
+        yield driver
+
+
+def load_page(driver, url):
+    get_pool().get(driver, url)
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
+
+
+# 程式結束時保證把 Chrome 全部關掉
+atexit.register(close_pool)
@@ -1,18 +1,11 @@
 import pandas as pd
-import pyodbc
-import re
+import storage
+from db_writer import as_value, as_float, as_constant, build_params
 
 # ======= 設定區 =======
 
 CSV_PATH = r"StockList.csv" 
 
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;"          
-    "DATABASE=Stock;"            
-    "Trusted_Connection=yes;" 
-)
-
 # ======= 工具函式 =======
 
 def clean_stock_no(x):
@@ -67,34 +60,27 @@ def import_csv_to_stocks():
     df_db = df[["stock_no", "name", "market", "market_cap", "industry"]]
     df_db = df_db[df_db["stock_no"].notna()]
 
-    # 4. 連線 SQL Server
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-
-    # optional：加速大量 insert
-    cursor.fast_executemany = True
-
-    insert_sql = """
-    INSERT INTO dbo.stocks (stock_no, name, market, market_cap, industry, is_active)
-    VALUES (?, ?, ?, ?, ?, 1);
-    """
-
-    # 5. 一筆一筆插入（全部都是新增）
-    rows = df_db.to_records(index=False)
-
-    for row in rows:
-        stock_no, name, market, market_cap, industry = row
-        cursor.execute(
-            insert_sql,
-            stock_no,
-            name,
-            market,
-            market_cap,
-            industry,
-        )
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-    print(f"匯入完成，共寫入 {len(df_db)} 筆資料。")
+    # 4. 寫入資料庫（SQL Server 或本機 SQLite，依 storage 設定）
+    columns = ["stock_no", "name", "market", "market_cap", "industry", "is_active"]
+
+    # 5. 整欄組好參數，分批 executemany 寫入（全部都是新增）
+    rows = build_params(
+        as_value(df_db["stock_no"]),
+        as_value(df_db["name"]),
+        as_value(df_db["market"]),
+        as_float(df_db["market_cap"]),
+        as_value(df_db["industry"]),
+        as_constant(1, len(df_db)),
+    )
+
+    # 整批失敗時會退回一筆一筆寫；寫不進去的那筆（例如代號重複）記下來跳過，
+    # 不要讓前面已經 commit 的批次只匯一半就中斷
+    skipped = []
+
+    def on_row_error(params, ex):
+        skipped.append(params[0])
+        print(f"⚠️ 略過 {params[0]}：{ex}")
+
+    inserted = storage.insert("dbo.stocks", columns, rows, on_row_error)
+
+    print(f"匯入完成，共寫入 {inserted} 筆資料，略過 {len(skipped)} 筆。")
@@ -0,0 +1,279 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import perf
+import storage
+from db_writer import as_int, as_float, build_params
+
+# ======= 設定區 =======
+
+# 寫入過的 (股票, 最早的期別) 記在 PENDING_TABLE；只重算這些股票、這個期別之後的比率
+# 期別往後會影響：YoY（隔年同期）、近四季合計（後三季），所以讀資料要往回多拿
+QUARTER_LOOKBACK = 4    # 季：近四季 EPS、ROE 的平均權益、季營收 YoY
+MONTH_LOOKBACK = 1      # 月：MoM（YoY 直接用表上的去年同月營收）
+WRITE_BATCH = 10_000
+IN_CHUNK = 500          # 一次 IN (...) 幾支股票
+
+QUARTERLY_TABLE = "dbo.stock_quarterly_ratios"
+QUARTERLY_COLUMNS = [
+    "stock_no", "fiscal_year", "fiscal_quarter",
+    "gross_margin", "operating_margin", "net_margin",   # 單位：%
+    "debt_ratio",                                       # 負債 / 資產，%
+    "roe_ttm",                                          # 近四季淨利 / 平均股東權益，%
+    "eps_ttm",                                          # 近四季 EPS 合計（元）
+    "revenue_yoy",                                      # 季營收年增率，%
+]
+QUARTERLY_KEYS = ["stock_no", "fiscal_year", "fiscal_quarter"]
+
+MONTHLY_TABLE = "dbo.stock_monthly_revenue_growth"
+MONTHLY_COLUMNS = ["stock_no", "year", "month", "revenue_mom", "revenue_yoy", "revenue_ytd_yoy"]  # 單位：%
+MONTHLY_KEYS = ["stock_no", "year", "month"]
+
+# 還沒重算的 (種類, 股票, 期別序號)；存在資料庫裡，程式中途結束下次執行照樣會算
+PENDING_TABLE = "dbo.stock_ratio_pending"
+PENDING_COLUMNS = ["kind", "stock_no", "period"]
+PERIODS_PER_YEAR = {"quarterly": 4, "monthly": 12}
+
+# 來源表有、比率表沒有的期別（上次寫完來源表還沒記到 PENDING_TABLE 就中斷、或第一次執行）
+MISSING_SQL = {
+    "quarterly": """
+        SELECT s.stock_no, MIN(s.fiscal_year * 4 + s.fiscal_quarter - 1) AS period
+        FROM (SELECT stock_no, fiscal_year, fiscal_quarter FROM dbo.stock_quarterly_income
+              UNION SELECT stock_no, fiscal_year, fiscal_quarter FROM dbo.stock_quarterly_balance) s
+        LEFT JOIN dbo.stock_quarterly_ratios r
+          ON r.stock_no = s.stock_no AND r.fiscal_year = s.fiscal_year AND r.fiscal_quarter = s.fiscal_quarter
+        WHERE r.stock_no IS NULL
+        GROUP BY s.stock_no
+    """,
+    "monthly": """
+        SELECT s.stock_no, MIN(s.year * 12 + s.month - 1) AS period
+        FROM dbo.stock_monthly_revenue s
+        LEFT JOIN dbo.stock_monthly_revenue_growth r
+          ON r.stock_no = s.stock_no AND r.year = s.year AND r.month = s.month
+        WHERE r.stock_no IS NULL
+        GROUP BY s.stock_no
+    """,
+}
+
+_tables_ready = False
+
+
+def _ensure_tables():
+    global _tables_ready
+    if not _tables_ready:
+        storage.create_tables()
+        _tables_ready = True
+
+
+# ======= 記錄改了什麼（save_* 寫入後呼叫） =======
+
+# kind = "quarterly"（period = (年, 季)）或 "monthly"（period = (年, 月)）
+def mark_changed(kind, stock_no, period):
+    _ensure_tables()
+    year, sub = (int(x) for x in period)
+    idx = year * PERIODS_PER_YEAR[kind] + sub - 1
+    storage.upsert(PENDING_TABLE, PENDING_COLUMNS, PENDING_COLUMNS, [(kind, str(stock_no), idx)])
+
+
+def _period(kind, idx) -> tuple:
+    year, sub = divmod(int(idx), PERIODS_PER_YEAR[kind])
+    return year, sub + 1
+
+
+# 要重算的股票 -> 最早的期別，以及讀到的 pending 列（算完才刪）
+def _take_changed(kind):
+    pending = storage.read_sql(f"SELECT {', '.join(PENDING_COLUMNS)} FROM {PENDING_TABLE} WHERE kind = '{kind}'")
+    missing = storage.read_sql(MISSING_SQL[kind])
+    changed = {}
+    for df in (pending, missing):
+        for stock_no, idx in zip(df["stock_no"].astype(str).str.strip(), df["period"]):
+            if stock_no not in changed or idx < changed[stock_no]:
+                changed[stock_no] = int(idx)
+    rows = list(zip(pending["kind"], pending["stock_no"], pending["period"].astype(int).tolist()))
+    return {s: _period(kind, idx) for s, idx in changed.items()}, rows
+
+
+# 只刪掉這次讀到的那幾列（一次整批）；計算期間別的程式新記的會留到下次
+def _clear_pending(rows):
+    storage.delete(PENDING_TABLE, PENDING_COLUMNS, rows)
+
+
+# ======= 讀資料 =======
+
+def _in_list(stock_nos) -> str:
+    return ", ".join("'" + str(s).replace("'", "''") + "'" for s in stock_nos)
+
+
+# stock_nos 為 None 時讀全部；since 是「年 * n + 期 - 1」的序號，只讀這之後的
+def _read(sql, stock_nos, where):
+    if stock_nos is None:
+        return storage.read_sql(f"{sql} WHERE {where}")
+    stock_nos = list(stock_nos)
+    frames = [
+        storage.read_sql(f"{sql} WHERE {where} AND stock_no IN ({_in_list(stock_nos[i:i + IN_CHUNK])})")
+        for i in range(0, len(stock_nos), IN_CHUNK)
+    ]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def _numeric(df, columns):
+    df["stock_no"] = df["stock_no"].astype(str).str.strip()
+    for col in columns:
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype(float)
+    return df
+
+
+def load_quarterly(stock_nos=None, since=0) -> pd.DataFrame:
+    where = f"fiscal_year * 4 + fiscal_quarter - 1 >= {int(since)}"
+    income = _read("SELECT stock_no, fiscal_year, fiscal_quarter, revenue, gross_profit, operating_income, "
+                   "net_income, eps_basic FROM dbo.stock_quarterly_income", stock_nos, where)
+    balance = _read("SELECT stock_no, fiscal_year, fiscal_quarter, total_assets, total_equity, total_liabilities "
+                    "FROM dbo.stock_quarterly_balance", stock_nos, where)
+    if income.empty and balance.empty:
+        return pd.DataFrame()
+    income = _numeric(income, ["revenue", "gross_profit", "operating_income", "net_income", "eps_basic"])
+    balance = _numeric(balance, ["total_assets", "total_equity", "total_liabilities"])
+    df = income.merge(balance, on=QUARTERLY_KEYS, how="outer")
+    df["qidx"] = df["fiscal_year"].astype(int) * 4 + df["fiscal_quarter"].astype(int) - 1
+    return df
+
+
+def load_monthly(stock_nos=None, since=0) -> pd.DataFrame:
+    df = _read("SELECT stock_no, year, month, revenue_current, revenue_prev_year_month, revenue_ytd, "
+               "revenue_ytd_prev_year FROM dbo.stock_monthly_revenue",
+               stock_nos, f"year * 12 + month - 1 >= {int(since)}")
+    if df.empty:
+        return df
+    df = _numeric(df, ["revenue_current", "revenue_prev_year_month", "revenue_ytd", "revenue_ytd_prev_year"])
+    df["midx"] = df["year"].astype(int) * 12 + df["month"].astype(int) - 1
+    return df
+
+
+# ======= 計算（所有股票一起） =======
+
+# 同一支股票 lag 期前的值；用期別序號對齊，缺期時是 NaN（不會錯拿到更早的一期）
+def _lag(df, idx, col, lag):
+    prev = df[["stock_no", idx, col]].copy()
+    prev[idx] = prev[idx] + lag
+    return df[["stock_no", idx]].merge(prev, on=["stock_no", idx], how="left")[col].to_numpy()
+
+
+def _pct(numerator, denominator):
+    numerator, denominator = np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denominator != 0, numerator / denominator * 100, np.nan)
+
+
+# 成長率：基期 <= 0（虧損、沒有營收）時沒有意義，留空
+def _growth(current, base):
+    current, base = np.asarray(current, dtype=float), np.asarray(base, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(base > 0, (current / base - 1) * 100, np.nan)
+
+
+def compute_quarterly(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.sort_values(["stock_no", "qidx"]).reset_index(drop=True)
+    eps_ttm = sum(_lag(df, "qidx", "eps_basic", k) for k in range(4))
+    ni_ttm = sum(_lag(df, "qidx", "net_income", k) for k in range(4))
+    equity = df["total_equity"].to_numpy()
+    equity_prev = _lag(df, "qidx", "total_equity", 4)
+    avg_equity = np.where(np.isnan(equity_prev), equity, (equity + equity_prev) / 2)
+
+    out = df[QUARTERLY_KEYS + ["qidx"]].copy()
+    out["gross_margin"] = _pct(df["gross_profit"], df["revenue"])
+    out["operating_margin"] = _pct(df["operating_income"], df["revenue"])
+    out["net_margin"] = _pct(df["net_income"], df["revenue"])
+    out["debt_ratio"] = _pct(df["total_liabilities"], df["total_assets"])
+    out["roe_ttm"] = np.where(avg_equity > 0, _pct(ni_ttm, avg_equity), np.nan)
+    out["eps_ttm"] = eps_ttm
+    out["revenue_yoy"] = _growth(df["revenue"], _lag(df, "qidx", "revenue", 4))
+    return out
+
+
+def compute_monthly(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.sort_values(["stock_no", "midx"]).reset_index(drop=True)
+    out = df[MONTHLY_KEYS + ["midx"]].copy()
+    out["revenue_mom"] = _growth(df["revenue_current"], _lag(df, "midx", "revenue_current", 1))
+    # 表上已經有去年同月 / 去年累計，不用往回讀一年
+    out["revenue_yoy"] = _growth(df["revenue_current"], df["revenue_prev_year_month"])
+    out["revenue_ytd_yoy"] = _growth(df["revenue_ytd"], df["revenue_ytd_prev_year"])
+    return out
+
+
+# 只留每支股票改過的期別（含）之後
+def _only_changed(out, changed, idx, per_year):
+    if changed is None:
+        return out
+    first = out["stock_no"].map({s: p[0] * per_year + p[1] - 1 for s, p in changed.items()})
+    return out[out[idx] >= first]
+
+
+# ======= 寫入 =======
+
+def _upsert_batched(table, columns, keys, rows):
+    inserted = updated = 0
+    for start in range(0, len(rows), WRITE_BATCH):
+        i, u = storage.upsert(table, columns, keys, rows[start:start + WRITE_BATCH])
+        inserted, updated = inserted + i, updated + u
+    return inserted, updated
+
+
+def _refresh(kind, changed, full):
+    per_year, lookback = (4, QUARTER_LOOKBACK) if kind == "quarterly" else (12, MONTH_LOOKBACK)
+    stock_nos = None if full else list(changed)
+    since = 0 if full else min(p[0] * per_year + p[1] - 1 for p in changed.values()) - lookback
+    with perf.stage("fetch") as span:
+        df = load_quarterly(stock_nos, since) if kind == "quarterly" else load_monthly(stock_nos, since)
+        span.rows = len(df)
+    if df.empty:
+        return 0
+    with perf.stage("transform") as span:
+        if kind == "quarterly":
+            out = _only_changed(compute_quarterly(df), None if full else changed, "qidx", per_year)
+            rows = build_params(
+                out["stock_no"].tolist(), as_int(out["fiscal_year"]), as_int(out["fiscal_quarter"]),
+                *(as_float(out[col]) for col in QUARTERLY_COLUMNS[3:]),
+            )
+        else:
+            out = _only_changed(compute_monthly(df), None if full else changed, "midx", per_year)
+            rows = build_params(
+                out["stock_no"].tolist(), as_int(out["year"]), as_int(out["month"]),
+                *(as_float(out[col]) for col in MONTHLY_COLUMNS[3:]),
+            )
+        span.rows = len(rows)
+    with perf.stage("write") as span:
+        if kind == "quarterly":
+            inserted, updated = _upsert_batched(QUARTERLY_TABLE, QUARTERLY_COLUMNS, QUARTERLY_KEYS, rows)
+        else:
+            inserted, updated = _upsert_batched(MONTHLY_TABLE, MONTHLY_COLUMNS, MONTHLY_KEYS, rows)
+        span.rows = inserted + updated
+    stocks = out["stock_no"].nunique()
+    print(f"✅ {'季財務比率' if kind == 'quarterly' else '月營收成長率'}：{stocks} 支股票、{len(rows)} 期"
+          f"（新增 {inserted}、更新 {updated}）")
+    return len(rows)
+
+
+# 每次執行完：只重算寫入過（或還沒有比率）的股票 / 期別；full=True 全部重算
+# 寫入成功才清掉 pending，中途失敗或中斷的下次執行再算
+def update(full=False) -> int:
+    _ensure_tables()
+    total = 0
+    for kind in ("quarterly", "monthly"):
+        changed, rows = _take_changed(kind)
+        if not full and not changed:
+            continue
+        total += _refresh(kind, changed, full)
+        _clear_pending(rows)
+    if total == 0:
+        print("⏭️ 財務比率沒有需要更新的股票")
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="從季報、月營收計算財務比率（毛利率、ROE、EPS TTM、營收成長率...）")
+    parser.add_argument("--full", action="store_true", help="所有股票、所有期別重算")
+    args = parser.parse_args()
+    update(full=args.full)
+    storage.close()
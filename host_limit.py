@@ -0,0 +1,201 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import aiohttp
+import requests
+
+import perf
+
+# ======= 設定區 =======
+
+# 每個網站同時進行中的請求上限，平行執行時避免把對方打爆
+HOST_LIMITS = {
+    "www.cmoney.tw": 3,
+    "www.twse.com.tw": 1,
+}
+DEFAULT_LIMIT = 2
+
+# 每個網站每秒請求數（token bucket）：(起始, 最低, 最高, 可累積的 token 數, 每次成功加多少)
+# 被限流（429 / 503、逾時、空回應）時速率減半並暫停一下，之後每次成功慢慢加回去
+# TWSE 大約每 5 秒超過 3 個請求就會被擋
+HOST_RATES = {
+    "www.twse.com.tw": (0.5, 0.1, 1.0, 1, 0.02),
+    "www.cmoney.tw": (2.0, 0.2, 6.0, 3, 0.05),
+}
+DEFAULT_RATE = (2.0, 0.2, 10.0, 3, 0.1)
+DECREASE_FACTOR = 0.5
+THROTTLE_STATUS = {403, 429, 503}
+THROTTLE_RETRIES = 3      # with_backoff 被限流後最多重試幾次
+
+_semaphores = {}
+_buckets = {}
+_lock = threading.Lock()
+
+
+# 對方限流的回應（例如該是 JSON 卻回空白或 HTML 擋頁）
+class Throttled(Exception):
+    pass
+
+
+# 速率會自己調整的 token bucket：成功一次加一點（加法），被限流就減半（乘法）
+class AdaptiveBucket:
+    def __init__(self, rate, min_rate, max_rate, burst, step):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.step = step
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    # 預約一個 token，回傳要等幾秒；token 不夠時變成負的，後面的人依序往後排
+    def reserve(self) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = max(0.0, -self.tokens / self.rate, self.paused_until - now)
+            self.waited += wait
+            return wait
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.step)
+
+    def penalize(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0.0)
+            self.paused_until = time.monotonic() + 1 / self.rate
+            self.throttled += 1
+
+
+def _host(url: str) -> str:
+    return urlparse(url).netloc or url
+
+
+# 這個網站同時進行中的請求上限（非同步版本自己開 asyncio.Semaphore 時也用這個數字）
+def concurrency(url: str) -> int:
+    with _lock:
+        return HOST_LIMITS.get(_host(url), DEFAULT_LIMIT)
+
+
+def _semaphore(host):
+    with _lock:
+        sem = _semaphores.get(host)
+        if sem is None:
+            sem = threading.BoundedSemaphore(HOST_LIMITS.get(host, DEFAULT_LIMIT))
+            _semaphores[host] = sem
+        return sem
+
+
+def _bucket(host) -> AdaptiveBucket:
+    with _lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = AdaptiveBucket(*HOST_RATES.get(host, DEFAULT_RATE))
+            _buckets[host] = bucket
+        return bucket
+
+
+# 調整某個網站的上限（要在開始抓之前設定）
+def set_host_limit(host: str, limit: int):
+    with _lock:
+        HOST_LIMITS[host] = limit
+        _semaphores.pop(host, None)
+
+
+# 這個例外是不是對方在限流（要降速），而不是資料本身的問題
+# Selenium 的 TimeoutException 不算：等不到元素是頁面結構的問題（circuit_breaker），
+# 整頁載入逾時由 driver_pool 轉成 Throttled
+def is_throttled(ex) -> bool:
+    if isinstance(ex, (Throttled, asyncio.TimeoutError, TimeoutError,
+                       requests.Timeout, requests.ConnectionError, aiohttp.ClientConnectionError)):
+        return True
+    if isinstance(ex, requests.HTTPError) and ex.response is not None:
+        return ex.response.status_code in THROTTLE_STATUS
+    if isinstance(ex, aiohttp.ClientResponseError):
+        return ex.status in THROTTLE_STATUS
+    return False
+
+
+# 回報一個請求的結果：ex 是限流就降速，沒有例外就慢慢加速
+def report(url: str, ex=None):
+    bucket = _bucket(_host(url))
+    if ex is None:
+        bucket.reward()
+    elif is_throttled(ex):
+        bucket.penalize()
+
+
+def _wait_token(url):
+    wait = _bucket(_host(url)).reserve()
+    if wait > 0:
+        time.sleep(wait)
+        perf.record("rate_wait", wait)
+
+
+# 非同步版本：拿到 token 才發請求，結果用 report() 回報
+async def acquire_async(url: str):
+    wait = _bucket(_host(url)).reserve()
+    if wait > 0:
+        await asyncio.sleep(wait)
+        perf.record("rate_wait", wait)
+
+
+# with host_slot(url): ... 同一個網站同時最多 HOST_LIMITS[host] 個，而且不超過目前的速率
+# with 裡丟出限流的例外會降速，正常結束會慢慢加速
+@contextmanager
+def host_slot(url: str):
+    sem = _semaphore(_host(url))
+    sem.acquire()
+    try:
+        _wait_token(url)
+        try:
+            yield
+        except Exception as ex:
+            report(url, ex)
+            raise
+        report(url)
+    finally:
+        sem.release()
+
+
+# 呼叫 fetch()；被限流時降速後重試，最多 retries 次，其他錯誤直接丟出
+def with_backoff(url: str, fetch, retries=THROTTLE_RETRIES):
+    for attempt in range(retries + 1):
+        try:
+            with host_slot(url):
+                return fetch()
+        except Exception as ex:
+            if attempt == retries or not is_throttled(ex):
+                raise
+            bucket = _bucket(_host(url))
+            print(f"⚠️ {_host(url)} 疑似限流（{type(ex).__name__}），降到每秒 {bucket.rate:.2f} 個請求後重試")
+
+
+def rate_summary() -> dict:
+    with _lock:
+        buckets = dict(_buckets)
+    return {
+        host: {"rate": b.rate, "throttled": b.throttled, "waited": b.waited}
+        for host, b in buckets.items()
+    }
+
+
+def print_rate_summary():
+    summary = rate_summary()
+    if not summary:
+        return
+    print("🚦 各網站請求速率（自動調整）")
+    for host, s in sorted(summary.items()):
+        print(f"  {host:<20} 目前每秒 {s['rate']:.2f} 個  被限流 {s['throttled']} 次  "
+              f"排隊等待合計 {s['waited']:.1f}s")
@@ -0,0 +1,111 @@
+import threading
+
+import requests
+from lxml import html as lxml_html
+
+import host_limit
+import perf
+
+# ======= 設定區 =======
+
+HTTP_TIMEOUT = 15
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+    ),
+    "Accept-Language": "zh-TW,zh;q=0.9",
+}
+
+# 共用 Session，重複使用連線
+_session = requests.Session()
+_session.headers.update(HEADERS)
+
+# 每個頁面用了哪種方式抓：{"dividend": {"http": 12, "browser": 3}, ...}
+_paths = {}
+_lock = threading.Lock()
+
+
+# 經過 host_limit 的速率限制；429 / 503、逾時、空白回應會降速重試
+def fetch_page(url: str) -> str:
+    def get():
+        resp = _session.get(url, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        # 沒有宣告 charset 時 requests 會當成 ISO-8859-1，cmoney 實際是 UTF-8
+        if not resp.encoding or resp.encoding.lower() == "iso-8859-1":
+            resp.encoding = "utf-8"
+        if not resp.text.strip():
+            raise host_limit.Throttled("回應是空的")
+        return resp.text
+    return host_limit.with_backoff(url, get)
+
+
+# 有資料列、而且表頭含有 must_contain 的每個字
+def _is_wanted(node, must_contain) -> bool:
+    if not node.xpath("descendant-or-self::table//tbody/tr[td]"):
+        return False
+    header = " ".join(node.xpath("descendant-or-self::table//thead//text()")
+                      or node.xpath("descendant-or-self::table//tr[1]//text()"))
+    return all(text in header for text in must_contain)
+
+
+# 在伺服器端產生的 HTML 裡找表格：先用 Selenium 同一個 xpath，
+# 不符合再找其他 <table>；都沒有（要 JavaScript 才畫得出來）回傳 None
+def find_table(tree, xpath: str, must_contain=()) -> str:
+    for node in tree.xpath(xpath) + tree.xpath("//table"):
+        if _is_wanted(node, must_contain):
+            return lxml_html.tostring(node, encoding="unicode")
+    return None
+
+
+# 一次抓一頁，回傳 {name: 表格 outerHTML}；specs = {name: (xpath, 表頭必須包含的字)}
+# 任何一張表不在 HTML 裡就回傳 None，讓呼叫端改用瀏覽器
+def fetch_tables(url: str, specs: dict):
+    tree = lxml_html.fromstring(fetch_page(url))
+    tables = {}
+    for name, (xpath, must_contain) in specs.items():
+        table = find_table(tree, xpath, must_contain)
+        if table is None:
+            return None
+        tables[name] = table
+    return tables
+
+
+# 只試 HTTP：fetch_http() 回傳 None 或 covers 判斷資料不夠就回傳 None
+def try_http(page: str, fetch_http, covers=None):
+    try:
+        result = fetch_http()
+        if result is not None and (covers is None or covers(result)):
+            record_path(page, "http")
+            return result
+    except Exception as ex:
+        print(f"⚠️ {page} HTTP 抓取失敗，改用瀏覽器：{ex}")
+    return None
+
+
+def use_browser(page: str, browser):
+    record_path(page, "browser")
+    return browser()
+
+
+def record_path(page, path):
+    with _lock:
+        counts = _paths.setdefault(page, {"http": 0, "browser": 0})
+        counts[path] += 1
+    perf.annotate(path=path)
+
+
+def path_summary() -> dict:
+    with _lock:
+        return {page: dict(counts) for page, counts in _paths.items()}
+
+
+def print_path_summary():
+    summary = path_summary()
+    if not summary:
+        return
+    print("🌐 cmoney 抓取方式（HTTP 直接解析 / 開瀏覽器）")
+    for page, counts in sorted(summary.items()):
+        total = counts["http"] + counts["browser"]
+        print(f"  {page:<18} http {counts['http']:>5}  browser {counts['browser']:>5}  "
+              f"（HTTP 佔 {counts['http'] / total:.0%}）")
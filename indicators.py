@@ -0,0 +1,252 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import perf
+import storage
+from db_writer import as_value, as_float, as_int, build_params
+
+# ======= 設定區 =======
+
+MA_WINDOWS = [5, 10, 20, 60]     # 收盤價移動平均
+VOL_WINDOWS = [5, 20]            # 成交量（張）移動平均
+BB_WINDOW, BB_K = 20, 2          # 布林通道：20 日均線 ± 2 倍標準差
+RSI_PERIOD = 14                  # RSI / ATR 用 Wilder 平滑
+ATR_PERIOD = 14
+MACD_FAST, MACD_SLOW, MACD_SIGNAL = 12, 26, 9
+# 移動平均要往回看的筆數（最長的視窗減一）；遞迴的指標（EMA、RSI、ATR）存在 state 表
+LOOKBACK = max(MA_WINDOWS + VOL_WINDOWS + [BB_WINDOW]) - 1
+WRITE_BATCH = 10_000
+
+INDICATOR_TABLE = "dbo.stock_daily_indicators"
+INDICATOR_COLUMNS = [
+    "stock_id", "trade_date",
+    "ma5", "ma10", "ma20", "ma60",
+    "bb_upper", "bb_lower",
+    "rsi14",
+    "macd", "macd_signal", "macd_hist",
+    "atr14",
+    "vol_ma5", "vol_ma20",
+]
+INDICATOR_KEYS = ["stock_id", "trade_date"]
+
+STATE_TABLE = "dbo.stock_indicator_state"
+STATE_COLUMNS = ["stock_id", "trade_date", "n_obs", "last_close", "ema12", "ema26", "macd_signal",
+                 "avg_gain", "avg_loss", "atr14"]
+STATE_KEYS = ["stock_id"]
+
+_QUOTE_COLUMNS = "q.stock_id, q.trade_date, q.last_price, q.high_price, q.low_price, q.volume_lots"
+
+# 上次算到之後的新交易日（還沒有 state 的股票是全部歷史）
+NEW_SQL = f"""
+    SELECT {_QUOTE_COLUMNS}
+    FROM dbo.stock_daily_quotes q
+    LEFT JOIN dbo.stock_indicator_state s ON s.stock_id = q.stock_id
+    WHERE s.stock_id IS NULL OR q.trade_date > s.trade_date
+"""
+# 有新交易日的股票，上次算到的那天（含）往回 LOOKBACK 筆，給移動平均用
+TAIL_SQL = f"""
+    SELECT stock_id, trade_date, last_price, high_price, low_price, volume_lots FROM (
+        SELECT {_QUOTE_COLUMNS},
+               ROW_NUMBER() OVER (PARTITION BY q.stock_id ORDER BY q.trade_date DESC) AS rn
+        FROM dbo.stock_daily_quotes q
+        JOIN dbo.stock_indicator_state s ON s.stock_id = q.stock_id AND q.trade_date <= s.trade_date
+        WHERE EXISTS (SELECT 1 FROM dbo.stock_daily_quotes n
+                      WHERE n.stock_id = s.stock_id AND n.trade_date > s.trade_date)
+    ) t
+    WHERE rn <= {LOOKBACK}
+"""
+ALL_SQL = f"SELECT {_QUOTE_COLUMNS} FROM dbo.stock_daily_quotes q"
+STATE_SQL = f"SELECT {', '.join(STATE_COLUMNS)} FROM {STATE_TABLE}"
+
+
+def _normalize(df) -> pd.DataFrame:
+    df["stock_id"] = df["stock_id"].astype(str).str.strip()
+    df["trade_date"] = pd.to_datetime(df["trade_date"])
+    for col in ("last_price", "high_price", "low_price", "volume_lots"):
+        df[col] = pd.to_numeric(df[col], errors="coerce").astype(float)
+    # 停牌日的 "--" 清洗後存成 0，不是真的價格，當成沒有收盤價
+    prices = ["last_price", "high_price", "low_price"]
+    df[prices] = df[prices].where(df[prices] > 0)
+    return df
+
+
+# 讀要算的資料：新交易日（is_new）+ 移動平均需要的前幾筆；full=True 全部重算
+def load_inputs(full=False):
+    if full:
+        rows = _normalize(storage.read_sql(ALL_SQL))
+        rows["is_new"] = True
+        return rows, pd.DataFrame(columns=STATE_COLUMNS)
+    new = _normalize(storage.read_sql(NEW_SQL))
+    if new.empty:
+        return new.assign(is_new=pd.Series(dtype=bool)), pd.DataFrame(columns=STATE_COLUMNS)
+    tail = _normalize(storage.read_sql(TAIL_SQL))
+    state = storage.read_sql(STATE_SQL)
+    state["stock_id"] = state["stock_id"].astype(str).str.strip()
+    rows = pd.concat([tail.assign(is_new=False), new.assign(is_new=True)], ignore_index=True)
+    return rows, state
+
+
+# ======= 計算（所有股票一起，欄 = 股票、列 = 該股票的第幾個交易日） =======
+
+def _ema_step(prev, x, alpha, mask):
+    # 第一筆直接用當天的值當起點（同 pandas ewm(adjust=False)）
+    updated = np.where(np.isnan(prev), x, prev + alpha * (x - prev))
+    return np.where(mask, updated, prev)
+
+
+def compute(rows: pd.DataFrame, state: pd.DataFrame):
+    rows = rows.sort_values(["stock_id", "trade_date"]).reset_index(drop=True)
+    rows["pos"] = rows.groupby("stock_id").cumcount()
+
+    def wide(col):
+        return rows.pivot(index="pos", columns="stock_id", values=col)
+
+    close, high, low, vol = wide("last_price"), wide("high_price"), wide("low_price"), wide("volume_lots")
+    is_new = wide("is_new").eq(True).to_numpy()
+    stocks = close.columns
+
+    # 移動平均 / 布林通道：整張表一次 rolling
+    rolled = {f"ma{w}": close.rolling(w, min_periods=w).mean() for w in MA_WINDOWS}
+    for w in VOL_WINDOWS:
+        rolled[f"vol_ma{w}"] = vol.rolling(w, min_periods=w).mean()
+    std = close.rolling(BB_WINDOW, min_periods=BB_WINDOW).std(ddof=0)
+    rolled["bb_upper"] = rolled[f"ma{BB_WINDOW}"] + BB_K * std
+    rolled["bb_lower"] = rolled[f"ma{BB_WINDOW}"] - BB_K * std
+
+    # 遞迴的指標：從 state 接著算，只跑新的交易日；沒有 state 的股票從頭算
+    s = state.set_index("stock_id").reindex(stocks)
+
+    def initial(col):
+        return pd.to_numeric(s[col], errors="coerce").to_numpy(dtype=float)
+
+    ema_fast, ema_slow, signal = initial("ema12"), initial("ema26"), initial("macd_signal")
+    avg_gain, avg_loss, atr = initial("avg_gain"), initial("avg_loss"), initial("atr14")
+    last_close = initial("last_close")
+    n_obs = np.nan_to_num(initial("n_obs")).astype(int)
+
+    c, h, l = close.to_numpy(), high.to_numpy(), low.to_numpy()
+    shape = c.shape
+    out = {name: np.full(shape, np.nan) for name in ("rsi14", "macd", "macd_signal", "macd_hist", "atr14")}
+    last_pos = np.full(len(stocks), -1)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for k in range(shape[0]):
+            x = c[k]
+            # 沒有收盤價（停牌）的新交易日也算處理過，state 的日期照樣往前
+            last_pos = np.where(is_new[k], k, last_pos)
+            step = is_new[k] & ~np.isnan(x)
+            if not step.any():
+                continue
+            prev = last_close
+
+            ema_fast = _ema_step(ema_fast, x, 2 / (MACD_FAST + 1), step)
+            ema_slow = _ema_step(ema_slow, x, 2 / (MACD_SLOW + 1), step)
+            macd = ema_fast - ema_slow
+            signal = _ema_step(signal, macd, 2 / (MACD_SIGNAL + 1), step)
+
+            change = x - prev
+            has_prev = step & ~np.isnan(prev)
+            avg_gain = _ema_step(avg_gain, np.maximum(change, 0), 1 / RSI_PERIOD, has_prev)
+            avg_loss = _ema_step(avg_loss, np.maximum(-change, 0), 1 / RSI_PERIOD, has_prev)
+
+            tr = np.where(np.isnan(prev), h[k] - l[k],
+                          np.fmax(h[k] - l[k], np.fmax(np.abs(h[k] - prev), np.abs(l[k] - prev))))
+            atr = _ema_step(atr, tr, 1 / ATR_PERIOD, step & ~np.isnan(tr))
+
+            last_close = np.where(step, x, last_close)
+            n_obs = n_obs + step
+
+            # 暖機期（觀察值不夠）的指標留空
+            rsi = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+            out["rsi14"][k] = np.where(step & (n_obs > RSI_PERIOD), rsi, np.nan)
+            out["macd"][k] = np.where(step & (n_obs >= MACD_SLOW), macd, np.nan)
+            ready = step & (n_obs >= MACD_SLOW + MACD_SIGNAL - 1)
+            out["macd_signal"][k] = np.where(ready, signal, np.nan)
+            out["macd_hist"][k] = np.where(ready, macd - signal, np.nan)
+            out["atr14"][k] = np.where(step & (n_obs > ATR_PERIOD), atr, np.nan)
+
+    # 攤回一列一筆，只留新的交易日
+    new_rows = rows[rows["is_new"]]
+    r, col = new_rows["pos"].to_numpy(), stocks.get_indexer(new_rows["stock_id"])
+    result = new_rows[["stock_id", "trade_date"]].reset_index(drop=True)
+    for name, frame in rolled.items():
+        result[name] = frame.to_numpy()[r, col]
+    for name, values in out.items():
+        result[name] = values[r, col]
+
+    moved = last_pos >= 0
+    dates = wide("trade_date").to_numpy()
+    new_state = pd.DataFrame({
+        "stock_id": stocks[moved],
+        "trade_date": dates[last_pos[moved], np.flatnonzero(moved)],
+        "n_obs": n_obs[moved],
+        "last_close": last_close[moved],
+        "ema12": ema_fast[moved],
+        "ema26": ema_slow[moved],
+        "macd_signal": signal[moved],
+        "avg_gain": avg_gain[moved],
+        "avg_loss": avg_loss[moved],
+        "atr14": atr[moved],
+    })
+    return result[INDICATOR_COLUMNS], new_state
+
+
+# ======= 寫入 =======
+
+def _dates(series):
+    return pd.to_datetime(series).dt.date
+
+
+def _upsert_batched(table, columns, keys, rows):
+    inserted = updated = 0
+    for start in range(0, len(rows), WRITE_BATCH):
+        i, u = storage.upsert(table, columns, keys, rows[start:start + WRITE_BATCH])
+        inserted, updated = inserted + i, updated + u
+    return inserted, updated
+
+
+def save(result: pd.DataFrame, new_state: pd.DataFrame):
+    rows = build_params(
+        result["stock_id"].tolist(),
+        as_value(_dates(result["trade_date"])),
+        *(as_float(result[col]) for col in INDICATOR_COLUMNS[2:]),
+    )
+    inserted, updated = _upsert_batched(INDICATOR_TABLE, INDICATOR_COLUMNS, INDICATOR_KEYS, rows)
+    # 指標寫完才更新 state，中途失敗下次會從舊的 state 重算這幾天
+    state_rows = build_params(
+        new_state["stock_id"].tolist(),
+        as_value(_dates(new_state["trade_date"])),
+        as_int(new_state["n_obs"]),
+        *(as_float(new_state[col]) for col in STATE_COLUMNS[3:]),
+    )
+    _upsert_batched(STATE_TABLE, STATE_COLUMNS, STATE_KEYS, state_rows)
+    return inserted, updated
+
+
+# 每次執行完：只算上次之後的新交易日；full=True 全部歷史重算（改了參數時用）
+def update(full=False) -> int:
+    storage.create_tables()
+    with perf.stage("fetch") as span:
+        rows, state = load_inputs(full)
+        span.rows = int(rows["is_new"].sum()) if not rows.empty else 0
+    if rows.empty:
+        print("⏭️ 技術指標已是最新，略過")
+        return 0
+    with perf.stage("transform") as span:
+        result, new_state = compute(rows, state)
+        span.rows = len(result)
+    with perf.stage("write") as span:
+        inserted, updated = save(result, new_state)
+        span.rows = inserted + updated
+    print(f"✅ 技術指標：{len(new_state)} 支股票、{len(result)} 個交易日（新增 {inserted}、更新 {updated}）")
+    return len(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="從 stock_daily_quotes 增量計算技術指標")
+    parser.add_argument("--full", action="store_true", help="不看 state，全部歷史重算")
+    args = parser.parse_args()
+    update(args.full)
+    storage.close()
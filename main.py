@@ -1,27 +1,33 @@
+import argparse
+import os
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import pandas as pd
-import pyodbc
-from sqlalchemy import create_engine
-import urllib
+import db
+import browser_profile
+import circuit_breaker
+import data_lake
 import exceltosql
 import clawer_dividend as cd
 import clawer_monthly_revenue as cmr
 import clawer_daily_quotes as cdq
 import clawer_quarterly_balance as cqb
 import clawer_quarterly_income as cqi
-
-CONN_STR = (
-    "DRIVER={ODBC Driver 17 for SQL Server};"
-    "SERVER=localhost;" 
-    "DATABASE=Stock;"
-    "Trusted_Connection=yes;"
-)
-
-# 要將 ODBC 字串變成適用於 URL 的格式
-params = urllib.parse.quote_plus(CONN_STR)
-engine = create_engine(f"mssql+pyodbc:///?odbc_connect={params}")
+import driver_pool
+import host_limit
+import http_tables
+import indicators
+import fundamentals
+import page_wait
+import perf
+import replay
+import scheduler
+import stock_session
+import storage
+import task_queue
 
 def get_stocks():
-    df = pd.read_sql("SELECT stock_no, name FROM stocks ORDER BY stock_no", engine)
+    df = storage.read_sql("SELECT stock_no, name FROM stocks ORDER BY stock_no")
     return df
 
 def flatten_columns(df):
@@ -31,34 +37,201 @@ def flatten_columns(df):
 
 # 檢查stocks是否有資料表，如果有資料救回傳true
 def check_stocks_table():
-    conn = pyodbc.connect(CONN_STR)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT COUNT(*) 
-        FROM INFORMATION_SCHEMA.TABLES 
-        WHERE TABLE_NAME = 'stocks'
-    """)
-    result = cursor.fetchone()
-    cursor.close()
-    conn.close()
-    return result[0] > 0
+    if not storage.has_table("stocks"):
+        return False
+    return storage.read_sql("SELECT COUNT(*) AS n FROM dbo.stocks")["n"].iloc[0] > 0
+
+# 每支股票要跑的資料集（順序同原本的序列執行）
+DATASETS = [
+    ("dividend", cd.process_dividend_for_stock),                     # 股利資料
+    ("monthly_revenue", cmr.process_monthly_revenue_for_stock),      # 月營收資料
+    ("daily_quotes", cdq.process_daily_quotes_for_stock),            # 日成交資料
+    ("quarterly_balance", cqb.process_quarterly_balance_for_stock),  # 季報（資產負債表）
+    ("quarterly_income", cqi.process_quarterly_income_for_stock),    # 季報（綜合損益表 + EPS）
+]
+
+PROCESSES = dict(DATASETS)
+
+PERF_LOG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "perf_logs")
+
+# 跑一個 (股票, 資料集)，各階段耗時記到 perf；回傳錯誤訊息，成功回傳 None
+# process_* 自己接住例外時，失敗的階段仍會記在 perf 的 task 上
+# 這個資料集的 circuit breaker 跳開時不跑，回傳 task_queue.Skip
+def run_task(name, process, stock_no):
+    if not circuit_breaker.allow(name):
+        return task_queue.Skip("circuit breaker 跳開")
+    try:
+        with perf.task(name, stock_no) as ctx:
+            process(stock_no)
+    except Exception as ex:
+        print(f"❌ {stock_no} {name} 失敗：{ex}")
+        circuit_breaker.report(name, False, ex)
+        return f"{type(ex).__name__}: {str(ex).strip()}"
+    if ctx["failed"]:
+        circuit_breaker.report(name, False, ctx["exception"])
+        return ctx["error"]
+    circuit_breaker.report(name, True if ctx["stages"] else None)
+    return None
+
+# 跑從佇列領到的工作；session=True 時是同一支股票的幾個資料集，
+# 先用同一個 Chrome 把 cmoney 各分頁一次抓進快取，再照順序跑
+def run_claimed(tasks, session=True):
+    stock_no = tasks[0][0]
+    if session:
+        try:
+            with perf.task("session", stock_no):
+                stock_session.prefetch_stock(stock_no, [name for _, name, _, _ in tasks])
+        except Exception as ex:
+            # 沒抓到的資料集由 process_*_for_stock 自己再抓
+            print(f"⚠️ {stock_no} 整支股票一次抓取失敗：{ex}")
+    return [run_task(name, PROCESSES[name], stock_no) for stock_no, name, _, _ in tasks]
+
+# 一個 worker：一直從佇列領工作來跑，直到沒有沒跑完的工作（失敗的會等退避時間後重試）
+# session=True 一次領一支股票的所有資料集，否則一次領一個 (股票, 資料集)
+def run_serial(session=True):
+    task_queue.work(lambda tasks: run_claimed(tasks, session), by_stock=session)
+
+# workers 個執行緒各自從佇列領工作
+# 每個 worker 從 driver_pool 借自己的 Chrome、每次寫入各自開 DB 連線，
+# 同一個網站的同時請求數由 host_limit 控制
+def run_parallel(workers, session=True):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_serial, session) for _ in range(workers)]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as ex:
+                print(f"❌ worker 失敗：{ex}")
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="平行執行的 worker 數，1 = 序列執行")
+    parser.add_argument("--daily-mode", choices=["stock", "market", "async"], default="stock",
+                        help="日成交資料：stock = 每支股票每月一個請求，market = 每個交易日抓一次全市場，"
+                             "async = 缺的月份全部用非同步 HTTP 一次回補（大量補歷史用）")
+    parser.add_argument("--replay", action="store_true",
+                        help="不連網，只用 raw_cache 的原始回應重跑所有 transform 與寫入")
+    parser.add_argument("--db-backend", choices=["sqlserver", "sqlite"],
+                        help="寫入哪種資料庫，預設依 appsettings.json（sqlserver）")
+    parser.add_argument("--sqlite-path", help="sqlite backend 的檔案路徑（有給就用 sqlite）")
+    parser.add_argument("--ship", metavar="SQLITE_PATH",
+                        help="把本機 sqlite 檔的資料匯入目前的資料庫後結束")
+    parser.add_argument("--no-indicators", action="store_true",
+                        help="執行完不要更新技術指標（stock_daily_indicators）")
+    parser.add_argument("--no-fundamentals", action="store_true",
+                        help="執行完不要更新財務比率（stock_quarterly_ratios、stock_monthly_revenue_growth）")
+    parser.add_argument("--no-lake", action="store_true",
+                        help="執行完不要把新資料匯出到 data_lake/ 的 Parquet")
+    parser.add_argument("--no-stock-session", action="store_true",
+                        help="不要每支股票先用同一個 Chrome 抓完 cmoney 各分頁，改回每個資料集各自開頁")
+    parser.add_argument("--all-datasets", action="store_true",
+                        help="不看公布時程，每支股票的每個資料集都排進佇列")
+    parser.add_argument("--queue-path", help="工作佇列（SQLite）的路徑，預設 task_queue.sqlite3")
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="已經失敗太多次、不再自動重試的工作這次重新跑")
+    parser.add_argument("--full-browser", action="store_true",
+                        help="Chrome 不擋圖片 / 字型 / 廣告、等整頁載完（比較下載量用）")
+    parser.add_argument("--perf-log", help="各階段耗時事件（JSON-lines）的路徑，預設寫到 perf_logs/")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
+    perf_log = args.perf_log
+    if perf_log is None:
+        os.makedirs(PERF_LOG_DIR, exist_ok=True)
+        perf_log = os.path.join(PERF_LOG_DIR, f"run_{datetime.now():%Y%m%d_%H%M%S}.jsonl")
+    perf.configure(perf_log)
+    if args.full_browser:
+        browser_profile.LEAN = False
+    # 每個 worker 同時最多借一條連線，常駐連線數跟著 worker 數
+    db.configure(PoolSize=max(db.DEFAULT_SETTINGS["PoolSize"], args.workers))
+    if args.db_backend or args.sqlite_path:
+        storage.configure(args.db_backend or "sqlite", args.sqlite_path)
+
+    if args.ship:
+        storage.ship(args.ship)
+        storage.close()
+        raise SystemExit(0)
+
     # 1. 匯入股票清單到 stocks 資料表
     if not check_stocks_table():
         exceltosql.import_csv_to_stocks()
 
     # 2. 取得 stocks 資料表的股票清單
     df_stocks = get_stocks()
-    for index, row in df_stocks.iterrows():
-        stock_no = row["stock_no"]
-        # 爬取每支股票的股利資料
-        cd.process_dividend_for_stock(stock_no)
-        # 爬取每支股票的月營收資料
-        cmr.process_monthly_revenue_for_stock(stock_no)
-        # 爬取每支股票的日成交資料
-        cdq.process_daily_quotes_for_stock(stock_no)
-        # 爬取每支股票的季報資料（資產負債表 + 綜合損益表）
-        cqb.process_quarterly_balance_for_stock(stock_no)
-        # 爬取每支股票的季報資料（綜合損益表 + EPS
-        cqi.process_quarterly_income_for_stock(stock_no)
+    stock_nos = df_stocks["stock_no"].tolist()
+
+    if args.replay:
+        replay.replay_from_cache(stock_nos)
+        if not args.no_indicators:
+            with perf.task("indicators", "ALL"):
+                indicators.update()
+        if not args.no_fundamentals:
+            with perf.task("fundamentals", "ALL"):
+                fundamentals.update()
+        if not args.no_lake:
+            data_lake.sync()
+        perf.print_summary()
+        perf.close()
+        storage.print_metrics()
+        storage.close()
+        raise SystemExit(0)
+
+    datasets = DATASETS
+    if args.daily_mode == "market":
+        # 日成交資料改成每個交易日抓一次全市場，其餘資料集照舊逐股處理
+        with perf.task("daily_quotes", "ALL"):
+            cdq.process_daily_quotes_for_market(stock_nos)
+        datasets = [d for d in DATASETS if d[0] != "daily_quotes"]
+    elif args.daily_mode == "async":
+        # 日成交資料先一次回補完（不經過佇列），其餘資料集照舊逐股處理
+        cdq.process_daily_quotes_backfill(stock_nos)
+        datasets = [d for d in DATASETS if d[0] != "daily_quotes"]
+
+    # 3. 依各資料集的公布時程（交易日、月營收 10 日、季報申報期限）挑出可能有新資料的
+    #    (股票, 資料集)，配上期別放進佇列；同一期別已完成的不重跑，上次中斷或失敗的接著跑
+    names = [name for name, _ in datasets]
+    if args.all_datasets:
+        pairs = [(stock_no, name) for stock_no in stock_nos for name in names]
+    else:
+        pairs = scheduler.plan(stock_nos, names)
+        scheduler.print_plan(pairs, stock_nos, names)
+    task_queue.configure(args.queue_path)
+    if args.retry_failed:
+        print(f"🔁 重新排入 {task_queue.retry_dead()} 個已放棄的工作")
+    added = task_queue.enqueue(pairs)
+    print(f"📋 新增 {added} 個工作")
+
+    # 所有 clawer_* 共用同一組 Chrome（每個 worker 一個）；第一次要用瀏覽器時才啟動，
+    # 全部走 HTTP 的執行就不會開 Chrome
+    driver_pool.configure_pool(max(1, args.workers))
+    try:
+        if args.workers > 1:
+            run_parallel(args.workers, session=not args.no_stock_session)
+        else:
+            run_serial(session=not args.no_stock_session)
+        # 只算新交易日的技術指標（移動平均、RSI、MACD...）
+        if not args.no_indicators:
+            with perf.task("indicators", "ALL"):
+                indicators.update()
+        # 這次寫入過的季報、月營收才重算財務比率（毛利率、ROE、EPS TTM、營收成長率...）
+        if not args.no_fundamentals:
+            with perf.task("fundamentals", "ALL"):
+                fundamentals.update()
+        # 新資料接到 Parquet data lake，分析直接讀檔不用查資料庫
+        if not args.no_lake:
+            with perf.task("data_lake", "ALL"), perf.stage("write"):
+                data_lake.sync()
+    finally:
+        driver_pool.close_pool()
+        page_wait.print_wait_summary()
+        browser_profile.print_page_summary()
+        http_tables.print_path_summary()
+        host_limit.print_rate_summary()
+        circuit_breaker.print_summary()
+        task_queue.print_summary()
+        task_queue.close()
+        perf.print_summary()
+        perf.close()
+        storage.print_metrics()
+        storage.close()
@@ -0,0 +1,94 @@
+import json
+import threading
+from datetime import date, timedelta
+
+import requests
+
+import host_limit
+import raw_cache
+
+# ======= 設定區 =======
+
+# TWSE 每年公布的休市日（queryYear 是民國年）
+TWSE_HOLIDAY_URL = "https://www.twse.com.tw/holidaySchedule/holidaySchedule?response=json&queryYear={roc_year}"
+HTTP_TIMEOUT = 15
+# 休市日表裡也會列出「開始交易 / 最後交易」這種有開盤的日子，名稱含這些字的不算休市
+TRADING_DAY_MARKERS = ("開始交易", "最後交易")
+# 臨時休市（例如颱風假）等 TWSE 表上沒有的日子，手動補在這裡
+EXTRA_CLOSED_DAYS = set()
+
+_holidays = {}   # {西元年: set(date)}，抓不到的年份是 None（只排除週末）
+_warned = set()
+_lock = threading.Lock()
+
+
+def _parse_date(text: str) -> date:
+    text = str(text).strip().replace("-", "/")
+    y, m, d = (int(x) for x in text.split("/"))
+    if y < 1911:
+        y += 1911
+    return date(y, m, d)
+
+
+def _fetch_holidays(year: int) -> str:
+    url = TWSE_HOLIDAY_URL.format(roc_year=year - 1911)
+
+    def get():
+        resp = requests.get(url, timeout=HTTP_TIMEOUT)
+        resp.raise_for_status()
+        return resp.text
+    return host_limit.with_backoff(url, get)
+
+
+# 一年的休市日（不含週末）；過去的年份快取永不過期，今年的跟著 TTL 重抓（TWSE 可能會補公告）
+def _load_year(year: int):
+    try:
+        text = raw_cache.cached_fetch("twse", "holiday", "ALL", str(year), lambda: _fetch_holidays(year),
+                                      closed=year < date.today().year,
+                                      should_cache=lambda t: bool(json.loads(t).get("data")))
+        rows = json.loads(text).get("data") or []
+        days = set()
+        for row in rows:
+            if any(marker in str(row[1]) for marker in TRADING_DAY_MARKERS):
+                continue
+            try:
+                days.add(_parse_date(row[0]))
+            except ValueError:
+                continue
+        return days
+    except Exception as ex:
+        if year not in _warned:
+            _warned.add(year)
+            print(f"⚠️ 抓不到 {year} 年的休市日，只排除週末：{ex}")
+        return None
+
+
+def holidays(year: int) -> set:
+    with _lock:
+        if year not in _holidays:
+            _holidays[year] = _load_year(year)
+        return _holidays[year] or set()
+
+
+def is_trading_day(d: date) -> bool:
+    if d.weekday() >= 5 or d in EXTRA_CLOSED_DAYS:
+        return False
+    return d not in holidays(d.year)
+
+
+# d 當天（含）以前最近的交易日
+def previous_trading_day(d: date) -> date:
+    while not is_trading_day(d):
+        d -= timedelta(days=1)
+    return d
+
+
+# start ~ end（含）之間的交易日
+def trading_days(start: date, end: date) -> list:
+    days = []
+    d = start
+    while d <= end:
+        if is_trading_day(d):
+            days.append(d)
+        d += timedelta(days=1)
+    return days
@@ -0,0 +1,165 @@
+import threading
+import time
+
+from selenium.common.exceptions import TimeoutException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+import perf
+
+# ======= 設定區 =======
+
+# 每個頁面等待表格出現的上限（秒），取代原本固定的 time.sleep(5)
+PAGE_TIMEOUTS = {
+    "dividend": 15,
+    "revenue": 15,
+    "balance-sheet": 15,
+    "income-statement": 15,
+    "eps": 15,
+}
+DEFAULT_TIMEOUT = 15
+# 點按鈕後等表格內容變化的上限（秒）；已選取的分頁不會點，其他認不出選取狀態、
+# 點了內容卻沒變的按鈕，超過就直接用目前的內容，最差跟原本 time.sleep(3) 一樣
+CHANGE_TIMEOUT = 3
+POLL_INTERVAL = 0.1
+
+# 按鈕是不是已經是目前選取的分頁（radio 已勾選、aria-*、active / selected class）
+SELECTED_JS = """
+const el = arguments[0];
+const input = el.control || (el.matches('input') ? el : el.querySelector('input'));
+if (input && input.checked) return true;
+for (const attr of ['aria-selected', 'aria-pressed', 'aria-checked']) {
+    if (el.getAttribute(attr) === 'true') return true;
+}
+return /(^|[\\s_-])(active|selected|checked|current)($|[\\s_-])/i.test(el.getAttribute('class') || '');
+"""
+
+# 每次等待實際花的時間：[{"page", "label", "seconds", "ok"}, ...]
+WAIT_LOG = []
+_log_lock = threading.Lock()
+
+
+def page_timeout(page: str) -> float:
+    return PAGE_TIMEOUTS.get(page, DEFAULT_TIMEOUT)
+
+
+def _record(page, label, started, ok):
+    seconds = time.perf_counter() - started
+    with _log_lock:
+        WAIT_LOG.append({
+            "page": page,
+            "label": label,
+            "seconds": seconds,
+            "ok": ok,
+        })
+    perf.record("wait", seconds, outcome="ok" if ok else "timeout")
+
+
+# 等到 xpath 的元素出現才回傳，逾時丟 TimeoutException
+# 頁面已經載入、元素卻一直沒出來，當成頁面結構的問題（circuit_breaker），不拿來降速
+def wait_for_element(driver, xpath: str, page: str, label: str = "load"):
+    started = time.perf_counter()
+    try:
+        element = WebDriverWait(driver, page_timeout(page), poll_frequency=POLL_INTERVAL).until(
+            EC.presence_of_element_located((By.XPATH, xpath))
+        )
+    except TimeoutException:
+        _record(page, label, started, False)
+        raise TimeoutException(f"{page} 等待 {label} 逾時：{xpath}")
+    _record(page, label, started, True)
+    return element
+
+
+def _outer_html(driver, xpath):
+    try:
+        return driver.find_element(By.XPATH, xpath).get_attribute("outerHTML")
+    except Exception:
+        return None
+
+
+def _is_selected(driver, button) -> bool:
+    try:
+        return bool(driver.execute_script(SELECTED_JS, button))
+    except Exception:
+        return False
+
+
+# 點按鈕，等 table_xpath 的內容跟點之前不一樣再回傳表格的 outerHTML
+# 按鈕本來就是目前的分頁（例如預設的資產表）點了內容不會變，不點也不等，直接用目前的表格
+def click_and_wait_changed(driver, button_xpath: str, table_xpath: str, page: str, label: str = "click"):
+    button = wait_for_element(driver, button_xpath, page, f"{label}:button")
+    before = _outer_html(driver, table_xpath)
+    if before is not None and _is_selected(driver, button):
+        _record(page, f"{label}:selected", time.perf_counter(), True)
+        return before
+    button.click()
+
+    started = time.perf_counter()
+    deadline = started + CHANGE_TIMEOUT
+    while True:
+        try:
+            html = driver.find_element(By.XPATH, table_xpath).get_attribute("outerHTML")
+        except Exception:
+            html = None
+        if html is not None and html != before:
+            _record(page, label, started, True)
+            return html
+        if time.perf_counter() >= deadline:
+            break
+        time.sleep(POLL_INTERVAL)
+
+    # 內容沒變：表格還在就用目前內容，不在就當作逾時
+    _record(page, label, started, False)
+    if html is None:
+        return wait_for_element(driver, table_xpath, page, f"{label}:table").get_attribute("outerHTML")
+    return html
+
+
+# 點頁面內的連結（單頁應用程式切換分頁，不重新載入），等 watched_xpath 的元素被換掉；
+# 沒被換掉（例如連結其實沒作用）回傳 False，讓呼叫端改用整頁載入
+def click_and_wait_replaced(driver, link, watched_xpath: str, page: str, label: str = "switch") -> bool:
+    try:
+        watched = driver.find_element(By.XPATH, watched_xpath)
+    except Exception:
+        watched = None
+    driver.execute_script("arguments[0].click();", link)
+    if watched is None:
+        return False
+
+    started = time.perf_counter()
+    try:
+        WebDriverWait(driver, page_timeout(page), poll_frequency=POLL_INTERVAL).until(EC.staleness_of(watched))
+    except TimeoutException:
+        _record(page, label, started, False)
+        return False
+    _record(page, label, started, True)
+    return True
+
+
+# 依 page/label 統計等待時間，看時間花在哪
+def wait_summary():
+    with _log_lock:
+        records = list(WAIT_LOG)
+    summary = {}
+    for r in records:
+        key = f'{r["page"]}:{r["label"]}'
+        s = summary.setdefault(key, {"count": 0, "total": 0.0, "max": 0.0, "timeouts": 0})
+        s["count"] += 1
+        s["total"] += r["seconds"]
+        s["max"] = max(s["max"], r["seconds"])
+        if not r["ok"]:
+            s["timeouts"] += 1
+    for s in summary.values():
+        s["avg"] = s["total"] / s["count"]
+    return summary
+
+
+def print_wait_summary():
+    summary = wait_summary()
+    if not summary:
+        return
+    print("⏱️ 頁面等待時間統計")
+    for key, s in sorted(summary.items(), key=lambda kv: -kv[1]["total"]):
+        print(f"  {key:<32} 次數 {s['count']:>5}  平均 {s['avg']:.2f}s  最長 {s['max']:.2f}s  "
+              f"合計 {s['total']:.1f}s  未變化/逾時 {s['timeouts']}")
@@ -0,0 +1,211 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# ======= 設定區 =======
+
+SLOWEST_STOCKS = 10   # 報表列出最慢的幾支股票
+# 報表裡階段的排列順序；rate_wait（等 host_limit 的 token）、render / wait（開瀏覽器抓頁面時）
+# 都是在 fetch 裡面量到的
+STAGE_ORDER = ["fetch", "rate_wait", "render", "wait", "parse", "transform", "write"]
+
+_events = []
+_lock = threading.Lock()
+_log_file = None
+_local = threading.local()
+_run_started = None   # (牆上時間, 行程 CPU 時間)
+
+
+# 開始記錄；path 給了就把每個事件寫成一行 JSON（JSON-lines）
+def configure(path=None):
+    global _log_file, _run_started
+    with _lock:
+        _events.clear()
+        if _log_file is not None:
+            _log_file.close()
+        _log_file = open(path, "a", encoding="utf-8") if path else None
+        _run_started = (time.perf_counter(), time.process_time())
+
+
+def close():
+    global _log_file
+    with _lock:
+        if _log_file is not None:
+            _log_file.close()
+            _log_file = None
+
+
+def _emit(event: dict):
+    event["ts"] = datetime.now().isoformat(timespec="milliseconds")
+    with _lock:
+        _events.append(event)
+        if _log_file is not None:
+            _log_file.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+            _log_file.flush()
+
+
+class _Span:
+    def __init__(self, rows=None):
+        self.rows = rows
+        self.info = {}
+
+
+# 一支股票的一個資料集（一次 process_*_for_stock 呼叫）
+# 有階段丟例外 → error（最後一個例外記在 ctx["exception"] / ctx["error"]，process_* 自己接住時也看得到）；一個階段都沒跑（高水位已是最新）→ skipped；其餘 ok
+@contextmanager
+def task(dataset: str, stock_no: str):
+    outer = getattr(_local, "task", None)
+    ctx = {"dataset": dataset, "stock_no": str(stock_no), "stages": 0, "failed": False,
+           "exception": None, "error": None}
+    _local.task = ctx
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    failed = False
+    try:
+        yield ctx
+    except Exception as ex:
+        failed = True
+        ctx["exception"], ctx["error"] = ex, f"{type(ex).__name__}: {str(ex).strip()}"
+        raise
+    finally:
+        _local.task = outer
+        if failed or ctx["failed"]:
+            outcome = "error"
+        elif ctx["stages"] == 0:
+            outcome = "skipped"
+        else:
+            outcome = "ok"
+        _emit({
+            "event": "task",
+            "dataset": dataset,
+            "stock_no": str(stock_no),
+            "duration": time.perf_counter() - started,
+            "cpu": time.thread_time() - cpu_started,
+            "outcome": outcome,
+        })
+
+
+# 量一個階段；在 with 裡設定 span.rows 記錄筆數
+# 股票代號、資料集預設用目前 task 的，沒有 task 時（例如重播）照樣記錄
+@contextmanager
+def stage(name: str, rows=None):
+    ctx = getattr(_local, "task", None)
+    span = _Span(rows)
+    outer = getattr(_local, "span", None)
+    _local.span = span
+    started, cpu_started = time.perf_counter(), time.thread_time()
+    outcome = "ok"
+    try:
+        yield span
+    except Exception as ex:
+        outcome = "error"
+        if ctx is not None:
+            ctx["failed"] = True
+            ctx["exception"], ctx["error"] = ex, f"{type(ex).__name__}: {str(ex).strip()}"
+        raise
+    finally:
+        _local.span = outer
+        if ctx is not None:
+            ctx["stages"] += 1
+        _emit({
+            "event": "stage",
+            "stage": name,
+            "dataset": ctx["dataset"] if ctx else None,
+            "stock_no": ctx["stock_no"] if ctx else None,
+            "duration": time.perf_counter() - started,
+            "cpu": time.thread_time() - cpu_started,
+            "rows": span.rows,
+            "outcome": outcome,
+            **span.info,
+        })
+
+
+# 在目前這個階段的事件上多記幾個欄位，例如 annotate(path="http")
+def annotate(**fields):
+    span = getattr(_local, "span", None)
+    if span is not None:
+        span.info.update(fields)
+
+
+# 已經量好的時間直接記一筆（例如 page_wait 自己計時的等待）
+def record(name: str, duration: float, rows=None, outcome="ok"):
+    ctx = getattr(_local, "task", None)
+    if ctx is not None:
+        ctx["stages"] += 1
+    _emit({
+        "event": "stage",
+        "stage": name,
+        "dataset": ctx["dataset"] if ctx else None,
+        "stock_no": ctx["stock_no"] if ctx else None,
+        "duration": duration,
+        "cpu": None,
+        "rows": rows,
+        "outcome": outcome,
+    })
+
+
+# ======= 報表 =======
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank
+    k = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[k - 1]
+
+
+def summary() -> dict:
+    with _lock:
+        events = list(_events)
+
+    stages = {}
+    for e in events:
+        if e["event"] == "stage":
+            stages.setdefault(e["stage"], []).append(e["duration"])
+    stage_stats = {}
+    for name, durations in stages.items():
+        durations.sort()
+        stage_stats[name] = {
+            "count": len(durations),
+            "total": sum(durations),
+            "p50": _percentile(durations, 50),
+            "p95": _percentile(durations, 95),
+            "max": durations[-1],
+        }
+
+    per_stock, outcomes = {}, {}
+    for e in events:
+        if e["event"] != "task":
+            continue
+        per_stock[e["stock_no"]] = per_stock.get(e["stock_no"], 0.0) + e["duration"]
+        outcomes[e["outcome"]] = outcomes.get(e["outcome"], 0) + 1
+    slowest = sorted(per_stock.items(), key=lambda kv: -kv[1])[:SLOWEST_STOCKS]
+
+    wall = cpu = None
+    if _run_started is not None:
+        wall = time.perf_counter() - _run_started[0]
+        cpu = time.process_time() - _run_started[1]
+
+    return {"stages": stage_stats, "slowest": slowest, "outcomes": outcomes, "wall": wall, "cpu": cpu}
+
+
+def print_summary():
+    s = summary()
+    if not s["stages"] and not s["outcomes"]:
+        return
+    order = {name: i for i, name in enumerate(STAGE_ORDER)}
+    print("📊 各階段耗時（rate_wait / render / wait 包含在 fetch 內）")
+    for name, st in sorted(s["stages"].items(), key=lambda kv: order.get(kv[0], len(order))):
+        print(f"  {name:<10} 次數 {st['count']:>6}  p50 {st['p50']:.3f}s  p95 {st['p95']:.3f}s  "
+              f"最長 {st['max']:.2f}s  合計 {st['total']:.1f}s")
+    if s["outcomes"]:
+        print("  結果：" + "、".join(f"{k} {v}" for k, v in sorted(s["outcomes"].items())))
+    if s["slowest"]:
+        print("🐢 最慢的股票")
+        for stock_no, seconds in s["slowest"]:
+            print(f"  {stock_no:<8} {seconds:.1f}s")
+    if s["wall"]:
+        print(f"⏱️ 總時間 {s['wall']:.1f}s，CPU 時間 {s['cpu']:.1f}s"
+              f"（CPU 佔 {s['cpu'] / s['wall']:.0%}，其餘多半在等網路、瀏覽器或資料庫）")
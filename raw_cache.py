@@ -0,0 +1,161 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+import perf
+
+# ======= 設定區 =======
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "raw_cache")
+
+# 每個資料集的快取有效時間（秒）；已結束的月份 / 季別標成 closed 就永不過期
+DATASET_TTL = {
+    "stock_day": 6 * 3600,
+    "market_day": 6 * 3600,
+    "dividend": 20 * 3600,
+    "revenue": 20 * 3600,
+    "balance-sheet": 20 * 3600,
+    "income-statement": 20 * 3600,
+    "quote": 10 * 60,
+}
+DEFAULT_TTL = 20 * 3600
+
+# 重播模式：只讀快取、不連網，快取沒有就丟 CacheMiss
+_replay = False
+_lock = threading.Lock()
+
+
+class CacheMiss(Exception):
+    pass
+
+
+def set_replay(enabled: bool):
+    global _replay
+    _replay = enabled
+
+
+def is_replay() -> bool:
+    return _replay
+
+
+# ======= 路徑：refs 放 key → 內容雜湊，objects 放 gzip 後的內容（同內容只存一份） =======
+
+def _ref_path(source, dataset, stock_no, period):
+    return os.path.join(CACHE_DIR, "refs", source, dataset, str(stock_no), f"{period}.json")
+
+
+def _object_path(digest):
+    return os.path.join(CACHE_DIR, "objects", digest[:2], f"{digest}.gz")
+
+
+def _write_atomic(path, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _read_ref(source, dataset, stock_no, period):
+    try:
+        with open(_ref_path(source, dataset, stock_no, period), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_object(digest):
+    with gzip.open(_object_path(digest), "rb") as f:
+        return f.read().decode("utf-8")
+
+
+def _expired(ref, dataset):
+    if ref.get("closed"):
+        return False
+    return time.time() - ref["fetched_at"] > DATASET_TTL.get(dataset, DEFAULT_TTL)
+
+
+# ======= 讀寫 =======
+
+def get(source, dataset, stock_no, period, ignore_ttl=False):
+    ref = _read_ref(source, dataset, stock_no, period)
+    if ref is None or (not ignore_ttl and _expired(ref, dataset)):
+        return None
+    try:
+        return _read_object(ref["sha256"])
+    except OSError:
+        return None
+
+
+def put(source, dataset, stock_no, period, payload: str, closed=False):
+    data = payload.encode("utf-8")
+    digest = hashlib.sha256(data).hexdigest()
+    obj = _object_path(digest)
+    if not os.path.exists(obj):
+        _write_atomic(obj, gzip.compress(data))
+    ref = {
+        "source": source,
+        "dataset": dataset,
+        "stock_no": str(stock_no),
+        "period": str(period),
+        "sha256": digest,
+        "fetched_at": time.time(),
+        "closed": bool(closed),
+    }
+    with _lock:
+        _write_atomic(_ref_path(source, dataset, stock_no, period),
+                      json.dumps(ref, ensure_ascii=False).encode("utf-8"))
+
+
+# 確認內容已經包含該期別（例如抓到的季報已經有最新一季）後，標成永不過期
+def mark_closed(source, dataset, stock_no, period):
+    ref = _read_ref(source, dataset, stock_no, period)
+    if ref is None or ref.get("closed"):
+        return
+    ref["closed"] = True
+    with _lock:
+        _write_atomic(_ref_path(source, dataset, stock_no, period),
+                      json.dumps(ref, ensure_ascii=False).encode("utf-8"))
+
+
+# 快取有且沒過期就直接用，否則呼叫 fetch() 並存起來；重播模式下不呼叫 fetch
+# should_cache(payload) 回傳 False 時不存（例如被擋、回傳錯誤）
+def cached_fetch(source, dataset, stock_no, period, fetch, closed=False, should_cache=None) -> str:
+    payload = get(source, dataset, stock_no, period, ignore_ttl=_replay)
+    if payload is not None:
+        perf.annotate(path="cache")
+        return payload
+    if _replay:
+        raise CacheMiss(f"快取沒有 {source}/{dataset}/{stock_no}/{period}")
+    payload = fetch()
+    if should_cache is None or should_cache(payload):
+        put(source, dataset, stock_no, period, payload, closed=closed)
+    return payload
+
+
+# 列出快取裡的所有 key（重播用），可依 source / dataset 篩選
+def iter_entries(source=None, dataset=None):
+    refs_dir = os.path.join(CACHE_DIR, "refs")
+    if not os.path.isdir(refs_dir):
+        return
+    for root, _, files in os.walk(refs_dir):
+        for name in sorted(files):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(root, name), encoding="utf-8") as f:
+                    ref = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if source and ref["source"] != source:
+                continue
+            if dataset and ref["dataset"] != dataset:
+                continue
+            yield ref
+
+
+def load(ref) -> str:
+    return _read_object(ref["sha256"])
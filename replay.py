@@ -0,0 +1,78 @@
+import json
+from datetime import datetime
+
+import raw_cache
+import watermark
+import clawer_dividend as cd
+import clawer_monthly_revenue as cmr
+import clawer_daily_quotes as cdq
+import clawer_quarterly_balance as cqb
+import clawer_quarterly_income as cqi
+
+
+# 同一支股票的 cmoney 頁面只需要重播最新一份（頁面本身就包含全部歷史）
+def _latest_per_stock(refs):
+    latest = {}
+    for ref in refs:
+        key = ref["stock_no"]
+        if key not in latest or ref["period"] > latest[key]["period"]:
+            latest[key] = ref
+    return [latest[k] for k in sorted(latest)]
+
+
+def _period_ym(period: str):
+    return int(period[:4]), int(period[4:6])
+
+
+def _period_yq(period: str):
+    return int(period[:4]), int(period[5:])
+
+
+def _replay_one(label, ref, action):
+    try:
+        action(raw_cache.load(ref))
+    except Exception as ex:
+        print(f"❌ 重播 {label} {ref['stock_no']} {ref['period']} 失敗：{ex}")
+
+
+# 只用快取重跑所有 transform 與寫入，不開瀏覽器、不連網；不看高水位，全部重寫一次
+def replay_from_cache(stock_nos=None):
+    raw_cache.set_replay(True)
+    wanted = None if stock_nos is None else {str(s) for s in stock_nos}
+
+    def keep(ref):
+        return wanted is None or ref["stock_no"] in wanted or ref["stock_no"] == "ALL"
+
+    # 日成交（每支股票每個月）
+    for ref in filter(keep, raw_cache.iter_entries("twse", "stock_day")):
+        _replay_one("日成交", ref, lambda p, r=ref: cdq.save_stock_month_json(
+            r["stock_no"], r["period"], json.loads(p), use_watermark=False))
+
+    # 日成交（全市場每天）
+    for ref in filter(keep, raw_cache.iter_entries("twse", "market_day")):
+        trade_date = datetime.strptime(ref["period"], "%Y%m%d").date()
+        _replay_one("全市場日成交", ref, lambda p, d=trade_date: cdq.save_market_day_json(
+            d, json.loads(p), stock_nos, use_watermark=False))
+
+    # 股利
+    for ref in _latest_per_stock(filter(keep, raw_cache.iter_entries("cmoney", "dividend"))):
+        _replay_one("股利", ref, lambda p, r=ref: cd.save_dividend_df(
+            r["stock_no"], cd.parse_dividend_html(p), use_watermark=False))
+
+    # 月營收
+    for ref in _latest_per_stock(filter(keep, raw_cache.iter_entries("cmoney", "revenue"))):
+        _replay_one("月營收", ref, lambda p, r=ref: cmr.save_monthly_revenue_df(
+            r["stock_no"], cmr.parse_monthly_revenue_html(p),
+            watermark.MONTHLY_DEFAULT_START, _period_ym(r["period"])))
+
+    # 季資產負債
+    for ref in _latest_per_stock(filter(keep, raw_cache.iter_entries("cmoney", "balance-sheet"))):
+        _replay_one("季資產負債", ref, lambda p, r=ref: cqb.save_quarterly_balance(
+            r["stock_no"], *cqb.parse_quarterly_balance_html(json.loads(p)),
+            watermark.QUARTERLY_DEFAULT_START, _period_yq(r["period"])))
+
+    # 季損益 + EPS
+    for ref in _latest_per_stock(filter(keep, raw_cache.iter_entries("cmoney", "income-statement"))):
+        _replay_one("季損益", ref, lambda p, r=ref: cqi.save_quarterly_income(
+            r["stock_no"], *cqi.parse_quarterly_income_html(json.loads(p)),
+            watermark.QUARTERLY_DEFAULT_START, _period_yq(r["period"])))
@@ -0,0 +1,71 @@
+from datetime import date
+
+import market_calendar
+import watermark
+
+# ======= 設定區 =======
+
+# 股利：董事會決議、股東會、除權息大多集中在這幾個月，期間每週檢查一次，其他月份每月一次
+DIVIDEND_SEASON_MONTHS = range(3, 10)
+
+
+# 股利這次的檢查週期；工作佇列同一個週期只會跑一次
+def dividend_period(today: date = None) -> str:
+    today = today or date.today()
+    if today.month in DIVIDEND_SEASON_MONTHS:
+        year, week, _ = today.isocalendar()
+        return f"{year}-W{week:02d}"
+    return f"{today.year}-{today.month:02d}"
+
+
+# ======= 每個資料集：這支股票現在可能有新資料嗎 =======
+
+# 日成交：最近一個交易日（收盤後、跳過休市日）比資料庫新
+def _daily_quotes_due(stock_no) -> bool:
+    return watermark.first_missing_trade_date(stock_no) is not None
+
+
+# 月營收：每月 10 日公布期限過後才有下一個月份
+def _monthly_revenue_due(stock_no) -> bool:
+    return watermark.missing_revenue_range(stock_no) is not None
+
+
+# 季報：各季申報期限（5/15、8/14、11/14、3/31）過後才有下一季
+def _quarterly_due(dataset):
+    return lambda stock_no: watermark.missing_quarter_range(dataset, stock_no) is not None
+
+
+# 股利：沒有固定公布日，交給 dividend_period 控制檢查頻率
+def _dividend_due(stock_no) -> bool:
+    return True
+
+
+DUE = {
+    "dividend": _dividend_due,
+    "monthly_revenue": _monthly_revenue_due,
+    "daily_quotes": _daily_quotes_due,
+    "quarterly_balance": _quarterly_due("quarterly_balance"),
+    "quarterly_income": _quarterly_due("quarterly_income"),
+}
+
+
+# 這次執行要跑的 (stock_no, dataset)，順序同 stock_nos × datasets
+def plan(stock_nos, datasets) -> list:
+    return [
+        (stock_no, name)
+        for stock_no in stock_nos
+        for name in datasets
+        if DUE[name](str(stock_no))
+    ]
+
+
+def print_plan(pairs, stock_nos, datasets):
+    counts = {name: 0 for name in datasets}
+    for _, name in pairs:
+        counts[name] += 1
+    today = date.today()
+    status = "交易日" if market_calendar.is_trading_day(today) else "休市"
+    print(f"🗓️ 今天 {today}（{status}），最近交易日 {watermark.latest_trade_date()}，"
+          f"月營收到 {'%d/%02d' % watermark.latest_revenue_month()}，季報到 {'%dQ%d' % watermark.latest_quarter()}")
+    for name in datasets:
+        print(f"  {name:<18} {counts[name]:>5} / {len(stock_nos)} 支股票可能有新資料")
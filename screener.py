@@ -0,0 +1,397 @@
+import argparse
+import ast
+import threading
+import time
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+import storage
+
+# ======= 設定區 =======
+
+DIVIDEND_DAYS = 365   # 殖利率：最新收盤日往回這幾天內除息的現金股利合計 / 收盤價
+DEFAULT_TOP = 30
+
+# 各表每支股票最新的一筆；{where} 換成股票條件（refresh 只讀部分股票時用）
+_LATEST_SQL = """
+    SELECT {columns} FROM (
+        SELECT t.*, ROW_NUMBER() OVER (PARTITION BY t.{key} ORDER BY {order} DESC) AS rn
+        FROM {table} t {where}
+    ) x
+    WHERE rn = 1
+"""
+
+# 來源：(表, 股票欄位, 排序, {來源欄位: 篩選時的欄名})
+SOURCES = {
+    "quotes": ("dbo.stock_daily_quotes", "stock_id", "t.trade_date", {
+        "trade_date": "trade_date", "last_price": "close", "prev_close": "prev_close",
+        "volume_lots": "volume"}),
+    "indicators": ("dbo.stock_daily_indicators", "stock_id", "t.trade_date", {
+        "ma5": "ma5", "ma20": "ma20", "ma60": "ma60", "rsi14": "rsi14", "macd_hist": "macd_hist",
+        "atr14": "atr14", "vol_ma20": "vol_ma20"}),
+    "ratios": ("dbo.stock_quarterly_ratios", "stock_no", "t.fiscal_year * 4 + t.fiscal_quarter", {
+        "fiscal_year": "fiscal_year", "fiscal_quarter": "fiscal_quarter",
+        "gross_margin": "gross_margin", "operating_margin": "operating_margin", "net_margin": "net_margin",
+        "debt_ratio": "debt_ratio", "roe_ttm": "roe", "eps_ttm": "eps_ttm", "revenue_yoy": "q_revenue_yoy"}),
+    "revenue": ("dbo.stock_monthly_revenue_growth", "stock_no", "t.year * 12 + t.month", {
+        "year": "revenue_year", "month": "revenue_month",
+        "revenue_mom": "revenue_mom", "revenue_yoy": "revenue_yoy", "revenue_ytd_yoy": "revenue_ytd_yoy"}),
+}
+CATEGORIES = ["market", "industry"]   # 存成 code，比較時先把字串轉成 code
+TEXT_COLUMNS = ["stock_no", "name"]
+DATE_COLUMNS = ["trade_date"]
+
+# 算出來的欄位（由上面的欄位算，單位：%、倍）
+DERIVED = {
+    "change_pct": lambda c: _ratio(c["close"], c["prev_close"]) * 100 - 100,
+    "dividend_yield": lambda c: _ratio(c["dividend_ttm"], c["close"]) * 100,
+    "pe": lambda c: np.where(c["eps_ttm"] > 0, _ratio(c["close"], c["eps_ttm"]), np.nan),
+}
+
+
+def _ratio(a, b):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(b != 0, a / b, np.nan)
+
+
+# ======= 讀資料（只有 load / refresh 會查資料庫） =======
+
+def _in_list(stock_nos) -> str:
+    return ", ".join("'" + str(s).replace("'", "''") + "'" for s in stock_nos)
+
+
+def _read_latest(name, stock_nos=None) -> pd.DataFrame:
+    table, key, order, columns = SOURCES[name]
+    where = f"WHERE t.{key} IN ({_in_list(stock_nos)})" if stock_nos is not None else ""
+    sql = _LATEST_SQL.format(columns=", ".join([key] + list(columns)), key=key, order=order,
+                             table=table, where=where)
+    if not storage.has_table(table.replace("dbo.", "")):
+        return pd.DataFrame(columns=["stock_no"] + list(columns.values()))
+    df = storage.read_sql(sql).rename(columns={key: "stock_no", **columns})
+    df["stock_no"] = df["stock_no"].astype(str).str.strip()
+    return df
+
+
+def _read_dividends(stock_nos=None) -> pd.DataFrame:
+    where = f"AND stock_no IN ({_in_list(stock_nos)})" if stock_nos is not None else ""
+    df = storage.read_sql("SELECT stock_no, cash_dividend, ex_dividend_date FROM dbo.stock_dividend "
+                          f"WHERE ex_dividend_date IS NOT NULL {where}")
+    df["stock_no"] = df["stock_no"].astype(str).str.strip()
+    df["ex_dividend_date"] = pd.to_datetime(df["ex_dividend_date"])
+    df["cash_dividend"] = pd.to_numeric(df["cash_dividend"], errors="coerce")
+    return df
+
+
+# 每支股票一列：stocks 的基本資料 + 各表最新一筆 + 近一年現金股利
+def load_frame(stock_nos=None) -> pd.DataFrame:
+    where = f"WHERE stock_no IN ({_in_list(stock_nos)})" if stock_nos is not None else ""
+    df = storage.read_sql(f"SELECT stock_no, name, market, market_cap, industry FROM dbo.stocks {where}")
+    df["stock_no"] = df["stock_no"].astype(str).str.strip()
+    for name in SOURCES:
+        df = df.merge(_read_latest(name, stock_nos), on="stock_no", how="left")
+    df["trade_date"] = pd.to_datetime(df["trade_date"])
+
+    # 近一年除息的現金股利合計（以各股最新收盤日為準，沒有報價的用今天）
+    div = _read_dividends(stock_nos).merge(df[["stock_no", "trade_date"]], on="stock_no")
+    asof = div["trade_date"].fillna(pd.Timestamp.today().normalize())
+    div = div[(div["ex_dividend_date"] <= asof) & (div["ex_dividend_date"] > asof - pd.Timedelta(days=DIVIDEND_DAYS))]
+    df["dividend_ttm"] = df["stock_no"].map(div.groupby("stock_no")["cash_dividend"].sum()).fillna(0.0)
+    return df
+
+
+# ======= 欄式的股票池 =======
+
+class Universe:
+    def __init__(self):
+        self.columns = {}      # 欄名 -> np.ndarray（數值 float32、類別 code、文字 object）
+        self.categories = {}   # 類別欄 -> pd.Index（code 對應的字串）
+        self.loaded_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.columns.get("stock_no", ()))
+
+    @property
+    def names(self):
+        return list(self.columns) + list(DERIVED)
+
+    # 整份重建（第一次、或股票清單變了）
+    def load(self):
+        df = load_frame()
+        columns, categories = {}, {}
+        for col in df.columns:
+            if col in CATEGORIES:
+                cat = pd.Categorical(df[col].fillna("").astype(str))
+                columns[col], categories[col] = cat.codes.copy(), cat.categories
+            elif col in TEXT_COLUMNS:
+                columns[col] = df[col].to_numpy(dtype=object)
+            elif col in DATE_COLUMNS:
+                columns[col] = df[col].to_numpy(dtype="datetime64[D]")
+            else:
+                columns[col] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float32)
+        with self._lock:
+            self.columns, self.categories = columns, categories
+            self._positions = {s: i for i, s in enumerate(columns["stock_no"])}
+            self.loaded_at = time.time()
+        return self
+
+    # 只重讀指定股票，直接改寫陣列裡那幾列；有新股票或新的類別時整份重建
+    def refresh(self, stock_nos=None) -> int:
+        if stock_nos is None or not self.columns:
+            self.load()
+            return len(self)
+        stock_nos = [str(s) for s in stock_nos]
+        df = load_frame(stock_nos)
+        if any(s not in self._positions for s in df["stock_no"]):
+            self.load()
+            return len(self)
+        with self._lock:
+            rows = np.array([self._positions[s] for s in df["stock_no"]], dtype=int)
+            for col, values in self.columns.items():
+                if col in CATEGORIES:
+                    codes = self.categories[col].get_indexer(df[col].fillna("").astype(str))
+                    if (codes < 0).any():
+                        break
+                    values[rows] = codes
+                elif col in TEXT_COLUMNS:
+                    values[rows] = df[col].to_numpy(dtype=object)
+                elif col in DATE_COLUMNS:
+                    values[rows] = df[col].to_numpy(dtype="datetime64[D]")
+                else:
+                    values[rows] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float32)
+            else:
+                self.loaded_at = time.time()
+                return len(rows)
+        self.load()
+        return len(self)
+
+    # 重讀一次各表的最新一筆，和記憶體裡不同的股票才改寫那幾列；回傳有變動的股票
+    def refresh_if_changed(self) -> list:
+        fresh = Universe().load()
+        same_layout = (
+            len(fresh) == len(self)
+            and (fresh.columns["stock_no"] == self.columns["stock_no"]).all()
+            and all(fresh.categories[c].equals(self.categories[c]) for c in CATEGORIES)
+        )
+        if not same_layout:
+            with self._lock:
+                self.columns, self.categories = fresh.columns, fresh.categories
+                self._positions, self.loaded_at = fresh._positions, fresh.loaded_at
+            return list(self.columns["stock_no"])
+        changed = np.zeros(len(self), dtype=bool)
+        for col, values in self.columns.items():
+            new = fresh.columns[col]
+            changed |= ~((new == values) | (pd.isna(new) & pd.isna(values)))
+        with self._lock:
+            for col, values in self.columns.items():
+                values[changed] = fresh.columns[col][changed]
+            self.loaded_at = fresh.loaded_at
+        return list(self.columns["stock_no"][changed])
+
+    # 類別欄還原成字串，其他欄原樣；衍生欄位現算
+    def column(self, name):
+        if name in DERIVED:
+            return DERIVED[name](self)
+        values = self.columns[name]
+        if name in CATEGORIES:
+            return np.asarray(self.categories[name])[values].astype(object)
+        return values
+
+    # 類別欄回傳字串（column），不把 code 當數字給人算
+    def __getitem__(self, name):
+        return self.column(name) if name in DERIVED or name in CATEGORIES else self.columns[name]
+
+    def code(self, name, label) -> int:
+        idx = self.categories[name].get_indexer([label])[0]
+        return int(idx)   # -1：沒有這個類別，比較結果全部 False
+
+    # 篩選 + 排序，回傳選到的股票（只有這幾列轉成 DataFrame）
+    def screen(self, where=None, rank=None, ascending=False, top=DEFAULT_TOP, columns=None) -> pd.DataFrame:
+        with self._lock:
+            mask = np.ones(len(self), dtype=bool) if not where else _evaluate(self, where)
+            if np.ndim(mask) == 0:
+                mask = np.full(len(self), bool(mask))
+            idx = np.flatnonzero(mask)
+            used = _names(where) + _names(rank)
+            if rank:
+                score = np.asarray(_evaluate(self, rank), dtype=float)[idx]
+                order = np.argsort(score if ascending else -score, kind="stable")
+                # NaN 一律排最後
+                order = order[np.argsort(np.isnan(score[order]), kind="stable")]
+                idx = idx[order]
+            if top:
+                idx = idx[:top]
+            out = {"stock_no": self.columns["stock_no"][idx], "name": self.columns["name"][idx],
+                   "market": self.column("market")[idx], "industry": self.column("industry")[idx]}
+            for name in (columns or []) + used:
+                if name not in out:
+                    out[name] = np.asarray(self.column(name))[idx]
+            if rank:
+                out["rank_value"] = score[order][:len(idx)]
+        return pd.DataFrame(out)
+
+
+# ======= 條件式（Python 語法的子集，整欄向量運算） =======
+
+_COMPARE = {ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Lt: np.less, ast.LtE: np.less_equal,
+            ast.Eq: np.equal, ast.NotEq: np.not_equal}
+_ARITH = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide,
+          ast.BitAnd: np.logical_and, ast.BitOr: np.logical_or}
+
+
+@lru_cache(maxsize=256)
+def _parse(expr):
+    return ast.parse(expr, mode="eval").body
+
+
+def _names(expr) -> list:
+    if not expr:
+        return []
+    return list(dict.fromkeys(n.id for n in ast.walk(_parse(expr)) if isinstance(n, ast.Name)))
+
+
+def _evaluate(universe, expr):
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return _eval_node(universe, _parse(expr))
+
+
+def _literal(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+        return [_literal(e) for e in node.elts]
+    raise ValueError(f"只能和常數比較：{ast.unparse(node)}")
+
+
+# industry == "半導體業"、market in ["TSE", "OTC"]：字串換成 code 再比
+def _compare_category(universe, name, op, right):
+    codes = universe.columns[name]
+    if isinstance(op, (ast.In, ast.NotIn)):
+        hit = np.isin(codes, [universe.code(name, v) for v in right])
+        return hit if isinstance(op, ast.In) else ~hit
+    if type(op) not in (ast.Eq, ast.NotEq):
+        raise ValueError(f"{name} 只能用 ==、!=、in")
+    return _COMPARE[type(op)](codes, universe.code(name, right))
+
+
+# stock_no == "2330"、name in ["台積電", "鴻海"]：文字欄只能比相等
+def _compare_text(universe, name, op, right):
+    values = universe.columns[name]
+    if isinstance(op, (ast.In, ast.NotIn)):
+        hit = np.isin(values, [str(v) for v in right])
+        return hit if isinstance(op, ast.In) else ~hit
+    if type(op) not in (ast.Eq, ast.NotEq):
+        raise ValueError(f"{name} 只能用 ==、!=、in")
+    return _COMPARE[type(op)](values, str(right))
+
+
+def _eval_node(u, node):
+    if isinstance(node, ast.Name):
+        if node.id not in u.columns and node.id not in DERIVED:
+            raise ValueError(f"沒有這個欄位：{node.id}（可用：{', '.join(u.names)}）")
+        # 類別欄存的是 code、文字欄是字串，不能拿來運算或當參數，只能直接和常數比
+        if node.id in CATEGORIES or node.id in TEXT_COLUMNS:
+            raise ValueError(f"{node.id} 只能直接和常數比較（==、!=、in），例如 {node.id} == \"...\"")
+        return u[node.id]
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.BoolOp):
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+        result = _eval_node(u, node.values[0])
+        for value in node.values[1:]:
+            result = combine(result, _eval_node(u, value))
+        return result
+    if isinstance(node, ast.UnaryOp):
+        value = _eval_node(u, node.operand)
+        if isinstance(node.op, (ast.Not, ast.Invert)):
+            return np.logical_not(value)
+        return -value if isinstance(node.op, ast.USub) else value
+    if isinstance(node, ast.BinOp) and type(node.op) in _ARITH:
+        return _ARITH[type(node.op)](_eval_node(u, node.left), _eval_node(u, node.right))
+    if isinstance(node, ast.Compare):
+        result, left = True, node.left
+        for op, right in zip(node.ops, node.comparators):
+            if isinstance(left, ast.Name) and left.id in CATEGORIES:
+                part = _compare_category(u, left.id, op, _literal(right))
+            elif isinstance(left, ast.Name) and left.id in TEXT_COLUMNS:
+                part = _compare_text(u, left.id, op, _literal(right))
+            elif type(op) in _COMPARE:
+                part = _COMPARE[type(op)](_eval_node(u, left), _eval_node(u, right))
+            else:
+                raise ValueError(f"不支援的比較：{ast.unparse(node)}")
+            result, left = np.logical_and(result, part), right
+        return result
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in ("abs", "isnull"):
+        value = _eval_node(u, node.args[0])
+        return np.abs(value) if node.func.id == "abs" else np.isnan(value)
+    raise ValueError(f"不支援的語法：{ast.unparse(node)}")
+
+
+# ======= 互動模式 =======
+
+def _print_result(df, elapsed_ms, total):
+    print(df.to_string(index=False, float_format=lambda x: f"{x:.2f}") if not df.empty else "（沒有符合的股票）")
+    print(f"🔎 {len(df)} / {total} 支，{elapsed_ms:.2f} ms")
+
+
+def _run(universe, where, rank, ascending, top):
+    started = time.perf_counter()
+    df = universe.screen(where, rank, ascending, top)
+    _print_result(df, (time.perf_counter() - started) * 1000, len(universe))
+
+
+def interactive(universe, rank=None, ascending=False, top=DEFAULT_TOP):
+    print("輸入篩選條件，例如：dividend_yield > 5 and revenue_yoy > 20 and industry == '半導體業'")
+    print("  :rank 欄位或算式（前面加 + 由小到大）  :top N  :refresh（重讀有變動的股票）  :columns  :quit")
+    while True:
+        try:
+            line = input("screen> ").strip()
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return
+        if not line:
+            continue
+        if line in (":q", ":quit", ":exit"):
+            return
+        try:
+            if line.startswith(":rank"):
+                rank = line[len(":rank"):].strip() or None
+                ascending = bool(rank) and rank.startswith("+")
+                rank = rank.lstrip("+").strip() if rank else None
+            elif line.startswith(":top"):
+                top = int(line[len(":top"):].strip() or 0) or None
+            elif line == ":refresh":
+                started = time.perf_counter()
+                changed = universe.refresh_if_changed()
+                print(f"🔄 {len(changed)} 支股票有新資料（{(time.perf_counter() - started) * 1000:.0f} ms）")
+            elif line == ":columns":
+                print(", ".join(universe.names))
+                for name, cats in universe.categories.items():
+                    print(f"  {name}: {', '.join(c for c in cats if c)}")
+            else:
+                _run(universe, line, rank, ascending, top)
+        except (ValueError, SyntaxError, TypeError) as ex:
+            print(f"❌ {ex}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="在記憶體裡篩選股票（各表最新一筆：殖利率、營收成長、ROE、技術指標...）")
+    parser.add_argument("where", nargs="?", help="篩選條件；不給就進互動模式")
+    parser.add_argument("--rank", help="排序用的欄位或算式（預設由大到小）")
+    parser.add_argument("--ascending", action="store_true", help="由小到大排序")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP, help="最多列出幾支（0 = 全部）")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    universe = Universe().load()
+    print(f"📦 載入 {len(universe)} 支股票、{len(universe.columns)} 個欄位"
+          f"（{(time.perf_counter() - started) * 1000:.0f} ms）")
+    try:
+        if args.where:
+            _run(universe, args.where, args.rank, args.ascending, args.top or None)
+        else:
+            interactive(universe, args.rank, args.ascending, args.top or None)
+    finally:
+        storage.close()
@@ -0,0 +1,134 @@
+import json
+
+from selenium.webdriver.common.by import By
+
+import circuit_breaker
+import clawer_dividend as cd
+import clawer_monthly_revenue as cmr
+import clawer_quarterly_balance as cqb
+import clawer_quarterly_income as cqi
+from driver_pool import borrow_driver, load_page
+from page_wait import click_and_wait_replaced
+import http_tables
+import perf
+import raw_cache
+import watermark
+
+# ======= 設定區 =======
+
+# cmoney 個股頁是單頁應用程式，各分頁（?s=dividend、?s=revenue...）共用同一個外框，
+# 點頁面上的連結只換掉內容區，不用整頁重新載入
+SECTION_LINK_CSS = 'a[href*="s={section}"]'
+# 切換分頁時會被換掉的內容區；等它被換掉代表新分頁開始畫了
+SECTION_PANEL_XPATH = '//*[@id="StockRevPanel"]/div[3]/div[2]/section'
+
+
+# 一支股票在 cmoney 上要抓的資料集：快取的 dataset / 期別、只用 HTTP 的抓法與它的快取內容、
+# 要去的分頁 (section, 網址, 讀表格的函式)，以及把各分頁讀到的內容組成快取內容
+# （兩種 pack 要和 clawer_* 存進快取的格式一樣）
+def _jobs(stock_no) -> list:
+    jobs = [{
+        "dataset": "dividend",
+        "page": "dividend",
+        "period": "latest",
+        "try_http": lambda: cd.try_dividend_html_http(stock_no),
+        "http_pack": lambda html: html,
+        "sections": [("dividend", cd.DIVIDEND_URL, cd.read_dividend_table)],
+        "pack": lambda results: results["dividend"],
+    }]
+
+    missing = watermark.missing_revenue_range(stock_no)
+    if missing is not None:
+        jobs.append({
+            "dataset": "monthly_revenue",
+            "page": "revenue",
+            "period": "%d%02d" % missing[1],
+            "try_http": lambda start=missing[0]: cmr.try_monthly_revenue_html_http(stock_no, start),
+            "http_pack": lambda html: html,
+            "sections": [("revenue", cmr.REVENUE_URL, cmr.read_monthly_revenue_table)],
+            "pack": lambda results: results["revenue"],
+        })
+
+    missing = watermark.missing_quarter_range("quarterly_balance", stock_no)
+    if missing is not None:
+        jobs.append({
+            "dataset": "quarterly_balance",
+            "page": "balance-sheet",
+            "period": "%dQ%d" % missing[1],
+            "try_http": lambda start=missing[0]: cqb.try_quarterly_balance_html_http(stock_no, start),
+            "http_pack": lambda tables: json.dumps(tables, ensure_ascii=False),
+            "sections": [("balance-sheet", cqb.BALANCE_URL, cqb.read_quarterly_balance_tables)],
+            "pack": lambda results: json.dumps(results["balance-sheet"], ensure_ascii=False),
+        })
+
+    missing = watermark.missing_quarter_range("quarterly_income", stock_no)
+    if missing is not None:
+        jobs.append({
+            "dataset": "quarterly_income",
+            "page": "income-statement",
+            "period": "%dQ%d" % missing[1],
+            "try_http": lambda start=missing[0]: cqi.try_quarterly_income_html_http(stock_no, start),
+            "http_pack": lambda tables: json.dumps(tables, ensure_ascii=False),
+            "sections": [
+                ("income-statement", cqi.INCOME_URL, cqi.read_income_table),
+                ("eps", cqi.EPS_URL, cqi.read_eps_table),
+            ],
+            "pack": lambda results: json.dumps(
+                {"income": results["income-statement"], "eps": results["eps"]}, ensure_ascii=False),
+        })
+    return jobs
+
+
+# 切到某個分頁：已經在個股頁上就點頁面裡的連結，找不到連結或內容沒換掉才整頁載入
+def open_section(driver, stock_no, section, url, first: bool):
+    if not first:
+        links = driver.find_elements(By.CSS_SELECTOR, SECTION_LINK_CSS.format(section=section))
+        if links and click_and_wait_replaced(driver, links[0], SECTION_PANEL_XPATH, section):
+            return
+    load_page(driver, url.format(stock_no=stock_no))
+
+
+# 一支股票的 cmoney 資料集一次抓完放進 raw_cache，之後 process_*_for_stock 直接讀快取：
+# 已在快取的跳過、HTTP 拿得到的不開瀏覽器，剩下的借一個 Chrome 載入一次個股頁，
+# 其他分頁用頁面內的連結切換；datasets 給了只抓這幾個資料集
+def prefetch_stock(stock_no, datasets=None):
+    pending = []
+    for job in _jobs(stock_no):
+        if datasets is not None and job["dataset"] not in datasets:
+            continue
+        # 頁面結構壞掉的資料集不開瀏覽器白等
+        if circuit_breaker.is_open(job["dataset"]):
+            continue
+        if raw_cache.get("cmoney", job["page"], stock_no, job["period"]) is not None:
+            continue
+        try:
+            with perf.stage("fetch"):
+                tables = job["try_http"]()
+            if tables is not None:
+                raw_cache.put("cmoney", job["page"], stock_no, job["period"], job["http_pack"](tables))
+                continue
+        except Exception as ex:
+            # HTTP 這條路失敗只影響這個資料集，照樣排進瀏覽器
+            print(f"⚠️ {stock_no} {job['page']} HTTP 抓取失敗，改用瀏覽器：{ex}")
+        pending.append(job)
+    if not pending:
+        return
+
+    with borrow_driver() as driver:
+        first = True
+        for job in pending:
+            try:
+                with perf.stage("fetch") as span:
+                    results = {}
+                    for section, url, read in job["sections"]:
+                        open_section(driver, stock_no, section, url, first)
+                        first = False
+                        results[section] = read(driver)
+                    payload = job["pack"](results)
+                    span.rows = len(results)
+                    http_tables.record_path(job["page"], "browser")
+                raw_cache.put("cmoney", job["page"], stock_no, job["period"], payload)
+            except Exception as ex:
+                # 這個資料集交給 process_*_for_stock 自己再抓一次
+                print(f"⚠️ {stock_no} {job['page']} 同一個瀏覽器抓取失敗，稍後單獨重抓：{ex}")
+                first = True
@@ -0,0 +1,453 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime
+
+import pandas as pd
+
+import db
+from db_writer import delete_keys, delete_keys_sqlite, insert_batched, replace_rows, upsert_merge, upsert_sqlite
+
+# ======= 設定區 =======
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SQLITE_TIMEOUT = 30   # 其他執行緒正在寫入時最多等幾秒
+
+# SQLite 沒有 dbo schema，表名去掉 "dbo." 前綴；欄位同 SQL Server 上的資料表
+SQLITE_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS stocks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        stock_no TEXT NOT NULL UNIQUE,
+        name TEXT,
+        market TEXT,
+        market_cap REAL,
+        industry TEXT,
+        is_active INTEGER
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_daily_quotes (
+        stock_id TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        last_price REAL,
+        open_price REAL,
+        high_price REAL,
+        low_price REAL,
+        prev_close REAL,
+        volume_lots INTEGER,
+        volume_shares INTEGER,
+        PRIMARY KEY (stock_id, trade_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_monthly_revenue (
+        stock_no TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        roc_year INTEGER,
+        revenue_current REAL,
+        revenue_prev_year_month REAL,
+        revenue_ytd REAL,
+        revenue_ytd_prev_year REAL,
+        PRIMARY KEY (stock_no, year, month)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_quarterly_balance (
+        stock_no TEXT NOT NULL,
+        fiscal_year INTEGER NOT NULL,
+        fiscal_quarter INTEGER NOT NULL,
+        roc_year INTEGER,
+        total_assets REAL,
+        total_equity REAL,
+        total_liabilities REAL,
+        PRIMARY KEY (stock_no, fiscal_year, fiscal_quarter)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_quarterly_income (
+        stock_no TEXT NOT NULL,
+        fiscal_year INTEGER NOT NULL,
+        fiscal_quarter INTEGER NOT NULL,
+        roc_year INTEGER,
+        revenue REAL,
+        gross_profit REAL,
+        operating_income REAL,
+        net_income REAL,
+        eps_basic REAL,
+        PRIMARY KEY (stock_no, fiscal_year, fiscal_quarter)
+    )
+    """,
+    # 除息日可能還沒公布（NULL），不能當 PRIMARY KEY，只建索引
+    """
+    CREATE TABLE IF NOT EXISTS stock_dividend (
+        stock_no TEXT NOT NULL,
+        cash_dividend REAL,
+        ex_dividend_date TEXT,
+        pay_date TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_stock_dividend_key ON stock_dividend (stock_no, ex_dividend_date)",
+    # 以下是從爬下來的資料算出來的表（indicators.py、fundamentals.py）
+    """
+    CREATE TABLE IF NOT EXISTS stock_daily_indicators (
+        stock_id TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        ma5 REAL, ma10 REAL, ma20 REAL, ma60 REAL,
+        bb_upper REAL, bb_lower REAL,
+        rsi14 REAL,
+        macd REAL, macd_signal REAL, macd_hist REAL,
+        atr14 REAL,
+        vol_ma5 REAL, vol_ma20 REAL,
+        PRIMARY KEY (stock_id, trade_date)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_indicator_state (
+        stock_id TEXT NOT NULL PRIMARY KEY,
+        trade_date TEXT NOT NULL,
+        n_obs INTEGER NOT NULL,
+        last_close REAL,
+        ema12 REAL, ema26 REAL, macd_signal REAL,
+        avg_gain REAL, avg_loss REAL,
+        atr14 REAL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_quarterly_ratios (
+        stock_no TEXT NOT NULL,
+        fiscal_year INTEGER NOT NULL,
+        fiscal_quarter INTEGER NOT NULL,
+        gross_margin REAL, operating_margin REAL, net_margin REAL,
+        debt_ratio REAL, roe_ttm REAL, eps_ttm REAL,
+        revenue_yoy REAL,
+        PRIMARY KEY (stock_no, fiscal_year, fiscal_quarter)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_monthly_revenue_growth (
+        stock_no TEXT NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        revenue_mom REAL, revenue_yoy REAL, revenue_ytd_yoy REAL,
+        PRIMARY KEY (stock_no, year, month)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stock_ratio_pending (
+        kind TEXT NOT NULL,
+        stock_no TEXT NOT NULL,
+        period INTEGER NOT NULL,
+        PRIMARY KEY (kind, stock_no, period)
+    )
+    """,
+]
+
+# SQL Server 上爬蟲資料表是事先建好的；算出來的表由程式自己建
+SQLSERVER_SCHEMA = [
+    """
+    IF OBJECT_ID('dbo.stock_daily_indicators', 'U') IS NULL
+    CREATE TABLE dbo.stock_daily_indicators (
+        stock_id NVARCHAR(10) NOT NULL,
+        trade_date DATE NOT NULL,
+        ma5 FLOAT NULL, ma10 FLOAT NULL, ma20 FLOAT NULL, ma60 FLOAT NULL,
+        bb_upper FLOAT NULL, bb_lower FLOAT NULL,
+        rsi14 FLOAT NULL,
+        macd FLOAT NULL, macd_signal FLOAT NULL, macd_hist FLOAT NULL,
+        atr14 FLOAT NULL,
+        vol_ma5 FLOAT NULL, vol_ma20 FLOAT NULL,
+        CONSTRAINT PK_stock_daily_indicators PRIMARY KEY (stock_id, trade_date)
+    )
+    """,
+    """
+    IF OBJECT_ID('dbo.stock_indicator_state', 'U') IS NULL
+    CREATE TABLE dbo.stock_indicator_state (
+        stock_id NVARCHAR(10) NOT NULL PRIMARY KEY,
+        trade_date DATE NOT NULL,
+        n_obs INT NOT NULL,
+        last_close FLOAT NULL,
+        ema12 FLOAT NULL, ema26 FLOAT NULL, macd_signal FLOAT NULL,
+        avg_gain FLOAT NULL, avg_loss FLOAT NULL,
+        atr14 FLOAT NULL
+    )
+    """,
+    """
+    IF OBJECT_ID('dbo.stock_quarterly_ratios', 'U') IS NULL
+    CREATE TABLE dbo.stock_quarterly_ratios (
+        stock_no NVARCHAR(10) NOT NULL,
+        fiscal_year INT NOT NULL,
+        fiscal_quarter INT NOT NULL,
+        gross_margin FLOAT NULL, operating_margin FLOAT NULL, net_margin FLOAT NULL,
+        debt_ratio FLOAT NULL, roe_ttm FLOAT NULL, eps_ttm FLOAT NULL,
+        revenue_yoy FLOAT NULL,
+        CONSTRAINT PK_stock_quarterly_ratios PRIMARY KEY (stock_no, fiscal_year, fiscal_quarter)
+    )
+    """,
+    """
+    IF OBJECT_ID('dbo.stock_monthly_revenue_growth', 'U') IS NULL
+    CREATE TABLE dbo.stock_monthly_revenue_growth (
+        stock_no NVARCHAR(10) NOT NULL,
+        year INT NOT NULL,
+        month INT NOT NULL,
+        revenue_mom FLOAT NULL, revenue_yoy FLOAT NULL, revenue_ytd_yoy FLOAT NULL,
+        CONSTRAINT PK_stock_monthly_revenue_growth PRIMARY KEY (stock_no, year, month)
+    )
+    """,
+    """
+    IF OBJECT_ID('dbo.stock_ratio_pending', 'U') IS NULL
+    CREATE TABLE dbo.stock_ratio_pending (
+        kind NVARCHAR(10) NOT NULL,
+        stock_no NVARCHAR(10) NOT NULL,
+        period INT NOT NULL,
+        CONSTRAINT PK_stock_ratio_pending PRIMARY KEY (kind, stock_no, period)
+    )
+    """,
+]
+
+# 各資料表的 key，搬資料（ship）時用；stocks 的 id 由目標資料庫自己編
+TABLE_KEYS = {
+    "dbo.stocks": ["stock_no"],
+    "dbo.stock_daily_quotes": ["stock_id", "trade_date"],
+    "dbo.stock_monthly_revenue": ["stock_no", "year", "month"],
+    "dbo.stock_quarterly_balance": ["stock_no", "fiscal_year", "fiscal_quarter"],
+    "dbo.stock_quarterly_income": ["stock_no", "fiscal_year", "fiscal_quarter"],
+    "dbo.stock_dividend": ["stock_no", "ex_dividend_date"],
+    "dbo.stock_daily_indicators": ["stock_id", "trade_date"],
+    "dbo.stock_indicator_state": ["stock_id"],
+    "dbo.stock_quarterly_ratios": ["stock_no", "fiscal_year", "fiscal_quarter"],
+    "dbo.stock_monthly_revenue_growth": ["stock_no", "year", "month"],
+    "dbo.stock_ratio_pending": ["kind", "stock_no", "period"],
+}
+
+# 日期存成 ISO 字串（Python 3.12 起不再有預設的 date adapter）
+sqlite3.register_adapter(date, date.isoformat)
+sqlite3.register_adapter(datetime, datetime.isoformat)
+
+
+def _sqlite_name(sql_or_table: str) -> str:
+    return re.sub(r"\bdbo\.", "", sql_or_table)
+
+
+# ======= SQL Server（原本的做法：db 連線池 + 暫存表 MERGE） =======
+
+class SqlServerBackend:
+    name = "sqlserver"
+
+    def upsert(self, table, columns, key_columns, rows):
+        with db.get_connection() as conn:
+            return upsert_merge(conn, table, columns, key_columns, rows)
+
+    def insert(self, table, columns, rows, on_row_error):
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        with db.get_connection() as conn:
+            return insert_batched(conn, sql, rows, on_row_error)
+
+    def replace(self, table, columns, match, rows):
+        with db.get_connection() as conn:
+            return replace_rows(conn, table, columns, match, rows)
+
+    def delete(self, table, key_columns, keys):
+        with db.get_connection() as conn:
+            return delete_keys(conn, table, key_columns, keys)
+
+    def read_sql(self, sql) -> pd.DataFrame:
+        return pd.read_sql(sql, db.get_engine())
+
+    def has_table(self, name) -> bool:
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM INFORMATION_SCHEMA.TABLES WHERE TABLE_NAME = ?", name)
+            result = cursor.fetchone()
+            cursor.close()
+        return result[0] > 0
+
+    def create_tables(self):
+        with db.get_connection() as conn:
+            cursor = conn.cursor()
+            for ddl in SQLSERVER_SCHEMA:
+                cursor.execute(ddl)
+            conn.commit()
+            cursor.close()
+
+    def print_metrics(self):
+        db.print_pool_metrics()
+
+    def close(self):
+        db.dispose()
+
+
+# ======= SQLite（本機單一檔案，每個執行緒一條連線） =======
+
+class SqliteBackend:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path if os.path.isabs(path) or path == ":memory:" else os.path.join(BASE_DIR, path)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # 每個執行緒各用各的；check_same_thread=False 只是讓 close() 能從主執行緒關掉全部
+            conn = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, check_same_thread=False)
+            # WAL：寫入時其他執行緒還能讀；synchronous=NORMAL 在 WAL 下仍不會損毀資料
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for ddl in SQLITE_SCHEMA:
+                conn.execute(ddl)
+            conn.commit()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def upsert(self, table, columns, key_columns, rows):
+        return upsert_sqlite(self.connect(), _sqlite_name(table), columns, key_columns, rows)
+
+    def insert(self, table, columns, rows, on_row_error):
+        sql = (f"INSERT INTO {_sqlite_name(table)} ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        return insert_batched(self.connect(), sql, rows, on_row_error)
+
+    def replace(self, table, columns, match, rows):
+        return replace_rows(self.connect(), _sqlite_name(table), columns, match, rows)
+
+    def delete(self, table, key_columns, keys):
+        return delete_keys_sqlite(self.connect(), _sqlite_name(table), key_columns, keys)
+
+    def read_sql(self, sql) -> pd.DataFrame:
+        return pd.read_sql(_sqlite_name(sql), self.connect())
+
+    def has_table(self, name) -> bool:
+        row = self.connect().execute(
+            "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?", (_sqlite_name(name),)
+        ).fetchone()
+        return row[0] > 0
+
+    # SQLITE_SCHEMA 在連線時就建好了
+    def create_tables(self):
+        self.connect()
+
+    def print_metrics(self):
+        print(f"🗄️ 本機資料庫：{self.path}")
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+
+# ======= 目前使用的 backend =======
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(name=None, path=None):
+    settings = db.load_settings()
+    name = name or settings["Backend"]
+    if name == "sqlserver":
+        return SqlServerBackend()
+    if name == "sqlite":
+        return SqliteBackend(path or settings["SqlitePath"])
+    raise ValueError(f"不支援的資料庫 backend：{name}")
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
+
+
+# 執行前切換 backend，例如 configure("sqlite", "worker1.sqlite3")
+def configure(name=None, path=None):
+    global _backend
+    with _backend_lock:
+        old, _backend = _backend, create_backend(name, path)
+    if old is not None:
+        old.close()
+    return _backend
+
+
+def upsert(table, columns, key_columns, rows):
+    return get_backend().upsert(table, columns, key_columns, rows)
+
+
+def insert(table, columns, rows, on_row_error):
+    return get_backend().insert(table, columns, rows, on_row_error)
+
+
+# 刪掉符合 match 的資料後寫入 rows（同一個 transaction），回傳 (寫入筆數, 刪除筆數)
+def replace(table, columns, match, rows):
+    return get_backend().replace(table, columns, match, rows)
+
+
+# 刪掉 key 在 keys 裡的資料（一次整批），回傳刪除筆數
+def delete(table, key_columns, keys):
+    return get_backend().delete(table, key_columns, keys)
+
+
+def read_sql(sql) -> pd.DataFrame:
+    return get_backend().read_sql(sql)
+
+
+def has_table(name) -> bool:
+    return get_backend().has_table(name)
+
+
+# 建立程式自己算出來的資料表（不存在才建）
+def create_tables():
+    get_backend().create_tables()
+
+
+def print_metrics():
+    get_backend().print_metrics()
+
+
+def close():
+    global _backend
+    with _backend_lock:
+        backend, _backend = _backend, None
+    if backend is not None:
+        backend.close()
+
+
+# 把本機 SQLite 檔的資料搬到目前的 backend（例如爬蟲機先寫本機，之後再匯進 SQL Server）
+def ship(sqlite_path, batch_size=10_000):
+    source = SqliteBackend(sqlite_path)
+    target = get_backend()
+    target.create_tables()
+    try:
+        for table, keys in TABLE_KEYS.items():
+            df = source.read_sql(f"SELECT * FROM {table}").drop(columns=["id"], errors="ignore")
+            if df.empty:
+                continue
+            columns = list(df.columns)
+            df = df.astype(object).where(df.notna(), None)
+            rows = list(df.itertuples(index=False, name=None))
+            # key 有 NULL 的（例如還沒公布除息日的股利）不能 MERGE，跟寫入時一樣按其他 key 整組取代
+            key_idx = [columns.index(k) for k in keys]
+            keyed, groups = [], {}
+            for r in rows:
+                if all(r[i] is not None for i in key_idx):
+                    keyed.append(r)
+                else:
+                    groups.setdefault(tuple((k, r[i]) for k, i in zip(keys, key_idx)), []).append(r)
+            inserted = updated = 0
+            for start in range(0, len(keyed), batch_size):
+                i, u = target.upsert(table, columns, keys, keyed[start:start + batch_size])
+                inserted, updated = inserted + i, updated + u
+            for match, group in groups.items():
+                written, deleted = target.replace(table, columns, dict(match), group)
+                inserted, updated = inserted + max(written - deleted, 0), updated + min(written, deleted)
+            print(f"✅ {table}：{len(rows)} 筆（新增 {inserted}、更新 {updated}）")
+    finally:
+        source.close()
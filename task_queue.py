@@ -0,0 +1,221 @@
+import os
+import sqlite3
+import threading
+import time
+
+import scheduler
+import watermark
+
+# ======= 設定區 =======
+
+QUEUE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "task_queue.sqlite3")
+MAX_ATTEMPTS = 3          # 失敗幾次後不再自動重試（status = dead）
+RETRY_BASE_SECONDS = 30   # 第 n 次失敗後等 RETRY_BASE_SECONDS * 2^(n-1) 秒再重試
+RETRY_MAX_SECONDS = 30 * 60
+MAX_IDLE_WAIT = 5         # 只剩等待重試的工作時，worker 每次最多睡幾秒再看一次
+
+# 每個資料集這次執行的目標期別；期別變了（新的交易日、月份、季別）就是新的工作，
+# 同一個期別已經完成的工作重跑時會跳過
+TASK_PERIODS = {
+    "dividend": scheduler.dividend_period,
+    "monthly_revenue": lambda: "%d%02d" % watermark.latest_revenue_month(),
+    "daily_quotes": lambda: watermark.latest_trade_date().isoformat(),
+    "quarterly_balance": lambda: "%dQ%d" % watermark.latest_quarter(),
+    "quarterly_income": lambda: "%dQ%d" % watermark.latest_quarter(),
+}
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tasks (
+        stock_no TEXT NOT NULL,
+        dataset TEXT NOT NULL,
+        period TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        next_attempt_at REAL NOT NULL DEFAULT 0,
+        updated_at REAL,
+        PRIMARY KEY (stock_no, dataset, period)
+    )
+"""
+
+_conn = None
+_lock = threading.Lock()
+
+
+# run(tasks) 回傳這個表示「這次不跑」（例如 circuit breaker 跳開），不算失敗次數，下次執行再排
+class Skip:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+# 開啟（或建立）佇列檔；所有執行緒共用一條連線，操作都在 _lock 裡
+def configure(path=None):
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+        _conn = sqlite3.connect(path or QUEUE_PATH, timeout=30, check_same_thread=False,
+                                isolation_level=None)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(SCHEMA)
+        _conn.execute("CREATE INDEX IF NOT EXISTS ix_tasks_status ON tasks (status, next_attempt_at, seq)")
+
+
+def _connection():
+    if _conn is None:
+        configure()
+    return _conn
+
+
+def close():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+# 把這次要跑的 (股票, 資料集) 配上期別放進佇列；已經有的（含已完成的）不動
+# 上次執行被中斷、還停在 running 的工作，以及上次略過（skipped）的工作放回 pending
+def enqueue(pairs) -> int:
+    periods = {}
+    rows = []
+    for seq, (stock_no, name) in enumerate(pairs):
+        if name not in periods:
+            periods[name] = TASK_PERIODS[name]()
+        rows.append((str(stock_no), name, periods[name], seq))
+    conn = _connection()
+    with _lock:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE tasks SET status = 'pending' WHERE status IN ('running', 'skipped')")
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO tasks (stock_no, dataset, period, seq) VALUES (?, ?, ?, ?)", rows)
+        added = conn.total_changes - before
+        conn.execute("COMMIT")
+    return added
+
+
+# 領工作：by_stock=False 一次領一個，True 一次領同一支股票所有可以跑的工作
+# 回傳 [(stock_no, dataset, period, attempts), ...]，沒有可以跑的回傳 []
+def claim(by_stock=False) -> list:
+    conn = _connection()
+    now = time.time()
+    with _lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            first = conn.execute(
+                "SELECT stock_no FROM tasks WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY seq LIMIT 1", (now,)).fetchone()
+            if first is None:
+                conn.execute("COMMIT")
+                return []
+            sql = ("SELECT stock_no, dataset, period, attempts FROM tasks "
+                   "WHERE status = 'pending' AND next_attempt_at <= ? AND stock_no = ? ORDER BY seq")
+            tasks = conn.execute(sql if by_stock else sql + " LIMIT 1", (now, first[0])).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET status = 'running', updated_at = ? "
+                "WHERE stock_no = ? AND dataset = ? AND period = ?",
+                [(now, t[0], t[1], t[2]) for t in tasks])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    return tasks
+
+
+def complete(stock_no, dataset, period):
+    conn = _connection()
+    with _lock:
+        conn.execute(
+            "UPDATE tasks SET status = 'done', last_error = NULL, updated_at = ? "
+            "WHERE stock_no = ? AND dataset = ? AND period = ?",
+            (time.time(), str(stock_no), dataset, period))
+
+
+def skip(stock_no, dataset, period, reason):
+    conn = _connection()
+    with _lock:
+        conn.execute(
+            "UPDATE tasks SET status = 'skipped', last_error = ?, updated_at = ? "
+            "WHERE stock_no = ? AND dataset = ? AND period = ?",
+            (reason, time.time(), str(stock_no), dataset, period))
+
+
+# 失敗：次數加一，排到退避時間之後再跑；超過 MAX_ATTEMPTS 次就標成 dead
+def fail(stock_no, dataset, period, error):
+    now = time.time()
+    conn = _connection()
+    with _lock:
+        row = conn.execute("SELECT attempts FROM tasks WHERE stock_no = ? AND dataset = ? AND period = ?",
+                           (str(stock_no), dataset, period)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+        status = "dead" if attempts >= MAX_ATTEMPTS else "pending"
+        conn.execute(
+            "UPDATE tasks SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, updated_at = ? "
+            "WHERE stock_no = ? AND dataset = ? AND period = ?",
+            (status, attempts, str(error)[:1000], now + delay, now, str(stock_no), dataset, period))
+
+
+# 還有沒跑完的工作時回傳最早可以領的秒數（0 = 現在就有），全部結束回傳 None
+def next_ready_in():
+    conn = _connection()
+    with _lock:
+        row = conn.execute(
+            "SELECT MIN(next_attempt_at) FROM tasks WHERE status = 'pending'").fetchone()
+    if row[0] is None:
+        return None
+    return max(0.0, row[0] - time.time())
+
+
+# 已經放棄（dead）的工作放回佇列，重新計算次數
+def retry_dead() -> int:
+    conn = _connection()
+    with _lock:
+        cur = conn.execute(
+            "UPDATE tasks SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'dead'")
+    return cur.rowcount
+
+
+# 一直領工作來跑，直到佇列裡沒有 pending；run(tasks) 回傳每個工作的錯誤訊息（None = 成功、Skip = 略過）
+def work(run, by_stock=False):
+    while True:
+        tasks = claim(by_stock)
+        if not tasks:
+            wait = next_ready_in()
+            if wait is None:
+                return
+            time.sleep(min(max(wait, 0.1), MAX_IDLE_WAIT))
+            continue
+        errors = run(tasks)
+        for (stock_no, dataset, period, _), error in zip(tasks, errors):
+            if error is None:
+                complete(stock_no, dataset, period)
+            elif isinstance(error, Skip):
+                skip(stock_no, dataset, period, error.reason)
+            else:
+                fail(stock_no, dataset, period, error)
+
+
+def summary() -> dict:
+    conn = _connection()
+    with _lock:
+        rows = conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+    return dict(rows)
+
+
+def print_summary(limit=10):
+    counts = summary()
+    if not counts:
+        return
+    print("📋 工作佇列：" + "、".join(f"{k} {v}" for k, v in sorted(counts.items())))
+    conn = _connection()
+    with _lock:
+        failed = conn.execute(
+            "SELECT stock_no, dataset, period, attempts, last_error FROM tasks "
+            "WHERE last_error IS NOT NULL AND status NOT IN ('done', 'skipped') ORDER BY attempts DESC, seq LIMIT ?",
+            (limit,)).fetchall()
+    for stock_no, dataset, period, attempts, error in failed:
+        print(f"  ❌ {stock_no} {dataset} {period}（第 {attempts} 次）：{error}")
@@ -0,0 +1,83 @@
+import json
+import os
+from datetime import date
+
+import pandas as pd
+
+import clawer_daily_quotes as cdq
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "bench_fixtures", "twse_stock_day_2330_202509.json")
+
+# TWSE 實際會出現的格式：千分位、空白、停牌的 "--"、註記的 X 前綴
+INT_CELLS = ["0", "", " 12,345,678 ", "1000", "999", "1.9"]
+FLOAT_CELLS = ["", "X0.00", "--", "1,050.00", " 12.5 ", "X12.50", "0.00", "-3.5"]
+
+
+# ======= 原本逐格 apply 的版本（對照組） =======
+
+def _roc_str_to_date(roc_str):
+    y, m, d = str(roc_str).strip().split("/")
+    return date(int(y) + 1911, int(m), int(d))
+
+
+def _to_int(s):
+    s = str(s).replace(",", "").strip()
+    if s == "" or s == "0":
+        return 0
+    return int(float(s))
+
+
+def _to_float(s):
+    s = str(s).replace(",", "").strip()
+    if s in ("", "X0.00", "--"):
+        return 0.0
+    s = s.replace("X", "")
+    return float(s)
+
+
+def _transform_rowwise(json_data):
+    raw = pd.DataFrame(json_data["data"], columns=json_data["fields"])
+    raw = raw.rename(columns={
+        "日期": "date_roc", "成交股數": "volume_shares", "開盤價": "open_price", "最高價": "high_price",
+        "最低價": "low_price", "收盤價": "last_price", "漲跌價差": "change_price",
+    })
+    raw["trade_date"] = raw["date_roc"].apply(_roc_str_to_date)
+    raw["volume_shares"] = raw["volume_shares"].apply(_to_int)
+    for col in ["open_price", "high_price", "low_price", "last_price", "change_price"]:
+        raw[col] = raw[col].apply(_to_float)
+    raw["prev_close"] = raw.apply(lambda row: row["last_price"] - row["change_price"], axis=1)
+    raw["volume_lots"] = (raw["volume_shares"] // 1000).astype(int)
+    return raw[["trade_date", "last_price", "open_price", "high_price", "low_price",
+                "prev_close", "volume_lots", "volume_shares"]].copy()
+
+
+# ======= 整欄版本要跟逐格版本一樣 =======
+
+def test_clean_int_col_matches_rowwise():
+    col = pd.Series(INT_CELLS)
+    assert cdq.clean_int_col(col).tolist() == [_to_int(s) for s in INT_CELLS]
+
+
+# 唯一刻意的差異：個股的 "--" 以前丟例外，現在跟全市場一樣當 0
+def test_clean_int_col_maps_dashes_to_zero():
+    assert cdq.clean_int_col(pd.Series(["--", "1,000"])).tolist() == [0, 1000]
+
+
+def test_clean_float_col_matches_rowwise():
+    col = pd.Series(FLOAT_CELLS)
+    assert cdq.clean_float_col(col).tolist() == [_to_float(s) for s in FLOAT_CELLS]
+
+
+def test_roc_col_to_date_matches_rowwise():
+    cells = ["114/11/03", " 113/02/29 ", "100/01/01"]
+    assert cdq.roc_col_to_date(pd.Series(cells)).tolist() == [_roc_str_to_date(s) for s in cells]
+    assert cdq.roc_col_to_date(pd.Series([], dtype=object)).empty
+
+
+def test_transform_matches_rowwise_on_fixture():
+    with open(FIXTURE, encoding="utf-8") as f:
+        json_data = json.load(f)
+    expected = _transform_rowwise(json_data)
+    actual = cdq.transform_twse_stock_day_json(json_data)
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True),
+                                  check_dtype=False)
@@ -0,0 +1,71 @@
+import requests
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+
+import circuit_breaker
+import host_limit
+
+
+# 同一個例外不能同時「降速」又「算頁面結構錯誤」
+def _classify(ex):
+    return host_limit.is_throttled(ex), circuit_breaker.is_structural(ex)
+
+
+# 等不到元素（page_wait.wait_for_element）：頁面結構問題，不降速
+def test_element_wait_timeout_is_structural_only():
+    assert _classify(TimeoutException("dividend 等待 load 逾時")) == (False, True)
+    assert _classify(NoSuchElementException("no table")) == (False, True)
+
+
+# 整頁載入逾時（driver_pool 轉成 Throttled）、HTTP 限流：降速，不算結構錯誤
+def test_page_load_timeout_is_throttling_only():
+    try:
+        try:
+            raise TimeoutException("page load")
+        except TimeoutException as ex:
+            raise host_limit.Throttled("載入逾時") from ex
+    except host_limit.Throttled as ex:
+        assert _classify(ex) == (True, False)
+    assert _classify(requests.Timeout()) == (True, False)
+    assert _classify(requests.ConnectionError()) == (True, False)
+
+
+def test_wait_for_element_does_not_penalize_rate(monkeypatch):
+    import page_wait
+
+    class Driver:
+        current_url = "https://www.cmoney.tw/forum/stock/2330?s=dividend"
+
+        def find_element(self, by, xpath):
+            raise NoSuchElementException(xpath)
+
+    monkeypatch.setattr(page_wait, "page_timeout", lambda page: 0.01)
+    bucket = host_limit._bucket("www.cmoney.tw")
+    rate = bucket.rate
+    try:
+        page_wait.wait_for_element(Driver(), "//table", "dividend")
+    except TimeoutException as ex:
+        assert _classify(ex) == (False, True)
+    else:
+        raise AssertionError("應該逾時")
+    assert bucket.rate == rate
+
+
+def test_page_load_timeout_penalizes_rate(monkeypatch):
+    import driver_pool
+
+    class Driver:
+        def get(self, url):
+            raise TimeoutException("page load")
+
+    monkeypatch.setattr(host_limit, "_wait_token", lambda url: None)
+    url = "https://slow.example.com/page"
+    bucket = host_limit._bucket("slow.example.com")
+    rate = bucket.rate
+    pool = driver_pool.DriverPool()
+    try:
+        pool.get(Driver(), url)
+    except host_limit.Throttled as ex:
+        assert _classify(ex) == (True, False)
+    else:
+        raise AssertionError("應該丟 Throttled")
+    assert bucket.rate < rate
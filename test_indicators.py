@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+import storage
+
+QUOTE_COLUMNS = ["stock_id", "trade_date", "last_price", "high_price", "low_price", "volume_lots"]
+
+
+def _quotes(stock_id, days, seed):
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 1.5, days))
+    return pd.DataFrame({
+        "stock_id": stock_id,
+        "trade_date": pd.bdate_range("2024-01-01", periods=days),
+        "last_price": close.round(2),
+        "high_price": (close + rng.uniform(0, 2, days)).round(2),
+        "low_price": (close - rng.uniform(0, 2, days)).round(2),
+        "volume_lots": rng.integers(1_000, 5_000, days).astype(float),
+    })
+
+
+def _compute_full(df):
+    rows = indicators._normalize(df.copy())
+    rows["is_new"] = True
+    result, _ = indicators.compute(rows, pd.DataFrame(columns=indicators.STATE_COLUMNS))
+    return result.set_index("trade_date")
+
+
+# 停牌日（清洗後價格是 0）不能被當成收盤價 0 算進指標
+def test_suspended_day_is_skipped():
+    df = _quotes("2330", 60, seed=1)
+    suspended = df["trade_date"].iloc[40]
+    halted = df.copy()
+    halted.loc[40, ["last_price", "high_price", "low_price"]] = 0.0
+    halted.loc[40, "volume_lots"] = 0.0
+
+    result = _compute_full(halted)
+    skipped = _compute_full(df.drop(index=40).reset_index(drop=True))
+
+    # 停牌當天沒有遞迴指標；之後的 RSI / MACD / ATR 跟那天不存在一樣
+    recursive = ["rsi14", "macd", "macd_signal", "macd_hist", "atr14"]
+    assert result.loc[suspended, recursive].isna().all()
+    after = result.index[result.index > suspended]
+    pd.testing.assert_frame_equal(result.loc[after, recursive], skipped.loc[after, recursive])
+
+    # 移動平均裡不會出現 0 收盤價：含停牌日的視窗留空
+    assert result.loc[after[:4], "ma5"].isna().all()
+    assert (result["ma5"].dropna() > 50).all()
+    assert (result["bb_lower"].dropna() > 0).all()
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage.configure("sqlite", str(tmp_path / "stock.db"))
+    storage.create_tables()
+    yield
+    storage.close()
+
+
+def _write_quotes(df):
+    rows = list(df[QUOTE_COLUMNS].assign(trade_date=df["trade_date"].dt.date).itertuples(index=False, name=None))
+    storage.upsert("dbo.stock_daily_quotes", QUOTE_COLUMNS, ["stock_id", "trade_date"], rows)
+
+
+def _read_indicators():
+    df = storage.read_sql(f"SELECT {', '.join(indicators.INDICATOR_COLUMNS)} FROM {indicators.INDICATOR_TABLE}")
+    df["trade_date"] = pd.to_datetime(df["trade_date"])
+    return df.sort_values(["stock_id", "trade_date"]).reset_index(drop=True)
+
+
+# 分兩次增量算（接 state + 回看 LOOKBACK 筆）要跟整段重算的結果一樣
+def test_incremental_equals_full(sqlite_storage):
+    quotes = pd.concat([_quotes("1101", 90, seed=2), _quotes("2330", 90, seed=3)], ignore_index=True)
+    quotes.loc[quotes.index[70], ["last_price", "high_price", "low_price"]] = 0.0
+    # 2603 第二批才上市，增量時還沒有 state
+    late = _quotes("2603", 30, seed=4)
+    late["trade_date"] = pd.bdate_range("2024-03-01", periods=30)
+    cut = pd.Timestamp("2024-03-15")
+
+    _write_quotes(quotes[quotes["trade_date"] <= cut])
+    indicators.update()
+    _write_quotes(quotes[quotes["trade_date"] > cut])
+    _write_quotes(late)
+    indicators.update()
+    incremental = _read_indicators()
+
+    indicators.update(full=True)
+    full = _read_indicators()
+
+    assert len(incremental) == len(quotes) + len(late)
+    pd.testing.assert_frame_equal(incremental, full, check_exact=False, rtol=1e-9)
@@ -0,0 +1,192 @@
+import threading
+from datetime import date, datetime, time, timedelta
+
+import pandas as pd
+
+import market_calendar
+import storage
+
+# ======= 設定區 =======
+
+# 資料庫還沒有資料時的起點（同原本寫死的範圍）
+DAILY_DEFAULT_MONTHS = 3            # 日成交：最近三個月
+MONTHLY_DEFAULT_START = (2022, 9)   # 月營收：2022/09 起
+QUARTERLY_DEFAULT_START = (2022, 1) # 季報：2022 年起
+DIVIDEND_DEFAULT_YEAR = 2020        # 股利：2020 年起
+
+MARKET_CLOSE = time(14, 30)         # 收盤行情大約這個時間後才會有
+MONTHLY_REVENUE_DEADLINE_DAY = 10   # 月營收：次月 10 日前公布
+# 季報公布期限：(季別, 期限月, 期限日, 期限年相對季報年度的位移)
+QUARTERLY_DEADLINES = [
+    (1, 5, 15, 0),
+    (2, 8, 14, 0),
+    (3, 11, 14, 0),
+    (4, 3, 31, 1),
+]
+
+# 每個資料集的高水位查詢：回傳 (stock_no, watermark 欄位...)
+WATERMARK_SQL = {
+    "daily_quotes": "SELECT stock_id AS stock_no, MAX(trade_date) AS wm FROM dbo.stock_daily_quotes GROUP BY stock_id",
+    "monthly_revenue": """
+        SELECT stock_no, MAX(year * 100 + month) AS wm
+        FROM dbo.stock_monthly_revenue GROUP BY stock_no
+    """,
+    "quarterly_balance": """
+        SELECT stock_no, MAX(fiscal_year * 10 + fiscal_quarter) AS wm
+        FROM dbo.stock_quarterly_balance GROUP BY stock_no
+    """,
+    "quarterly_income": """
+        SELECT stock_no, MAX(fiscal_year * 10 + fiscal_quarter) AS wm
+        FROM dbo.stock_quarterly_income GROUP BY stock_no
+    """,
+    "dividend": "SELECT stock_no, MAX(ex_dividend_date) AS wm FROM dbo.stock_dividend GROUP BY stock_no",
+}
+
+_cache = {}
+_lock = threading.Lock()
+
+
+# ======= 讀高水位（每個資料集每次執行只查一次，整個 universe 一起） =======
+
+def _load(dataset: str) -> dict:
+    with _lock:
+        if dataset not in _cache:
+            df = storage.read_sql(WATERMARK_SQL[dataset])
+            _cache[dataset] = {
+                str(row.stock_no).strip(): row.wm
+                for row in df.itertuples(index=False)
+                if pd.notna(row.wm)
+            }
+        return _cache[dataset]
+
+
+# 寫入新資料後更新記憶體中的高水位
+def advance(dataset: str, stock_no: str, value):
+    with _lock:
+        marks = _cache.setdefault(dataset, {})
+        if value is not None and (stock_no not in marks or value > marks[stock_no]):
+            marks[stock_no] = value
+
+
+def reset():
+    with _lock:
+        _cache.clear()
+
+
+def _to_date(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return pd.Timestamp(value).date()
+
+
+def daily_watermark(stock_no: str):
+    return _to_date(_load("daily_quotes").get(stock_no))
+
+
+def monthly_watermark(stock_no: str):
+    wm = _load("monthly_revenue").get(stock_no)
+    return None if wm is None else (int(wm) // 100, int(wm) % 100)
+
+
+def quarterly_watermark(dataset: str, stock_no: str):
+    wm = _load(dataset).get(stock_no)
+    return None if wm is None else (int(wm) // 10, int(wm) % 10)
+
+
+def dividend_watermark(stock_no: str):
+    return _to_date(_load("dividend").get(stock_no))
+
+
+# ======= 目前「應該已經公布」的最新期別 =======
+
+def latest_trade_date(now: datetime = None) -> date:
+    now = now or datetime.now()
+    d = now.date()
+    if now.time() < MARKET_CLOSE:
+        d -= timedelta(days=1)
+    # 跳過週末與 TWSE 公布的休市日
+    return market_calendar.previous_trading_day(d)
+
+
+def latest_revenue_month(today: date = None):
+    today = today or date.today()
+    # 上個月的營收要到這個月 10 日後才確定都公布
+    back = 1 if today.day > MONTHLY_REVENUE_DEADLINE_DAY else 2
+    y, m = today.year, today.month - back
+    while m <= 0:
+        y, m = y - 1, m + 12
+    return y, m
+
+
+def latest_quarter(today: date = None):
+    today = today or date.today()
+    latest = (today.year - 2, 4)
+    for year in (today.year - 1, today.year):
+        for quarter, month, day, year_offset in QUARTERLY_DEADLINES:
+            if today > date(year + year_offset, month, day):
+                latest = max(latest, (year, quarter))
+    return latest
+
+
+# ======= 缺少的期別 =======
+
+def next_month(ym):
+    y, m = ym
+    return (y + 1, 1) if m == 12 else (y, m + 1)
+
+
+def next_quarter(yq):
+    y, q = yq
+    return (y + 1, 1) if q == 4 else (y, q + 1)
+
+
+# 日成交第一個缺的日期，已經最新回傳 None
+def first_missing_trade_date(stock_no: str):
+    latest = latest_trade_date()
+    wm = daily_watermark(stock_no)
+    if wm is not None and wm >= latest:
+        return None
+    if wm is not None:
+        return wm + timedelta(days=1)
+    y, m = latest.year, latest.month
+    for _ in range(DAILY_DEFAULT_MONTHS - 1):
+        y, m = (y - 1, 12) if m == 1 else (y, m - 1)
+    return date(y, m, 1)
+
+
+# 日成交要抓的月份（YYYYMM01），已經最新就回傳空 list
+def missing_daily_months(stock_no: str) -> list:
+    first = first_missing_trade_date(stock_no)
+    if first is None:
+        return []
+    latest = latest_trade_date()
+    months = []
+    ym = (first.year, first.month)
+    while ym <= (latest.year, latest.month):
+        months.append(f"{ym[0]}{ym[1]:02d}01")
+        ym = next_month(ym)
+    return months
+
+
+# 月營收：回傳 (起, 訖) 月份（含），已經最新回傳 None
+def missing_revenue_range(stock_no: str):
+    latest = latest_revenue_month()
+    wm = monthly_watermark(stock_no)
+    if wm is not None and wm >= latest:
+        return None
+    start = MONTHLY_DEFAULT_START if wm is None else next_month(wm)
+    return start, latest
+
+
+# 季報：回傳 (起, 訖) 季別（含），已經最新回傳 None
+def missing_quarter_range(dataset: str, stock_no: str):
+    latest = latest_quarter()
+    wm = quarterly_watermark(dataset, stock_no)
+    if wm is not None and wm >= latest:
+        return None
+    start = QUARTERLY_DEFAULT_START if wm is None else next_quarter(wm)
+    return start, latest